@@ -0,0 +1,12 @@
+-- Idempotency keys of kiosk scans sent through /api/checkin/batch; a replayed key returns the stored result
+create table if not exists public.checkin_scans (
+  device_id text not null,
+  idempotency_key text not null,
+  status text not null default 'pending',
+  member_id bigint,
+  check_in_id bigint,
+  scanned_at timestamptz,
+  received_at timestamptz default now(),
+  primary key (device_id, idempotency_key)
+);
+create index if not exists idx_checkin_scans_received on public.checkin_scans(received_at);
@@ -0,0 +1,21 @@
+-- Bulk QR email campaigns (see src/campaigns.py); their messages are tagged in outbound_emails
+create table if not exists public.email_campaigns (
+  id bigserial primary key,
+  segment text not null,
+  tier text,
+  since text,
+  base_url text not null,
+  status text not null default 'pending' check (status in ('pending','running','paused','done','cancelled','failed')),
+  total integer not null default 0,
+  enqueued integer not null default 0,
+  max_member_id bigint not null,
+  cursor_member_id bigint not null default 0,
+  heartbeat_at double precision,
+  last_error text,
+  created_at timestamptz default now(),
+  finished_at timestamptz
+);
+
+alter table public.outbound_emails
+  add column if not exists campaign_id bigint references public.email_campaigns(id);
+create index if not exists idx_outbound_emails_campaign on public.outbound_emails(campaign_id, status) where campaign_id is not null;
@@ -0,0 +1,4 @@
+-- Kiosk scans look members up by qr_token; only the partial "qr_token is null" index existed.
+
+create index if not exists idx_members_qr_token
+  on public.members(qr_token);
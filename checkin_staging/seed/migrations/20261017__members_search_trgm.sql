@@ -0,0 +1,13 @@
+-- Member search (/api/members/search, /api/kiosk/suggest) matches substrings with ILIKE '%q%'.
+-- Trigram GIN indexes let those predicates use an index instead of scanning members per keystroke.
+
+create extension if not exists pg_trgm;
+
+create index if not exists idx_members_name_trgm
+  on public.members using gin (name gin_trgm_ops);
+
+create index if not exists idx_members_email_trgm
+  on public.members using gin (email_lower gin_trgm_ops);
+
+create index if not exists idx_members_phone_trgm
+  on public.members using gin (phone_e164 gin_trgm_ops);
@@ -0,0 +1,10 @@
+-- Admin member list orders by last name, then full name, and pages with a (sort_key, id) cursor.
+-- Storing the key (instead of computing regexp_replace per row per request) lets the index serve
+-- both the ORDER BY and the cursor predicate.
+
+alter table public.members
+  add column if not exists sort_key text
+  generated always as (lower(regexp_replace(btrim(name), '^.*\s+', '')) || ' ' || lower(btrim(name))) stored;
+
+create index if not exists idx_members_sort_key
+  on public.members(sort_key, id);
@@ -0,0 +1,14 @@
+-- Durable outbound email queue drained by the app's mail worker (see src/mail_queue.py)
+create table if not exists public.outbound_emails (
+  id bigserial primary key,
+  to_email text not null,
+  subject text,
+  message bytea not null,
+  status text not null default 'pending' check (status in ('pending','sent','failed')),
+  attempts integer not null default 0,
+  available_at double precision not null,
+  last_error text,
+  created_at timestamptz default now(),
+  sent_at timestamptz
+);
+create index if not exists idx_outbound_emails_due on public.outbound_emails(available_at, id) where status = 'pending';
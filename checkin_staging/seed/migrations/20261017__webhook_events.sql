@@ -0,0 +1,17 @@
+-- Inbox of verified provider webhooks (Stripe), processed by the app's inbox worker (see src/webhook_inbox.py)
+create table if not exists public.webhook_events (
+  id bigserial primary key,
+  provider text not null,
+  event_id text not null,
+  event_type text not null,
+  payload text not null,
+  base_url text,
+  status text not null default 'pending' check (status in ('pending','processed','ignored','dead')),
+  attempts integer not null default 0,
+  available_at double precision not null,
+  last_error text,
+  received_at timestamptz default now(),
+  processed_at timestamptz,
+  unique (provider, event_id)
+);
+create index if not exists idx_webhook_events_due on public.webhook_events(available_at, id) where status = 'pending';
@@ -43,5 +43,220 @@ create index if not exists idx_members_phone on public.members(phone_e164);
 create index if not exists idx_checkins_member_time on public.check_ins(member_id, timestamp);
 create unique index if not exists ux_members_external on public.members(external_id);
 create index if not exists idx_members_qr_token_null on public.members(id) where qr_token is null;
+create index if not exists idx_members_qr_token on public.members(qr_token);
+
+-- Last-name sort key for the admin member list (keyset pagination)
+alter table public.members
+  add column if not exists sort_key text
+  generated always as (lower(regexp_replace(btrim(name), '^.*\s+', '')) || ' ' || lower(btrim(name))) stored;
+create index if not exists idx_members_sort_key on public.members(sort_key, id);
+
+-- Trigram indexes for substring member search
+create extension if not exists pg_trgm;
+create index if not exists idx_members_name_trgm on public.members using gin (name gin_trgm_ops);
+create index if not exists idx_members_email_trgm on public.members using gin (email_lower gin_trgm_ops);
+create index if not exists idx_members_phone_trgm on public.members using gin (phone_e164 gin_trgm_ops);
+
+-- Outbound email queue drained by the app's mail worker
+create table if not exists public.outbound_emails (
+  id bigserial primary key,
+  to_email text not null,
+  subject text,
+  message bytea not null,
+  status text not null default 'pending' check (status in ('pending','sent','failed')),
+  attempts integer not null default 0,
+  available_at double precision not null,
+  last_error text,
+  created_at timestamptz default now(),
+  sent_at timestamptz
+);
+create index if not exists idx_outbound_emails_due on public.outbound_emails(available_at, id) where status = 'pending';
+
+-- Bulk QR email campaigns
+create table if not exists public.email_campaigns (
+  id bigserial primary key,
+  segment text not null,
+  tier text,
+  since text,
+  base_url text not null,
+  status text not null default 'pending' check (status in ('pending','running','paused','done','cancelled','failed')),
+  total integer not null default 0,
+  enqueued integer not null default 0,
+  max_member_id bigint not null,
+  cursor_member_id bigint not null default 0,
+  heartbeat_at double precision,
+  last_error text,
+  created_at timestamptz default now(),
+  finished_at timestamptz
+);
+
+alter table public.outbound_emails
+  add column if not exists campaign_id bigint references public.email_campaigns(id);
+create index if not exists idx_outbound_emails_campaign on public.outbound_emails(campaign_id, status) where campaign_id is not null;
+
+-- Webhook inbox (Stripe events are stored on receipt and processed in the background)
+create table if not exists public.webhook_events (
+  id bigserial primary key,
+  provider text not null,
+  event_id text not null,
+  event_type text not null,
+  payload text not null,
+  base_url text,
+  status text not null default 'pending' check (status in ('pending','processed','ignored','dead')),
+  attempts integer not null default 0,
+  available_at double precision not null,
+  last_error text,
+  received_at timestamptz default now(),
+  processed_at timestamptz,
+  unique (provider, event_id)
+);
+create index if not exists idx_webhook_events_due on public.webhook_events(available_at, id) where status = 'pending';
+
+-- Idempotency keys of batched kiosk scans (/api/checkin/batch)
+create table if not exists public.checkin_scans (
+  device_id text not null,
+  idempotency_key text not null,
+  status text not null default 'pending',
+  member_id bigint,
+  check_in_id bigint,
+  scanned_at timestamptz,
+  received_at timestamptz default now(),
+  primary key (device_id, idempotency_key)
+);
+create index if not exists idx_checkin_scans_received on public.checkin_scans(received_at);
+
+-- check_ins partitioned by month on timestamp (see migrations/20261017__check_ins_partitioned.sql)
+create or replace function public.ensure_check_ins_partitions(months_ahead int default 3) returns int
+language plpgsql security definer set search_path = public, pg_temp as $$
+declare
+  month_start timestamptz := date_trunc('month', now() at time zone 'UTC') at time zone 'UTC';
+  part_start timestamptz;
+  part_name text;
+  created int := 0;
+begin
+  for i in 0 .. greatest(months_ahead, 0) loop
+    part_start := month_start + make_interval(months => i);
+    part_name := 'check_ins_p' || to_char(part_start at time zone 'UTC', 'YYYYMM');
+    if to_regclass('public.' || part_name) is null then
+      execute format(
+        'create table public.%I partition of public.check_ins for values from (%L) to (%L)',
+        part_name, part_start, part_start + interval '1 month'
+      );
+      created := created + 1;
+    end if;
+  end loop;
+  return created;
+end $$;
+
+create or replace function public.archive_check_ins_partitions(keep_months int) returns setof text
+language plpgsql security definer set search_path = public, pg_temp as $$
+declare
+  cutoff timestamptz := (date_trunc('month', now() at time zone 'UTC') at time zone 'UTC')
+                        - make_interval(months => greatest(keep_months, 1));
+  part record;
+begin
+  create schema if not exists check_ins_archive;
+  for part in
+    select c.relname,
+           substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \(''([^'']+)''\)')::timestamptz as upper_bound
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'public.check_ins'::regclass
+    order by 2
+  loop
+    if part.upper_bound is not null and part.upper_bound <= cutoff then
+      execute format('alter table public.check_ins detach partition public.%I', part.relname);
+      execute format('alter table public.%I set schema check_ins_archive', part.relname);
+      return next part.relname;
+    end if;
+  end loop;
+end $$;
+
+do $$
+declare
+  month_start timestamptz := date_trunc('month', now() at time zone 'UTC') at time zone 'UTC';
+  seq text;
+  is_identity boolean;
+  next_id bigint;
+  con_name text;
+  last_at timestamptz;
+  months_ahead int := 3;
+begin
+  if exists (select 1 from pg_partitioned_table where partrelid = 'public.check_ins'::regclass) then
+    return;
+  end if;
+  lock table public.check_ins in access exclusive mode;
+
+  seq := pg_get_serial_sequence('public.check_ins', 'id');
+  select attidentity <> '' into is_identity
+  from pg_attribute where attrelid = 'public.check_ins'::regclass and attname = 'id';
+  select coalesce(max(id), 0) + 1 into next_id from public.check_ins;
+
+  alter table public.check_ins rename to check_ins_legacy;
+  -- Covered by the partitioned index of the same name once attached
+  drop index if exists public.idx_checkins_member_time;
+  if is_identity then
+    alter table public.check_ins_legacy alter column id drop identity;
+  else
+    alter table public.check_ins_legacy alter column id drop default;
+  end if;
+  -- A partition key cannot be null; undated rows (there should be none) sort before everything
+  update public.check_ins_legacy set timestamp = to_timestamp(0) where timestamp is null;
+  -- Replaced by the partitioned (id, timestamp) key and the parent's foreign keys once attached
+  for con_name in
+    select conname from pg_constraint
+    where conrelid = 'public.check_ins_legacy'::regclass and contype in ('p', 'f')
+  loop
+    execute format('alter table public.check_ins_legacy drop constraint %I', con_name);
+  end loop;
+
+  create table public.check_ins (like public.check_ins_legacy including defaults including constraints)
+    partition by range (timestamp);
+  if seq is not null and not is_identity then
+    execute format('alter sequence %s owned by public.check_ins.id', seq);
+    execute format('alter table public.check_ins alter column id set default nextval(%L::regclass)', seq);
+  else
+    create sequence public.check_ins_id_seq owned by public.check_ins.id;
+    perform setval('public.check_ins_id_seq', next_id, false);
+    alter table public.check_ins alter column id set default nextval('public.check_ins_id_seq'::regclass);
+  end if;
+  alter table public.check_ins add primary key (id, timestamp);
+  alter table public.check_ins add constraint check_ins_member_id_fkey foreign key (member_id) references public.members(id);
+  alter table public.check_ins add constraint check_ins_location_id_fkey foreign key (location_id) references public.locations(id);
+  create index idx_checkins_member_time on public.check_ins(member_id, timestamp);
+  create index idx_checkins_time on public.check_ins(timestamp);
+
+  -- Every row from this month on needs a partition to move into, however far ahead it is dated
+  select max(timestamp) into last_at from public.check_ins_legacy;
+  if last_at >= month_start then
+    months_ahead := greatest(months_ahead,
+      (extract(year from last_at at time zone 'UTC') - extract(year from month_start at time zone 'UTC'))::int * 12
+      + (extract(month from last_at at time zone 'UTC') - extract(month from month_start at time zone 'UTC'))::int);
+  end if;
+  perform public.ensure_check_ins_partitions(months_ahead);
+  with moved as (
+    delete from public.check_ins_legacy where timestamp >= month_start returning *
+  )
+  insert into public.check_ins select * from moved;
+  -- A validated CHECK matching the partition bound lets SET NOT NULL and ATTACH skip their own scans
+  execute format(
+    'alter table public.check_ins_legacy add constraint check_ins_legacy_bound check (timestamp is not null and timestamp < %L) not valid',
+    month_start
+  );
+  alter table public.check_ins_legacy validate constraint check_ins_legacy_bound;
+  alter table public.check_ins_legacy alter column timestamp set not null;
+  execute format(
+    'alter table public.check_ins attach partition public.check_ins_legacy for values from (minvalue) to (%L)',
+    month_start
+  );
+  alter table public.check_ins_legacy drop constraint check_ins_legacy_bound;
+end $$;
+
+do $$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule('ensure-check-ins-partitions', '15 3 * * *', 'select public.ensure_check_ins_partitions(3)');
+  end if;
+end $$;
 
 -- Done: schema objects created
@@ -0,0 +1,232 @@
+"""Static asset build for the check-in app: PWA icons, fingerprinted copies and precompressed variants.
+
+``build_assets`` renders the PWA icons, copies every file under ``static/`` to
+``<name>.<hash><ext>`` and writes ``.gz`` (and ``.br`` when the ``brotli`` package is installed)
+siblings for text assets. References to other assets inside CSS, JS and the web manifest
+(``/static/...`` and ``/icons/...``) are rewritten to their fingerprinted URLs, so every built
+file can be cached as immutable. ``manifest.json`` maps logical paths (``checkin/kiosk.js``,
+``icons/icon-192.png``) to built ones, along with a digest of the sources it was built from.
+
+Each build deletes the fingerprinted files (and their variants) of earlier builds that the new
+manifest no longer lists, so the output directory does not collect stale bundles.
+
+``ensure_assets`` (called at app startup) rebuilds only when that digest no longer matches; run
+``python src/assets.py [out_dir]`` to build ahead of time (e.g. in the Docker image).
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+from typing import Optional
+
+try:
+    import brotli  # optional
+except Exception:
+    brotli = None
+
+MANIFEST_NAME = "manifest.json"
+# Bump when the build output changes for the same sources (icon design, compression settings)
+BUILD_VERSION = "1"
+ICON_SIZES = (192, 512)
+TEXT_EXTENSIONS = {".css", ".js", ".webmanifest", ".json", ".svg", ".html", ".txt"}
+REWRITE_EXTENSIONS = {".css", ".js", ".webmanifest"}
+# Precompressed variants smaller than this fraction of the original are not worth serving
+MIN_COMPRESSION_SAVING = 0.9
+
+_REF_RE = re.compile(r"""(?<=["'(])/(static|icons)/([A-Za-z0-9_@.\-/]+)(?=["')])""")
+
+CONTENT_TYPES = {
+    ".css": "text/css",
+    ".js": "text/javascript",
+    ".webmanifest": "application/manifest+json",
+    ".json": "application/json",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+}
+
+
+def render_icon(size: int) -> bytes:
+    """Black square with a neon green border and a centered "A" monogram."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.new("RGB", (size, size), color=(0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    inset = max(4, size // 64)
+    draw.rectangle([inset, inset, size - inset, size - inset], outline=(57, 255, 20), width=max(4, size // 80))
+    try:
+        font = ImageFont.load_default(size=size // 2)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    # textsize() is gone in Pillow 10; textbbox includes the glyph's offset from the anchor
+    left, top, right, bottom = draw.textbbox((0, 0), "A", font=font)
+    draw.text(((size - (right - left)) // 2 - left, (size - (bottom - top)) // 2 - top), "A", fill=(57, 255, 20), font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _fingerprinted(logical: str, data: bytes) -> str:
+    root, ext = os.path.splitext(logical)
+    digest = hashlib.blake2b(data, digest_size=6).hexdigest()
+    return f"{root}.{digest}{ext}"
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Several workers may build at once; files are content-addressed so the last rename wins harmlessly
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def _emit(out_dir: str, logical: str, data: bytes, manifest: dict) -> None:
+    built = _fingerprinted(logical, data)
+    target = os.path.join(out_dir, built)
+    _write(target, data)
+    if os.path.splitext(logical)[1] in TEXT_EXTENSIONS:
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data) * MIN_COMPRESSION_SAVING:
+            _write(target + ".gz", gz)
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data) * MIN_COMPRESSION_SAVING:
+                _write(target + ".br", br)
+    manifest[logical] = built
+
+
+_FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{12}(\.[^./]+)?(\.gz|\.br)?$")
+
+
+def _prune(out_dir: str, manifest: dict) -> int:
+    """Delete fingerprinted files in out_dir that manifest does not reference; returns how many."""
+    keep = set(manifest.values())
+    removed = 0
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            built = os.path.relpath(os.path.join(root, name), out_dir).replace(os.sep, "/")
+            m = _FINGERPRINT_RE.search(name)
+            if m is None or (built[: -len(m.group(2))] if m.group(2) else built) in keep:
+                continue
+            try:
+                os.remove(os.path.join(root, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _refs(data: bytes) -> set:
+    return {f"icons/{m.group(2)}" if m.group(1) == "icons" else m.group(2) for m in _REF_RE.finditer(data.decode("utf-8", "ignore"))}
+
+
+def _rewrite(data: bytes, manifest: dict) -> bytes:
+    def sub(m):
+        logical = f"icons/{m.group(2)}" if m.group(1) == "icons" else m.group(2)
+        built = manifest.get(logical)
+        return f"/assets/{built}" if built else m.group(0)
+
+    return _REF_RE.sub(sub, data.decode("utf-8")).encode("utf-8")
+
+
+def _read_sources(static_dir: str) -> dict:
+    sources: dict[str, bytes] = {}
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            logical = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as fh:
+                sources[logical] = fh.read()
+    return sources
+
+
+def source_digest(sources: dict) -> str:
+    h = hashlib.blake2b(BUILD_VERSION.encode("ascii"), digest_size=16)
+    h.update(b"brotli" if brotli is not None else b"")
+    for logical in sorted(sources):
+        h.update(logical.encode("utf-8") + b"\0" + hashlib.blake2b(sources[logical], digest_size=16).digest())
+    return h.hexdigest()
+
+
+def build_assets(static_dir: str, out_dir: str, sources: Optional[dict] = None) -> dict:
+    """Build every asset into out_dir and return the logical -> built path manifest."""
+    sources = _read_sources(static_dir) if sources is None else sources
+    manifest: dict[str, str] = {}
+    for size in ICON_SIZES:
+        _emit(out_dir, f"icons/icon-{size}.png", render_icon(size), manifest)
+
+    # Files that reference other assets are built after their dependencies so the references can
+    # point at fingerprinted names; anything left in a cycle keeps its plain /static/ URLs.
+    pending = dict(sources)
+    while pending:
+        progressed = False
+        for logical in sorted(pending):
+            data = pending[logical]
+            if os.path.splitext(logical)[1] in REWRITE_EXTENSIONS:
+                deps = {d for d in _refs(data) if d in sources or d.startswith("icons/")} - {logical}
+                if deps - set(manifest):
+                    continue
+                data = _rewrite(data, manifest)
+            _emit(out_dir, logical, data, manifest)
+            del pending[logical]
+            progressed = True
+        if not progressed:
+            for logical in sorted(pending):
+                _emit(out_dir, logical, _rewrite(pending[logical], manifest), manifest)
+            break
+
+    document = {"source": source_digest(sources), "files": manifest}
+    _write(os.path.join(out_dir, MANIFEST_NAME), json.dumps(document, indent=2, sort_keys=True).encode("utf-8"))
+    _prune(out_dir, manifest)
+    return manifest
+
+
+def ensure_assets(static_dir: str, out_dir: str) -> dict:
+    """Manifest for out_dir, rebuilding first if it is missing or was built from other sources."""
+    sources = _read_sources(static_dir)
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), "rb") as fh:
+            document = json.load(fh)
+        if document.get("source") == source_digest(sources):
+            return document["files"]
+    except (OSError, ValueError, AttributeError):
+        pass
+    return build_assets(static_dir, out_dir, sources)
+
+
+def negotiate(out_dir: str, built: str, accept_encoding: str) -> tuple[str, Optional[str]]:
+    """Path of the best variant of a built asset for this Accept-Encoding, and its Content-Encoding."""
+    path = os.path.join(out_dir, built)
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in accepted and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def content_type(built: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(built)[1].lower(), "application/octet-stream")
+
+
+__all__ = ["build_assets", "ensure_assets", "negotiate", "content_type", "render_icon"]
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(here), "data", "assets")
+    built = build_assets(os.path.join(here, "static"), out)
+    print(f"Built {len(built)} assets into {out}")
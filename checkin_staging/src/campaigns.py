@@ -0,0 +1,352 @@
+"""Bulk "send everyone their QR" email campaigns.
+
+A campaign freezes its member set when it is created (segment filters plus ``max_member_id``) and
+walks it in id order, ``batch_size`` members at a time: members without a QR token get one stored
+first, QR PNGs are rendered in a process pool (spawned, since forking a threaded server process can
+deadlock the child on locks held by other threads), the messages composed and inserted into
+``outbound_emails`` tagged with the campaign, and ``cursor_member_id`` advanced in the same
+transaction. A campaign stopped by a pause, an error or a restart resumes exactly where it left off
+without emailing anyone twice. Delivery (pooled SMTP sessions, rate limit, retries) is the mail
+queue's job; progress combines both tables.
+
+No connection is held while a batch renders: each step takes one from ``connect`` and returns it.
+
+A runner claims a campaign by bumping ``heartbeat_at``, so only one process works on it at a time; a
+campaign whose heartbeat is older than ``stale_after_seconds`` may be taken over.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+SEGMENTS = ("active", "new", "tier")
+
+
+class CampaignError(ValueError):
+    pass
+
+
+def _utc_text(value: str) -> str:
+    """ISO 8601 timestamp -> naive UTC 'YYYY-MM-DD HH:MM:SS', the form CURRENT_TIMESTAMP stores."""
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError as exc:
+        raise CampaignError("since must be an ISO 8601 timestamp") from exc
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CampaignRunner:
+    def __init__(
+        self,
+        connect: Callable,
+        postgres: bool,
+        mail_queue,
+        render_png: Callable[[str], bytes],
+        compose: Callable,
+        processes: int = 2,
+        batch_size: int = 200,
+        stale_after_seconds: float = 60.0,
+    ):
+        """``render_png(token)`` runs in spawned worker processes, so it must be picklable (a
+        module-level function or a partial of one) from a module that is cheap to import;
+        ``compose(name, email, token, png, base_url)`` returns ``(to_email, subject, message_bytes)``."""
+        self.connect = connect
+        self.postgres = postgres
+        self.mail_queue = mail_queue
+        self.render_png = render_png
+        self.compose = compose
+        self.processes = max(1, processes)
+        self.batch_size = max(1, batch_size)
+        self.stale_after_seconds = stale_after_seconds
+        self._ph = "%s" if postgres else "?"
+        self._threads: dict[int, threading.Thread] = {}
+        # Campaigns re-claimed while their thread was still finishing a batch; it carries on
+        self._rerun: set = set()
+        self._lock = threading.Lock()
+
+    def _segment_where(self, segment: str, tier: Optional[str], since: Optional[str]) -> tuple[str, list]:
+        ph = self._ph
+        where = ["status = 'active'", "email_lower IS NOT NULL", "email_lower <> ''"]
+        params: list = []
+        if segment == "tier":
+            where.append(f"LOWER(membership_tier) = LOWER({ph})")
+            params.append(tier)
+        elif segment == "new":
+            where.append(f"created_at >= {ph}")
+            # Stored as naive UTC text; Postgres compares against timestamptz
+            params.append(datetime.strptime(since, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc) if self.postgres else since)
+        return " AND ".join(where), params
+
+    def create(self, segment: str, base_url: str, tier: Optional[str] = None, since: Optional[str] = None) -> int:
+        if segment not in SEGMENTS:
+            raise CampaignError(f"segment must be one of {', '.join(SEGMENTS)}")
+        tier = (tier or "").strip() or None
+        if segment == "tier" and not tier:
+            raise CampaignError("tier is required for the tier segment")
+        if segment == "new":
+            if not since:
+                raise CampaignError("since is required for the new segment")
+            since = _utc_text(since)
+        else:
+            since = None
+        ph = self._ph
+        where, params = self._segment_where(segment, tier, since)
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(f"SELECT COUNT(*) AS c, MAX(id) AS max_id FROM members WHERE {where}", params)
+            row = cur.fetchone()
+            total, max_id = int(row["c"]), int(row["max_id"] or 0)
+            sql = (
+                "INSERT INTO email_campaigns (segment, tier, since, base_url, total, max_member_id) "
+                f"VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph})"
+            )
+            values = (segment, tier, since, base_url, total, max_id)
+            if self.postgres:
+                cur.execute(sql + " RETURNING id", values)
+                campaign_id = int(cur.fetchone()["id"])
+            else:
+                cur.execute(sql, values)
+                campaign_id = int(cur.lastrowid)
+            con.commit()
+        finally:
+            con.close()
+        return campaign_id
+
+    def _claim(self, campaign_id: int) -> bool:
+        ph = self._ph
+        now = time.time()
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""
+                UPDATE email_campaigns SET status = 'running', heartbeat_at = {ph}, last_error = NULL
+                WHERE id = {ph}
+                  AND (status IN ('pending', 'paused', 'failed')
+                       OR (status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < {ph})))
+                """,
+                (now, campaign_id, now - self.stale_after_seconds),
+            )
+            claimed = cur.rowcount == 1
+            con.commit()
+            return claimed
+        finally:
+            con.close()
+
+    def start(self, campaign_id: int) -> bool:
+        """Run (or resume) a campaign in a background thread; False if it is finished, cancelled or
+        still being worked on by a live runner."""
+        with self._lock:
+            if not self._claim(campaign_id):
+                return False
+            thread = self._threads.get(campaign_id)
+            if thread is not None and thread.is_alive():
+                self._rerun.add(campaign_id)
+                return True
+            thread = threading.Thread(target=self._run, args=(campaign_id,), name=f"campaign-{campaign_id}", daemon=True)
+            self._threads[campaign_id] = thread
+            thread.start()
+            return True
+
+    def resume_stale(self) -> list:
+        """Take over campaigns left running by a process that went away."""
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT id FROM email_campaigns WHERE status = 'running'")
+            ids = [int(r["id"]) for r in cur.fetchall()]
+        finally:
+            con.close()
+        return [campaign_id for campaign_id in ids if self.start(campaign_id)]
+
+    def _set_status(self, campaign_id: int, status: str, from_statuses: tuple, last_error: Optional[str] = None) -> bool:
+        ph = self._ph
+        finished = ", finished_at = CURRENT_TIMESTAMP" if status in ("done", "cancelled") else ""
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"UPDATE email_campaigns SET status = {ph}, last_error = {ph}{finished} "
+                f"WHERE id = {ph} AND status IN ({', '.join(ph for _ in from_statuses)})",
+                (status, last_error, campaign_id, *from_statuses),
+            )
+            changed = cur.rowcount == 1
+            if changed and status == "cancelled":
+                # Messages already handed to a sender may still go out
+                cur.execute(
+                    f"UPDATE outbound_emails SET status = 'failed', last_error = 'campaign cancelled' "
+                    f"WHERE campaign_id = {ph} AND status = 'pending'",
+                    (campaign_id,),
+                )
+            con.commit()
+            return changed
+        finally:
+            con.close()
+
+    def pause(self, campaign_id: int) -> bool:
+        return self._set_status(campaign_id, "paused", ("pending", "running"))
+
+    def cancel(self, campaign_id: int) -> bool:
+        return self._set_status(campaign_id, "cancelled", ("pending", "running", "paused", "failed"))
+
+    def _run(self, campaign_id: int) -> None:
+        pool = None
+        try:
+            if self.processes > 1:
+                pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            while True:
+                while self._run_batch(campaign_id, pool):
+                    pass
+                with self._lock:
+                    if campaign_id not in self._rerun:
+                        self._threads.pop(campaign_id, None)
+                        break
+                    self._rerun.discard(campaign_id)
+        except Exception as exc:
+            print(f"Campaign {campaign_id} failed:", exc)
+            with self._lock:
+                self._threads.pop(campaign_id, None)
+                self._rerun.discard(campaign_id)
+            self._set_status(campaign_id, "failed", ("running",), f"{type(exc).__name__}: {exc}"[:500])
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _store_tokens(self, members: list) -> None:
+        """Give members without a QR token one, and set m["qr_token"] to the token actually stored
+        (another writer may have set one since the batch was read)."""
+        missing = [m for m in members if not m["qr_token"]]
+        if not missing:
+            return
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            for m in missing:
+                cur.execute(
+                    f"UPDATE members SET qr_token = COALESCE(qr_token, {ph}) WHERE id = {ph} RETURNING qr_token",
+                    (secrets.token_urlsafe(24), m["id"]),
+                )
+                row = cur.fetchone()
+                m["qr_token"] = row["qr_token"] if row is not None else None
+            con.commit()
+        finally:
+            con.close()
+
+    def _run_batch(self, campaign_id: int, pool: Optional[ProcessPoolExecutor]) -> bool:
+        """Enqueue the next batch; False once the campaign is finished or no longer running."""
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(f"SELECT * FROM email_campaigns WHERE id = {ph}", (campaign_id,))
+            campaign = cur.fetchone()
+            if campaign is None or campaign["status"] != "running":
+                return False
+            where, params = self._segment_where(campaign["segment"], campaign["tier"], campaign["since"])
+            cur.execute(
+                f"""
+                SELECT id, name, email_lower, qr_token FROM members
+                WHERE {where} AND id > {ph} AND id <= {ph}
+                ORDER BY id LIMIT {int(self.batch_size)}
+                """,
+                (*params, campaign["cursor_member_id"], campaign["max_member_id"]),
+            )
+            members = [dict(r) for r in cur.fetchall()]
+            con.commit()
+        finally:
+            con.close()
+        if not members:
+            self._set_status(campaign_id, "done", ("running",))
+            return False
+
+        # Stored before anything is rendered, so every email carries a token that scans
+        self._store_tokens(members)
+        members = [m for m in members if m["qr_token"]]
+        if not members:
+            return True
+        tokens = [m["qr_token"] for m in members]
+        if pool is not None:
+            pngs = list(pool.map(self.render_png, tokens, chunksize=max(1, len(tokens) // (self.processes * 4))))
+        else:
+            pngs = [self.render_png(t) for t in tokens]
+        messages = [
+            self.compose(m["name"], m["email_lower"], m["qr_token"], png, campaign["base_url"])
+            for m, png in zip(members, pngs)
+        ]
+
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            # Advance the cursor first: if the campaign was paused or cancelled meanwhile nothing is queued
+            cur.execute(
+                f"""
+                UPDATE email_campaigns
+                SET cursor_member_id = {ph}, enqueued = enqueued + {ph}, heartbeat_at = {ph}
+                WHERE id = {ph} AND status = 'running' AND cursor_member_id = {ph}
+                """,
+                (members[-1]["id"], len(messages), time.time(), campaign_id, campaign["cursor_member_id"]),
+            )
+            if cur.rowcount != 1:
+                con.rollback()
+                return False
+            self.mail_queue.enqueue_batch(con, messages, campaign_id=campaign_id)
+            con.commit()
+        finally:
+            con.close()
+        self.mail_queue.wake()
+        return True
+
+    def progress(self, campaign_id: int) -> Optional[dict]:
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(f"SELECT * FROM email_campaigns WHERE id = {ph}", (campaign_id,))
+            campaign = cur.fetchone()
+            if campaign is None:
+                return None
+            cur.execute(
+                f"SELECT status, COUNT(*) AS c FROM outbound_emails WHERE campaign_id = {ph} GROUP BY status",
+                (campaign_id,),
+            )
+            delivery = {r["status"]: int(r["c"]) for r in cur.fetchall()}
+        finally:
+            con.close()
+        return {
+            "id": int(campaign["id"]),
+            "segment": campaign["segment"],
+            "tier": campaign["tier"],
+            "since": campaign["since"],
+            "status": campaign["status"],
+            "total": int(campaign["total"]),
+            "enqueued": int(campaign["enqueued"]),
+            "sent": delivery.get("sent", 0),
+            "pending": delivery.get("pending", 0),
+            "failed": delivery.get("failed", 0),
+            "last_error": campaign["last_error"],
+            "created_at": str(campaign["created_at"]) if campaign["created_at"] is not None else None,
+            "finished_at": str(campaign["finished_at"]) if campaign["finished_at"] is not None else None,
+        }
+
+    def recent(self, limit: int = 10) -> list:
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(f"SELECT id FROM email_campaigns ORDER BY id DESC LIMIT {int(limit)}")
+            ids = [int(r["id"]) for r in cur.fetchall()]
+        finally:
+            con.close()
+        return [p for p in (self.progress(campaign_id) for campaign_id in ids) if p]
+
+
+__all__ = ["CampaignRunner", "CampaignError", "SEGMENTS"]
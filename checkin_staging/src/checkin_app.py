@@ -4,15 +4,14 @@ import sqlite3
 import hashlib
 import hmac
 import secrets
-import smtplib
 import io
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.utils import formataddr
+import functools
+import json
 from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse, unquote
 import socket
+import threading
+import time
 
 # Optional Postgres (Supabase) support via psycopg
 DATABASE_URL = os.environ.get("DATABASE_URL")
@@ -26,6 +25,21 @@ try:
 except Exception:
     _PG_AVAILABLE = False
 
+# Optional connection pooling for Postgres via psycopg_pool
+_PG_POOL_AVAILABLE = False
+try:
+    if DATABASE_URL:
+        from psycopg_pool import ConnectionPool
+        _PG_POOL_AVAILABLE = True
+except Exception:
+    _PG_POOL_AVAILABLE = False
+
+# Stripe (staff signup checkout and webhooks); only needed with ENABLE_STAFF_SIGNUP=1
+try:
+    import stripe
+except Exception:
+    stripe = None
+
 from flask import (
     Flask,
     request,
@@ -36,9 +50,32 @@ from flask import (
     session,
     abort,
     send_file,
+    Response,
+    stream_with_context,
+    g,
+    has_app_context,
 )
 
-from wallet_pass import wallet_pass_configured, build_member_wallet_pass
+from wallet_pass import (
+    WalletPassResult,
+    wallet_pass_configured,
+    build_member_wallet_pass,
+    wallet_pass_digest,
+    wallet_pass_filename,
+)
+from ttl_cache import TTLCache
+from checkin_counters import CheckinCounters
+from recent_checkins import RecentCheckins
+from shared_cache import make_cache_backend, ResponseCache
+from event_stream import EventBroker, format_sse
+from member_import import MemberImport, DeactivationLimitExceeded
+from assets import ensure_assets, negotiate, content_type
+from mail_queue import MailQueue, SmtpSession, SmtpSettings
+from mail_templates import MailTemplates
+from campaigns import CampaignRunner, CampaignError
+from qr_render import generate_qr_png
+from webhook_inbox import WebhookInbox
+from stripe_customers import StripeCustomers
 
 
 def get_db_path() -> str:
@@ -53,11 +90,135 @@ def get_db_path() -> str:
 
 DB_PATH = get_db_path()
 DUP_WINDOW_MINUTES = int(os.environ.get("CHECKIN_DUP_WINDOW_MINUTES", "5"))
+# Offline kiosk scans (/api/checkin/batch): scans per request, how old a scan may be, how long replay results are kept
+CHECKIN_BATCH_MAX_SCANS = int(os.environ.get("CHECKIN_BATCH_MAX_SCANS", "200"))
+CHECKIN_BATCH_MAX_AGE_HOURS = float(os.environ.get("CHECKIN_BATCH_MAX_AGE_HOURS", "24"))
+CHECKIN_SCAN_KEY_RETENTION_DAYS = int(os.environ.get("CHECKIN_SCAN_KEY_RETENTION_DAYS", "7"))
 SESSION_SECRET = os.environ.get("CHECKIN_SESSION_SECRET", "dev-secret-change-me")
 STAFF_SIGNUP_PASSWORD = os.environ.get("STAFF_SIGNUP_PASSWORD")
 STAFF_SIGNUP_ENABLED = os.environ.get("ENABLE_STAFF_SIGNUP", "0").strip().lower() in {"1", "true", "yes", "on"}
 WALLET_PASS_ENABLED = os.environ.get("ENABLE_WALLET_PASS", "0").strip().lower() in {"1", "true", "yes", "on"}
 
+# Connection reuse. Each gunicorn gthread worker serves GUNICORN_THREADS requests at once, so the
+# per-process Postgres pool never needs more connections than that.
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "4"))
+DB_POOL_ENABLED = os.environ.get("CHECKIN_DB_POOL", "1").strip().lower() in {"1", "true", "yes", "on"}
+DB_POOL_MIN_SIZE = int(os.environ.get("CHECKIN_DB_POOL_MIN", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("CHECKIN_DB_POOL_MAX", str(GUNICORN_THREADS)))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("CHECKIN_DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.environ.get("CHECKIN_DB_POOL_MAX_IDLE_SECONDS", "300"))
+# Connections idle longer than this get a liveness probe before being handed out
+DB_POOL_CHECK_AFTER_SECONDS = float(os.environ.get("CHECKIN_DB_POOL_CHECK_AFTER_SECONDS", "60"))
+# Background threads (mail senders, webhook inbox, campaign runner) draw from their own pool of this
+# size, so a slow SMTP relay or a running campaign cannot take the connections requests wait on.
+DB_BACKGROUND_POOL_MAX_SIZE = int(os.environ.get("CHECKIN_DB_BACKGROUND_POOL_MAX", "2"))
+DNS_TTL_SECONDS = float(os.environ.get("CHECKIN_DNS_TTL_SECONDS", "300"))
+
+# QR token -> member cache for kiosk scans. Writes in this process invalidate it; the TTL bounds how
+# long another worker's edits (e.g. a deactivation) can go unseen.
+QR_CACHE_SIZE = int(os.environ.get("CHECKIN_QR_CACHE_SIZE", "2048"))
+QR_CACHE_TTL_SECONDS = float(os.environ.get("CHECKIN_QR_CACHE_TTL_SECONDS", "300"))
+QR_TOKEN_CACHE = TTLCache(max_entries=QR_CACHE_SIZE, ttl_seconds=QR_CACHE_TTL_SECONDS)
+
+# Totals for the admin member list. Unfiltered and status/tier views are summed from one cached
+# GROUP BY; free-text totals are cached per filter. Writes in this process clear both, and the TTL
+# bounds how long another worker's writes go unseen.
+MEMBER_COUNTS_TTL_SECONDS = float(os.environ.get("CHECKIN_MEMBER_COUNTS_TTL_SECONDS", "60"))
+MEMBER_COUNT_CACHE = TTLCache(max_entries=256, ttl_seconds=MEMBER_COUNTS_TTL_SECONDS)
+
+# Rendered QR PNGs keyed by (token, box_size, border), capped by total bytes. Browsers may keep a
+# PNG for QR_PNG_MAX_AGE_SECONDS and revalidate with the ETag after that.
+QR_PNG_CACHE_BYTES = int(os.environ.get("CHECKIN_QR_PNG_CACHE_BYTES", str(8 * 1024 * 1024)))
+QR_PNG_MAX_AGE_SECONDS = int(os.environ.get("CHECKIN_QR_PNG_MAX_AGE_SECONDS", "86400"))
+QR_PNG_CACHE = TTLCache(max_entries=4096, ttl_seconds=24 * 3600, max_bytes=QR_PNG_CACHE_BYTES)
+_QR_RENDER_VERSION = "qrcode-m-1"
+
+# Signed Apple Wallet passes keyed by wallet_pass_digest (a hash of everything that goes into the
+# pass), so a member whose name/tier/email/token changed simply misses. Values are
+# (member_id, WalletPassResult). PKPASS_CACHE_DIR adds a disk tier shared by all workers on the host.
+PKPASS_CACHE_BYTES = int(os.environ.get("CHECKIN_PKPASS_CACHE_BYTES", str(16 * 1024 * 1024)))
+PKPASS_CACHE_DIR = os.environ.get("CHECKIN_PKPASS_CACHE_DIR") or None
+PKPASS_CACHE = TTLCache(max_entries=4096, ttl_seconds=24 * 3600, max_bytes=PKPASS_CACHE_BYTES, sizeof=lambda v: len(v[1].data))
+
+# Outbound email: handlers enqueue into outbound_emails and a worker thread per process delivers over
+# a persistent SMTP session, retrying with exponential backoff up to MAIL_MAX_ATTEMPTS times.
+MAIL_QUEUE_ENABLED = os.environ.get("CHECKIN_MAIL_QUEUE", "1").strip().lower() in {"1", "true", "yes", "on"}
+MAIL_QUEUE = MailQueue(
+    connect=lambda: connect_background_db(),
+    postgres=bool(DATABASE_URL),
+    max_attempts=int(os.environ.get("CHECKIN_MAIL_MAX_ATTEMPTS", "8")),
+    poll_seconds=float(os.environ.get("CHECKIN_MAIL_POLL_SECONDS", "5")),
+    idle_seconds=float(os.environ.get("CHECKIN_SMTP_IDLE_SECONDS", "30")),
+    backoff_seconds=float(os.environ.get("CHECKIN_MAIL_BACKOFF_SECONDS", "30")),
+    senders=int(os.environ.get("CHECKIN_MAIL_SENDERS", "2")),
+    rate_per_second=float(os.environ.get("CHECKIN_MAIL_RATE_PER_SECOND", "10")),
+)
+# Stripe API calls (signup checkout, webhook processing) give up after this long instead of the library's 80s
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get("CHECKIN_STRIPE_TIMEOUT_SECONDS", "10"))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get("CHECKIN_STRIPE_MAX_NETWORK_RETRIES", "1"))
+# Email bodies live in templates/email (see mail_templates.py), compiled once per process
+MAIL_TEMPLATES = MailTemplates(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+# Bulk QR email campaigns (see campaigns.py); QR PNGs for a batch are rendered in this many processes
+CAMPAIGN_RENDER_PROCESSES = int(os.environ.get("CHECKIN_CAMPAIGN_RENDER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+CAMPAIGN_BATCH_SIZE = int(os.environ.get("CHECKIN_CAMPAIGN_BATCH_SIZE", "200"))
+
+# Built static assets (see assets.py): fingerprinted names are served as immutable, icons for a day
+ASSET_DIR = os.environ.get("CHECKIN_ASSET_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "assets")
+ASSET_MAX_AGE_SECONDS = 365 * 24 * 3600
+ICON_MAX_AGE_SECONDS = 24 * 3600
+
+# Check-in counters behind /api/staff/metrics and /api/kiosk/status. Other workers' check-ins are
+# picked up by a cheap id-range catch-up at most every COUNTERS_SYNC_SECONDS.
+COUNTERS_SYNC_SECONDS = float(os.environ.get("CHECKIN_COUNTERS_SYNC_SECONDS", "5"))
+COUNTERS_REBUILD_SECONDS = float(os.environ.get("CHECKIN_COUNTERS_REBUILD_SECONDS", "3600"))
+CHECKIN_COUNTERS = CheckinCounters(history_days=7)
+# Postgres check_ins is partitioned by month (seed/migrations/20261017__check_ins_partitioned.sql).
+# Each rebuild of the counters also creates partitions this many months ahead and, when set, detaches
+# partitions older than CHECKINS_ARCHIVE_AFTER_MONTHS into the check_ins_archive schema.
+CHECKINS_PARTITIONS_AHEAD = int(os.environ.get("CHECKIN_PARTITIONS_AHEAD_MONTHS", "3"))
+CHECKINS_ARCHIVE_AFTER_MONTHS = int(os.environ.get("CHECKIN_ARCHIVE_AFTER_MONTHS", "0"))
+
+# Cache shared across workers (memory://, sqlite:///path or redis://...) and the kiosk status
+# response cached in it; every kiosk at a location gets the same payload.
+SHARED_CACHE = make_cache_backend(os.environ.get("CHECKIN_CACHE_URL"))
+KIOSK_STATUS_TTL_SECONDS = float(os.environ.get("CHECKIN_KIOSK_STATUS_TTL_SECONDS", "15"))
+KIOSK_STATUS_CACHE = ResponseCache(SHARED_CACHE, "kiosk_status", ttl_seconds=KIOSK_STATUS_TTL_SECONDS)
+# Members checked in within DUP_WINDOW_MINUTES, so a repeat scan is answered without a query; fed by
+# _note_checkin and seeded with the counters, and shared through SHARED_CACHE when it is not memory://.
+RECENT_CHECKINS = RecentCheckins(DUP_WINDOW_MINUTES, SHARED_CACHE)
+
+# Staff dashboard live feed. Under gthread an open stream occupies a worker thread for as long as it
+# is held, so only a few streams per worker are allowed (none with fewer than 4 threads, and never
+# all threads) and each is closed after SSE_MAX_SECONDS; EventSource reconnects and resumes by
+# Last-Event-ID without a new snapshot. Over the cap, clients get a 204 and poll /api/staff/metrics
+# with If-None-Match, which is answered from the counters (304) until something changes.
+SSE_MAX_STREAMS = max(0, min(
+    int(os.environ.get("CHECKIN_SSE_MAX_STREAMS", str((GUNICORN_THREADS - 1) // 3))),
+    GUNICORN_THREADS - 1,
+))
+SSE_MAX_SECONDS = float(os.environ.get("CHECKIN_SSE_MAX_SECONDS", "30"))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("CHECKIN_SSE_HEARTBEAT_SECONDS", "15"))
+STAFF_EVENTS = EventBroker(capacity=256)
+_SSE_SLOTS = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# members.sort_key orders the admin member list by last name, then full name. Postgres stores it as a
+# generated column; SQLite, which has no regexp_replace, takes the text after the last space and is
+# kept current by triggers. Both feed the (sort_key, id) index used for keyset pagination.
+MEMBER_SORT_KEY_PG = "lower(regexp_replace(btrim(name), '^.*\\s+', '')) || ' ' || lower(btrim(name))"
+MEMBER_SORT_KEY_SQLITE = (
+    "lower(substr(trim({n}), length(rtrim(trim({n}), replace(trim({n}), ' ', ''))) + 1)) || ' ' || lower(trim({n}))"
+)
+
+# Set by init_db(): whether the SQLite members_fts trigram index exists.
+SQLITE_MEMBER_FTS = False
+
+# Roster uploads are decoded and mapped CSV_CHUNK_ROWS rows at a time, so memory does not grow with
+# the size of the export.
+CSV_CHUNK_ROWS = int(os.environ.get("CHECKIN_CSV_CHUNK_ROWS", "2000"))
+# deactivate_missing refuses to deactivate more than this fraction of active members unless forced,
+# which catches truncated or wrong-location exports before they empty the roster.
+DEACTIVATE_MAX_FRACTION = float(os.environ.get("CHECKIN_DEACTIVATE_MAX_FRACTION", "0.25"))
+
 
 def using_postgres() -> bool:
     if DATABASE_URL:
@@ -75,6 +236,84 @@ def _connect_sqlite() -> sqlite3.Connection:
     return con
 
 
+_DNS_CACHE: dict[str, tuple[str | None, float]] = {}
+_DNS_LOCK = threading.Lock()
+
+
+def _resolve_ipv4(host: str) -> str | None:
+    """Resolve host to an IPv4 address, caching the answer for DNS_TTL_SECONDS.
+
+    If a refresh fails, the last good address keeps being served until the next refresh.
+    """
+    now = time.monotonic()
+    with _DNS_LOCK:
+        cached = _DNS_CACHE.get(host)
+    if cached and cached[1] > now:
+        return cached[0]
+    ipv4 = None
+    try:
+        infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+        if infos:
+            ipv4 = infos[0][4][0]
+    except Exception:
+        ipv4 = cached[0] if cached else None
+    with _DNS_LOCK:
+        _DNS_CACHE[host] = (ipv4, now + DNS_TTL_SECONDS)
+    return ipv4
+
+
+def _pg_connect_kwargs() -> dict | None:
+    """Build psycopg connect kwargs from a URI-style DATABASE_URL (None for other DSN shapes)."""
+    dsn = DATABASE_URL.strip()
+    # Try to build an IPv4-preferring conninfo preserving hostname for TLS/SNI
+    if not (dsn.startswith("postgres://") or dsn.startswith("postgresql://")):
+        return None
+    u = urlparse(dsn)
+    host = u.hostname or ""
+    port = u.port or 5432
+    dbname = (u.path or "/postgres").lstrip("/") or "postgres"
+    user = unquote(u.username) if u.username else None
+    password = unquote(u.password) if u.password else None
+    # Extract sslmode if present; default to require
+    sslmode = "require"
+    try:
+        q = u.query or ""
+        for kv in q.split("&"):
+            if not kv:
+                continue
+            k, _, v = kv.partition("=")
+            if k == "sslmode" and v:
+                sslmode = v
+                break
+    except Exception:
+        pass
+    kwargs = {
+        "host": host,
+        "port": port,
+        "dbname": dbname,
+        "sslmode": sslmode,
+        "row_factory": _pg_dict_row,
+        "connect_timeout": 10,
+        # The Supabase pooler runs pgBouncer in transaction mode, which cannot keep server-side
+        # prepared statements across transactions. Reused connections would otherwise start
+        # preparing hot statements after a few executions.
+        "prepare_threshold": None,
+    }
+    if user:
+        kwargs["user"] = user
+    if password:
+        kwargs["password"] = password
+    return kwargs
+
+
+def _with_hostaddr(kwargs: dict) -> dict:
+    # Resolve IPv4 address for host (avoid IPv6 unreachable in some containers)
+    ipv4 = _resolve_ipv4(kwargs["host"]) if kwargs.get("host") else None
+    if not ipv4:
+        return kwargs
+    return {**kwargs, "hostaddr": ipv4}
+
+
 def _connect_postgres():
     if not _PG_AVAILABLE:
         raise RuntimeError(
@@ -82,59 +321,190 @@ def _connect_postgres():
         )
     dsn = DATABASE_URL.strip()
     try:
-        # Try to build an IPv4-preferring conninfo preserving hostname for TLS/SNI
-        if dsn.startswith("postgres://") or dsn.startswith("postgresql://"):
-            u = urlparse(dsn)
-            host = u.hostname or ""
-            port = u.port or 5432
-            dbname = (u.path or "/postgres").lstrip("/") or "postgres"
-            user = unquote(u.username) if u.username else None
-            password = unquote(u.password) if u.password else None
-            # Resolve IPv4 address for host (avoid IPv6 unreachable in some containers)
-            ipv4 = None
-            try:
-                infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
-                if infos:
-                    ipv4 = infos[0][4][0]
-            except Exception:
-                ipv4 = None
-            # Extract sslmode if present; default to require
-            sslmode = "require"
-            try:
-                q = u.query or ""
-                for kv in q.split("&"):
-                    if not kv:
-                        continue
-                    k, _, v = kv.partition("=")
-                    if k == "sslmode" and v:
-                        sslmode = v
-                        break
-            except Exception:
-                pass
-            kwargs = {
-                "host": host,
-                "port": port,
-                "dbname": dbname,
-                "sslmode": sslmode,
-                "row_factory": _pg_dict_row,
-                "connect_timeout": 10,
-            }
-            if ipv4:
-                kwargs["hostaddr"] = ipv4
-            if user:
-                kwargs["user"] = user
-            if password:
-                kwargs["password"] = password
-            return psycopg.connect(**kwargs)
+        kwargs = _pg_connect_kwargs()
+        if kwargs is not None:
+            return psycopg.connect(**_with_hostaddr(kwargs))
         # Fallback: let psycopg parse conninfo/DSN itself
-        return psycopg.connect(dsn, row_factory=_pg_dict_row, connect_timeout=10)
+        return psycopg.connect(dsn, row_factory=_pg_dict_row, connect_timeout=10, prepare_threshold=None)
     except Exception:
         # As a last resort, try the raw DSN without extra params
         return psycopg.connect(dsn, row_factory=_pg_dict_row)
 
 
+class _PooledConnection:
+    """Connection proxy whose close() hands the connection back for reuse instead of closing it.
+
+    Anything left uncommitted is rolled back on release, which matches what closing a fresh
+    connection used to do.
+    """
+
+    def __init__(self, con, release):
+        self._con = con
+        self._release = release
+
+    def __getattr__(self, name):
+        if self._con is None:
+            raise RuntimeError("Connection already released")
+        return getattr(self._con, name)
+
+    def close(self):
+        con, self._con = self._con, None
+        if con is not None:
+            self._release(con)
+
+
+_PG_POOL = None
+_PG_POOL_PID = None
+_PG_BACKGROUND_POOL = None
+_PG_BACKGROUND_POOL_PID = None
+_PG_POOL_LOCK = threading.Lock()
+_SQLITE_LOCAL = threading.local()
+
+
+def _pg_check_connection(con):
+    # Only probe connections that sat idle long enough for the pooler to have dropped them;
+    # recently used ones go straight back into service.
+    if time.monotonic() - getattr(con, "_checkin_released_at", 0.0) > DB_POOL_CHECK_AFTER_SECONDS:
+        ConnectionPool.check_connection(con)
+
+
+def _new_pg_pool(name: str, min_size: int, max_size: int):
+    base_kwargs = _pg_connect_kwargs()
+
+    class _ResolvingConnection(psycopg.Connection):
+        # New pool connections pick up the cached (TTL-refreshed) IPv4 address
+        @classmethod
+        def connect(cls, conninfo: str = "", **kwargs):
+            return super().connect(conninfo, **_with_hostaddr(kwargs))
+
+    if base_kwargs is not None:
+        conninfo, kwargs = "", base_kwargs
+    else:
+        conninfo = DATABASE_URL.strip()
+        kwargs = {"row_factory": _pg_dict_row, "connect_timeout": 10, "prepare_threshold": None}
+    return ConnectionPool(
+        conninfo,
+        connection_class=_ResolvingConnection,
+        kwargs=kwargs,
+        min_size=max(0, min(min_size, max_size)),
+        max_size=max(1, max_size),
+        timeout=DB_POOL_TIMEOUT_SECONDS,
+        max_idle=DB_POOL_MAX_IDLE_SECONDS,
+        check=_pg_check_connection,
+        name=name,
+        open=True,
+    )
+
+
+def _get_pg_pool():
+    global _PG_POOL, _PG_POOL_PID
+    pid = os.getpid()
+    if _PG_POOL is not None and _PG_POOL_PID == pid:
+        return _PG_POOL
+    with _PG_POOL_LOCK:
+        # A pool inherited across fork (gunicorn --preload) shares sockets with the parent; build a new one.
+        if _PG_POOL is None or _PG_POOL_PID != pid:
+            _PG_POOL = _new_pg_pool("checkin", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+            _PG_POOL_PID = pid
+        return _PG_POOL
+
+
+def _get_pg_background_pool():
+    global _PG_BACKGROUND_POOL, _PG_BACKGROUND_POOL_PID
+    pid = os.getpid()
+    if _PG_BACKGROUND_POOL is not None and _PG_BACKGROUND_POOL_PID == pid:
+        return _PG_BACKGROUND_POOL
+    with _PG_POOL_LOCK:
+        if _PG_BACKGROUND_POOL is None or _PG_BACKGROUND_POOL_PID != pid:
+            _PG_BACKGROUND_POOL = _new_pg_pool("checkin-background", 0, DB_BACKGROUND_POOL_MAX_SIZE)
+            _PG_BACKGROUND_POOL_PID = pid
+        return _PG_BACKGROUND_POOL
+
+
+def _pg_releaser(pool):
+    def release(con):
+        try:
+            if not con.closed and con.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+                con.rollback()
+        except Exception:
+            pass
+        con._checkin_released_at = time.monotonic()
+        pool.putconn(con)
+
+    return release
+
+
+def _release_sqlite(con):
+    try:
+        if con.in_transaction:
+            con.rollback()
+    except Exception:
+        pass
+    if con is getattr(_SQLITE_LOCAL, "con", None):
+        _SQLITE_LOCAL.busy = False
+    else:
+        con.close()
+
+
+def _acquire_sqlite() -> sqlite3.Connection:
+    # One long-lived connection per thread; sqlite3 connections are not shared across threads.
+    # A nested connect_db() while the thread's connection is checked out gets a private one so
+    # releasing it cannot roll back the outer caller's transaction.
+    if getattr(_SQLITE_LOCAL, "busy", False):
+        return _connect_sqlite()
+    con = getattr(_SQLITE_LOCAL, "con", None)
+    if con is None or getattr(_SQLITE_LOCAL, "path", None) != DB_PATH:
+        con = _connect_sqlite()
+        _SQLITE_LOCAL.con = con
+        _SQLITE_LOCAL.path = DB_PATH
+    _SQLITE_LOCAL.busy = True
+    return con
+
+
+def _track_request_connection(con):
+    # Connections checked out during a request are released at teardown even if a handler
+    # returns or raises before calling close().
+    if has_app_context():
+        g.setdefault("_checkin_db_connections", []).append(con)
+    return con
+
+
+def release_request_connections(exc=None):
+    for con in g.pop("_checkin_db_connections", []):
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+def db_pool_stats() -> dict:
+    if _PG_POOL is not None:
+        stats = {"kind": "psycopg_pool", **_PG_POOL.get_stats()}
+        if _PG_BACKGROUND_POOL is not None:
+            stats["background"] = _PG_BACKGROUND_POOL.get_stats()
+        return stats
+    return {"kind": "sqlite_per_thread" if not DATABASE_URL else "none", "enabled": DB_POOL_ENABLED}
+
+
 def connect_db():
-    return _connect_postgres() if using_postgres() else _connect_sqlite()
+    if not DB_POOL_ENABLED:
+        return _connect_postgres() if using_postgres() else _connect_sqlite()
+    if using_postgres():
+        if not _PG_AVAILABLE or not _PG_POOL_AVAILABLE:
+            return _connect_postgres()
+        pool = _get_pg_pool()
+        return _track_request_connection(_PooledConnection(pool.getconn(), _pg_releaser(pool)))
+    return _track_request_connection(_PooledConnection(_acquire_sqlite(), _release_sqlite))
+
+
+def connect_background_db():
+    """connect_db() for background threads: Postgres connections come from the separate background pool."""
+    if not DB_POOL_ENABLED or not using_postgres():
+        return connect_db()
+    if not _PG_AVAILABLE or not _PG_POOL_AVAILABLE:
+        return _connect_postgres()
+    pool = _get_pg_background_pool()
+    return _track_request_connection(_PooledConnection(pool.getconn(), _pg_releaser(pool)))
 
 
 def init_db():
@@ -160,6 +530,14 @@ def init_db():
                     con.commit()
                 except Exception:
                     con.rollback()
+                try:
+                    cur.execute(
+                        f"ALTER TABLE public.members ADD COLUMN IF NOT EXISTS sort_key TEXT GENERATED ALWAYS AS ({MEMBER_SORT_KEY_PG}) STORED"
+                    )
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_members_sort_key ON public.members(sort_key, id)")
+                    con.commit()
+                except Exception:
+                    con.rollback()
         except Exception:
             # If schema/tables aren't there yet, ignore; migrations will create them.
             pass
@@ -171,6 +549,8 @@ def init_db():
         return
     con = connect_db()
     cur = con.cursor()
+    # WAL lets the per-thread connections read while another thread writes
+    cur.execute("PRAGMA journal_mode=WAL")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS locations (
@@ -191,14 +571,39 @@ def init_db():
             membership_tier TEXT,
             status TEXT CHECK (status IN ('active','inactive')) DEFAULT 'active',
             qr_token TEXT,
+            sort_key TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """
     )
+    cur.execute("PRAGMA table_info(members)")
+    member_columns = {r["name"] for r in cur.fetchall()}
+    if "sort_key" not in member_columns:
+        cur.execute("ALTER TABLE members ADD COLUMN sort_key TEXT")
+    if "stripe_customer_id" not in member_columns:
+        cur.execute("ALTER TABLE members ADD COLUMN stripe_customer_id TEXT")
+    cur.execute(f"UPDATE members SET sort_key = {MEMBER_SORT_KEY_SQLITE.format(n='name')} WHERE sort_key IS NULL")
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS members_sort_key_ai AFTER INSERT ON members BEGIN
+            UPDATE members SET sort_key = {MEMBER_SORT_KEY_SQLITE.format(n='new.name')} WHERE id = new.id;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS members_sort_key_au AFTER UPDATE OF name ON members BEGIN
+            UPDATE members SET sort_key = {MEMBER_SORT_KEY_SQLITE.format(n='new.name')} WHERE id = new.id;
+        END
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_members_sort_key ON members(sort_key, id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_members_email ON members(email_lower)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_members_phone ON members(phone_e164)")
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_members_external ON members(external_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_members_qr_token ON members(qr_token)")
+    _init_sqlite_member_search(cur)
 
     cur.execute(
         """
@@ -216,6 +621,23 @@ def init_db():
         """
     )
     cur.execute("CREATE INDEX IF NOT EXISTS idx_checkins_member_time ON check_ins(member_id, timestamp)")
+    # Dashboard and counter queries filter by time alone; SQLite is not partitioned, so they range-scan this
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checkins_time ON check_ins(timestamp)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkin_scans (
+            device_id TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            member_id INTEGER,
+            check_in_id INTEGER,
+            scanned_at TIMESTAMP,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (device_id, idempotency_key)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checkin_scans_received ON checkin_scans(received_at)")
 
     cur.execute(
         """
@@ -229,6 +651,70 @@ def init_db():
         """
     )
 
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbound_emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT,
+            message BLOB NOT NULL,
+            status TEXT CHECK (status IN ('pending','sent','failed')) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            campaign_id INTEGER
+        )
+        """
+    )
+    cur.execute("PRAGMA table_info(outbound_emails)")
+    if "campaign_id" not in {r["name"] for r in cur.fetchall()}:
+        cur.execute("ALTER TABLE outbound_emails ADD COLUMN campaign_id INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbound_emails_due ON outbound_emails(available_at, id) WHERE status = 'pending'")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbound_emails_campaign ON outbound_emails(campaign_id, status) WHERE campaign_id IS NOT NULL")
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            segment TEXT NOT NULL,
+            tier TEXT,
+            since TEXT,
+            base_url TEXT NOT NULL,
+            status TEXT CHECK (status IN ('pending','running','paused','done','cancelled','failed')) NOT NULL DEFAULT 'pending',
+            total INTEGER NOT NULL DEFAULT 0,
+            enqueued INTEGER NOT NULL DEFAULT 0,
+            max_member_id INTEGER NOT NULL,
+            cursor_member_id INTEGER NOT NULL DEFAULT 0,
+            heartbeat_at REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            base_url TEXT,
+            status TEXT CHECK (status IN ('pending','processed','ignored','dead')) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            last_error TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            UNIQUE (provider, event_id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_due ON webhook_events(available_at, id) WHERE status = 'pending'")
+
     cur.execute("SELECT COUNT(*) AS c FROM locations")
     if cur.fetchone()[0] == 0:
         cur.execute("INSERT INTO locations(name, timezone) VALUES (?, ?)", ("Atlas Gym", "America/Los_Angeles"))
@@ -237,6 +723,118 @@ def init_db():
     con.close()
 
 
+def _init_sqlite_member_search(cur):
+    """Trigram FTS5 index over member name/email/phone, kept in sync by triggers on members."""
+    global SQLITE_MEMBER_FTS
+    try:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'members_fts'")
+        created = cur.fetchone() is None
+        cur.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+                name, email_lower, phone_e164,
+                content='members', content_rowid='id', tokenize='trigram'
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS members_fts_ai AFTER INSERT ON members BEGIN
+                INSERT INTO members_fts(rowid, name, email_lower, phone_e164)
+                VALUES (new.id, new.name, new.email_lower, new.phone_e164);
+            END
+            """
+        )
+        cur.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS members_fts_ad AFTER DELETE ON members BEGIN
+                INSERT INTO members_fts(members_fts, rowid, name, email_lower, phone_e164)
+                VALUES ('delete', old.id, old.name, old.email_lower, old.phone_e164);
+            END
+            """
+        )
+        cur.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS members_fts_au AFTER UPDATE OF name, email_lower, phone_e164 ON members BEGIN
+                INSERT INTO members_fts(members_fts, rowid, name, email_lower, phone_e164)
+                VALUES ('delete', old.id, old.name, old.email_lower, old.phone_e164);
+                INSERT INTO members_fts(rowid, name, email_lower, phone_e164)
+                VALUES (new.id, new.name, new.email_lower, new.phone_e164);
+            END
+            """
+        )
+        if created:
+            cur.execute("INSERT INTO members_fts(members_fts) VALUES ('rebuild')")
+        SQLITE_MEMBER_FTS = True
+    except sqlite3.OperationalError as e:
+        # SQLite builds without FTS5 or the trigram tokenizer (< 3.34) fall back to LIKE scans
+        print("Member search index unavailable, using LIKE:", e)
+        SQLITE_MEMBER_FTS = False
+
+
+def _like_escape(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_members(q: str, limit: int, name_only: bool = False) -> list:
+    """Active members whose name (and email/phone unless name_only) contains q, best matches first.
+
+    Name prefix matches rank first, then matches at the start of a later word, then any other
+    substring hit. Postgres answers from the pg_trgm indexes; SQLite from members_fts.
+    """
+    ql = q.strip().lower()
+    esc = _like_escape(ql)
+    like, prefix, word = f"%{esc}%", f"{esc}%", f"% {esc}%"
+    cols = "m.id, m.name" if name_only else "m.id, m.name, m.email_lower, m.phone_e164, m.membership_tier, m.status"
+    rank = "CASE WHEN lower(m.name) LIKE {p} ESCAPE '\\' THEN 0 WHEN lower(m.name) LIKE {p} ESCAPE '\\' THEN 1 ELSE 2 END"
+    con = connect_db()
+    cur = con.cursor()
+    if using_postgres():
+        where = "m.name ILIKE %s ESCAPE '\\'" if name_only else (
+            "(m.name ILIKE %s ESCAPE '\\' OR m.email_lower LIKE %s ESCAPE '\\' OR m.phone_e164 LIKE %s ESCAPE '\\')"
+        )
+        params = [like] if name_only else [like, like, like]
+        cur.execute(
+            f"""
+            SELECT {cols} FROM members m
+            WHERE m.status = 'active' AND {where}
+            ORDER BY {rank.format(p="%s")}, lower(m.name), m.id
+            LIMIT %s
+            """,
+            (*params, prefix, word, limit),
+        )
+    elif SQLITE_MEMBER_FTS and len(ql) >= 3:
+        # Trigram MATCH needs at least three characters; the phrase matches any substring
+        phrase = '"' + ql.replace('"', '""') + '"'
+        match = f"name : {phrase}" if name_only else phrase
+        cur.execute(
+            f"""
+            SELECT {cols} FROM members_fts JOIN members m ON m.id = members_fts.rowid
+            WHERE members_fts MATCH ? AND m.status = 'active'
+            ORDER BY {rank.format(p="?")}, lower(m.name), m.id
+            LIMIT ?
+            """,
+            (match, prefix, word, limit),
+        )
+    else:
+        where = "m.name LIKE ? ESCAPE '\\'" if name_only else (
+            "(m.name LIKE ? ESCAPE '\\' OR m.email_lower LIKE ? ESCAPE '\\' OR m.phone_e164 LIKE ? ESCAPE '\\')"
+        )
+        params = [like] if name_only else [like, like, like]
+        cur.execute(
+            f"""
+            SELECT {cols} FROM members m
+            WHERE m.status = 'active' AND {where}
+            ORDER BY {rank.format(p="?")}, lower(m.name), m.id
+            LIMIT ?
+            """,
+            (*params, prefix, word, limit),
+        )
+    rows = [dict(r) for r in cur.fetchall()]
+    con.close()
+    return rows
+
+
 def _pbkdf2_hash(pin: str, salt: bytes) -> str:
     dk = hashlib.pbkdf2_hmac("sha256", pin.encode("utf-8"), salt, 120_000)
     return dk.hex()
@@ -301,158 +899,562 @@ def ensure_qr_token(member) -> str:
         cur.execute("UPDATE members SET qr_token = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (new_token, member["id"]))
     con.commit()
     con.close()
+    invalidate_member_caches(member["id"])
     return new_token
 
 
-def generate_qr_png(data: str, box_size: int = 8, border: int = 2) -> bytes:
+def invalidate_member_caches(member_id: int | None = None, deactivated: bool = False):
+    """Drop cached member data after a write; member_id=None clears everything (bulk imports).
+
+    Recent check-ins only go stale when members were deactivated or deleted (or check-ins deleted);
+    other edits keep the repeat-scan shortcut. That invalidation reaches every worker sharing
+    SHARED_CACHE.
+    """
+    if member_id is None:
+        QR_TOKEN_CACHE.clear()
+        if deactivated:
+            RECENT_CHECKINS.reset()
+    else:
+        QR_TOKEN_CACHE.pop_matching(lambda m: m["id"] == member_id)
+        if deactivated:
+            RECENT_CHECKINS.forget(member_id)
+        # Content-addressed, so stale passes are never served; this only frees the space early
+        PKPASS_CACHE.pop_matching(lambda v: v[0] == member_id)
+        for path in _pkpass_disk_paths(member_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    MEMBER_COUNT_CACHE.clear()
+
+
+def lookup_member_by_qr_token(token: str) -> dict | None:
+    """Return {"id", "name", "status"} for the member owning token, served from QR_TOKEN_CACHE when possible."""
+    cached = QR_TOKEN_CACHE.get(token)
+    if cached is not None:
+        return cached
+    con = connect_db()
+    cur = con.cursor()
+    cur.execute(
+        ("SELECT id, name, status FROM members WHERE qr_token = %s LIMIT 1" if using_postgres() else "SELECT id, name, status FROM members WHERE qr_token = ? LIMIT 1"),
+        (token,),
+    )
+    row = cur.fetchone()
+    con.close()
+    if not row:
+        return None
+    member = {"id": row["id"], "name": row["name"], "status": row["status"]}
+    QR_TOKEN_CACHE.set(token, member)
+    return member
+
+
+def qr_png_etag(token: str, box_size: int = 8, border: int = 2) -> str:
+    # The PNG is a pure function of these inputs, so the ETag can be checked before rendering
+    key = f"{_QR_RENDER_VERSION}:{box_size}:{border}:{token}".encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def cached_qr_png(token: str, box_size: int = 8, border: int = 2) -> bytes:
+    """generate_qr_png through QR_PNG_CACHE; an empty result (render failure) is not cached."""
+    key = (token, box_size, border)
+    png = QR_PNG_CACHE.get(key)
+    if png is None:
+        png = generate_qr_png(token, box_size=box_size, border=border)
+        if png:
+            QR_PNG_CACHE.set(key, png)
+    return png
+
+
+def _pkpass_disk_paths(member_id) -> list:
+    if not PKPASS_CACHE_DIR:
+        return []
+    prefix = f"{int(member_id)}-"
     try:
-        import qrcode
-        qr = qrcode.QRCode(
-            version=None,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=box_size,
-            border=border,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        return buf.getvalue()
-    except Exception:
-        return b''
+        return [os.path.join(PKPASS_CACHE_DIR, n) for n in os.listdir(PKPASS_CACHE_DIR) if n.startswith(prefix) and n.endswith(".pkpass")]
+    except OSError:
+        return []
+
+
+def cached_member_wallet_pass(member, token: str, base_url: str, digest: str | None = None) -> WalletPassResult:
+    """build_member_wallet_pass through PKPASS_CACHE and the optional disk tier."""
+    digest = digest or wallet_pass_digest(member, token, base_url)
+    cached = PKPASS_CACHE.get(digest)
+    if cached is not None:
+        return cached[1]
+    member_id = int(member["id"])
+    path = os.path.join(PKPASS_CACHE_DIR, f"{member_id}-{digest}.pkpass") if PKPASS_CACHE_DIR else None
+    result = None
+    if path:
+        try:
+            with open(path, "rb") as fh:
+                result = WalletPassResult(filename=wallet_pass_filename(member, token), data=fh.read(), digest=digest)
+        except OSError:
+            pass
+    if result is None:
+        result = build_member_wallet_pass(member, token, base_url)
+        if path:
+            try:
+                os.makedirs(PKPASS_CACHE_DIR, exist_ok=True)
+                # Keep one pass per member on disk
+                for old in _pkpass_disk_paths(member_id):
+                    os.remove(old)
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as fh:
+                    fh.write(result.data)
+                os.replace(tmp, path)
+            except OSError as e:
+                print("Wallet pass disk cache write failed:", e)
+    PKPASS_CACHE.set(digest, (member_id, result))
+    return result
+
+
+def qr_email_context(name: str | None, token: str, base_url: str) -> dict:
+    """Per-member variables of the "your check-in QR" email (templates/email/qr_code.*)."""
+    wallet_available = WALLET_PASS_ENABLED and wallet_pass_configured()
+    full_name = (name or "").strip()
+    return {
+        "first_name": full_name.split()[0] if full_name else "there",
+        "link": f"{base_url}/member/qr?token={token}",
+        "wallet_link": f"{base_url}/member/pass.apple?token={token}" if wallet_available else None,
+    }
+
+
+def compose_qr_email(name: str | None, email: str, token: str, qr_png: bytes | None, base_url: str) -> tuple:
+    """(to_email, subject, message bytes) of the QR email; the compose step of bulk campaigns."""
+    inline = [("qr.png", qr_png, "image/png", "<qrimg>")] if qr_png else None
+    subject, message = MAIL_TEMPLATES.message(SmtpSettings.from_env(), email, "qr_code", inline, **qr_email_context(name, token, base_url))
+    return email, subject, message
+
+
+def send_message(to_email: str, subject: str, message: bytes) -> bool:
+    """Deliver synchronously on a one-off SMTP session (admin SMTP test); handlers use queue_message."""
+    settings = SmtpSettings.from_env()
+    if not settings.host:
+        print(f"[DEV] Would send email to {to_email}: {subject} ({len(message)} bytes)")
+        return True
+    session = SmtpSession()
+    try:
+        session.send(settings, to_email, message)
+        return True
+    except Exception as e:
+        print("Email send failed:", e)
+        return False
+    finally:
+        session.close()
 
 
-def upsert_member(cur, external_id: str | None, name: str, email: str | None, phone: str | None, membership_tier: str | None, status: str):
-    email_n = normalize_email(email)
-    phone_n = normalize_phone(phone)
-    if using_postgres():
-        cur.execute(
-            """
-            SELECT id FROM members
-            WHERE (
-                (external_id IS NOT NULL AND external_id = %s)
-                OR (email_lower IS NOT NULL AND email_lower = %s)
-                OR (phone_e164 IS NOT NULL AND phone_e164 = %s)
-            )
-            ORDER BY
-                CASE WHEN external_id = %s THEN 0 ELSE 1 END,
-                CASE WHEN email_lower = %s THEN 0 ELSE 1 END,
-                CASE WHEN phone_e164 = %s THEN 0 ELSE 1 END
-            LIMIT 1
-            """,
-            (external_id, email_n, phone_n, external_id, email_n, phone_n),
-        )
+def queue_message(to_email: str, subject: str, message: bytes) -> bool:
+    """Hand a message to the background mail worker; sends inline when the queue is off or unavailable."""
+    if not MAIL_QUEUE_ENABLED:
+        return send_message(to_email, subject, message)
+    try:
+        MAIL_QUEUE.enqueue(to_email, subject, message)
+        return True
+    except Exception as e:
+        # e.g. outbound_emails not migrated yet
+        print("Email enqueue failed, sending inline:", e)
+        return send_message(to_email, subject, message)
+
+
+def queue_email(to_email: str, template: str, inline_images: list | None = None, **context) -> bool:
+    """Render templates/email/<template>.* for one recipient and queue it."""
+    subject, message = MAIL_TEMPLATES.message(SmtpSettings.from_env(), to_email, template, inline_images, **context)
+    return queue_message(to_email, subject, message)
+
+
+def record_checkin(
+    member_id: int | None = None,
+    qr_token: str | None = None,
+    email: str | None = None,
+    phone: str | None = None,
+    method: str = "manual",
+    device_id: str | None = None,
+    window_minutes: int = DUP_WINDOW_MINUTES,
+) -> dict | None:
+    """Resolve an active member and record a check-in unless one exists inside the duplicate window.
+
+    The member is looked up by id, else QR token, else email/phone (email wins). Lookup, duplicate
+    check and insert share one connection and one transaction; the member row is locked first
+    (FOR UPDATE on Postgres, BEGIN IMMEDIATE on SQLite) so two simultaneous scans of the same
+    member cannot both insert.
+
+    Returns None when no active member matches, otherwise {"member_id", "name", "duplicate"}.
+    """
+    pg = using_postgres()
+    ph = "%s" if pg else "?"
+    if member_id is not None:
+        where, params = f"id = {ph}", [member_id]
+    elif qr_token:
+        where, params = f"qr_token = {ph}", [qr_token]
     else:
-        cur.execute(
-            """
-            SELECT id FROM members
-            WHERE (
-                (external_id IS NOT NULL AND external_id = ?)
-                OR (email_lower IS NOT NULL AND email_lower = ?)
-                OR (phone_e164 IS NOT NULL AND phone_e164 = ?)
-            )
-            ORDER BY
-                CASE WHEN external_id = ? THEN 0 ELSE 1 END,
-                CASE WHEN email_lower = ? THEN 0 ELSE 1 END,
-                CASE WHEN phone_e164 = ? THEN 0 ELSE 1 END
-            LIMIT 1
-            """,
-            (external_id, email_n, phone_n, external_id, email_n, phone_n),
-        )
-    existing = cur.fetchone()
-    if existing:
-        # Resolve existing id across backends
-        existing_id = existing["id"] if using_postgres() else existing[0]
-        if using_postgres():
+        email_n = normalize_email(email)
+        phone_n = normalize_phone(phone)
+        if not email_n and not phone_n:
+            return None
+        where = f"(email_lower = {ph} OR phone_e164 = {ph}) ORDER BY CASE WHEN email_lower = {ph} THEN 0 ELSE 1 END"
+        params = [email_n, phone_n, email_n]
+    con = connect_db()
+    cur = con.cursor()
+    try:
+        if pg:
+            cur.execute(f"SELECT id, name FROM members WHERE status='active' AND {where} LIMIT 1 FOR UPDATE", tuple(params))
+        else:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(f"SELECT id, name FROM members WHERE status='active' AND {where} LIMIT 1", tuple(params))
+        member = cur.fetchone()
+        if not member:
+            con.rollback()
+            return None
+        if pg:
             cur.execute(
                 """
-                UPDATE members
-                SET name = %s, email_lower = %s, phone_e164 = %s, membership_tier = %s, status = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
+                INSERT INTO check_ins(member_id, location_id, method, source_device_id, status)
+                SELECT %s, 1, %s, %s, 'ok'
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM check_ins
+                    WHERE member_id = %s AND timestamp > NOW() - make_interval(mins => %s)
+                )
+                RETURNING id, timestamp
                 """,
-                (name, email_n, phone_n, membership_tier, status, existing_id),
+                (member["id"], method, device_id, member["id"], window_minutes),
             )
         else:
             cur.execute(
                 """
-                UPDATE members
-                SET name = ?, email_lower = ?, phone_e164 = ?, membership_tier = ?, status = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
+                INSERT INTO check_ins(member_id, location_id, method, source_device_id, status)
+                SELECT ?, 1, ?, ?, 'ok'
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM check_ins
+                    WHERE member_id = ? AND timestamp > datetime('now', ?)
+                )
+                RETURNING id, timestamp
                 """,
-                (name, email_n, phone_n, membership_tier, status, existing_id),
+                (member["id"], method, device_id, member["id"], f"-{int(window_minutes)} minutes"),
             )
-        return existing_id
+        inserted = cur.fetchall()
+        con.commit()
+        if inserted:
+            _note_checkin(inserted[0]["id"], member["id"], _parse_db_timestamp(inserted[0]["timestamp"]), member["name"], method)
+        return {"member_id": member["id"], "name": member["name"], "duplicate": not inserted}
+    except Exception:
+        try:
+            con.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        con.close()
+
+
+def _parse_scan_time(value) -> datetime | None:
+    """Client scan time (ISO 8601, naive meaning UTC, or epoch milliseconds) as a naive UTC datetime."""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+        ts = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _db_utc(ts: datetime, pg: bool):
+    """Naive UTC datetime as a check_ins.timestamp parameter for either backend."""
+    return ts.replace(tzinfo=timezone.utc) if pg else ts.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def record_checkin_batch(scans: list, device_id: str, window_minutes: int = DUP_WINDOW_MINUTES) -> list:
+    """Record scans a kiosk queued while offline, in one transaction; one result per scan, in order.
+
+    Each scan is {"idempotency_key", "qr_token", "scanned_at"}. Keys are claimed in checkin_scans
+    before anything else, so a scan the kiosk sends again (after a timeout, or racing its own retry:
+    on Postgres the second claim waits for the first transaction) gets the stored result back instead
+    of a second check-in. New scans are applied in scan-time order and stored at their scan time
+    (clamped to now); a scan is a duplicate when the member has a check-in within window_minutes
+    either side of it, so a scan flushed late is judged against the visits around it. A scan within
+    window_minutes of a check-in RECENT_CHECKINS (or this batch) already knows about is answered as
+    a duplicate without the database check.
+
+    Result status: ok, duplicate, not_found, stale (older than CHECKIN_BATCH_MAX_AGE_HOURS) or invalid.
+    """
+    pg = using_postgres()
+    ph = "%s" if pg else "?"
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    oldest = now - timedelta(hours=CHECKIN_BATCH_MAX_AGE_HOURS)
+    results: list = [None] * len(scans)
+    pending: dict = {}
+    for i, scan in enumerate(scans):
+        scan = scan if isinstance(scan, dict) else {}
+        key = str(scan.get("idempotency_key") or "").strip()[:100]
+        token = str(scan.get("qr_token") or "").strip()
+        ts = _parse_scan_time(scan.get("scanned_at"))
+        if not key or not token or ts is None or key in pending:
+            results[i] = {"idempotency_key": key or None, "status": "invalid", "member_name": None}
+            continue
+        pending[key] = (i, token, min(ts, now))
+    if not pending:
+        return results
+
+    if pg:
+        insert_sql = """
+            INSERT INTO check_ins(member_id, location_id, timestamp, method, source_device_id, status)
+            SELECT %s, 1, %s, 'QR', %s, 'ok'
+            WHERE NOT EXISTS (
+                SELECT 1 FROM check_ins
+                WHERE member_id = %s AND timestamp > %s - make_interval(mins => %s) AND timestamp < %s + make_interval(mins => %s)
+            )
+            RETURNING id, timestamp
+        """
     else:
-        if using_postgres():
+        insert_sql = """
+            INSERT INTO check_ins(member_id, location_id, timestamp, method, source_device_id, status)
+            SELECT ?, 1, ?, 'QR', ?, 'ok'
+            WHERE NOT EXISTS (
+                SELECT 1 FROM check_ins
+                WHERE member_id = ? AND timestamp > datetime(?, ?) AND timestamp < datetime(?, ?)
+            )
+            RETURNING id, timestamp
+        """
+    con = connect_db()
+    cur = con.cursor()
+    noted = []
+    try:
+        if not pg:
+            cur.execute("BEGIN IMMEDIATE")
+        keys = list(pending)
+        cur.execute(
+            f"INSERT INTO checkin_scans (device_id, idempotency_key, scanned_at) VALUES {', '.join([f'({ph}, {ph}, {ph})'] * len(keys))} "
+            "ON CONFLICT (device_id, idempotency_key) DO NOTHING RETURNING idempotency_key",
+            [v for key in keys for v in (device_id, key, _db_utc(pending[key][2], pg))],
+        )
+        claimed = {r["idempotency_key"] for r in cur.fetchall()}
+
+        replayed = [key for key in keys if key not in claimed]
+        if replayed:
             cur.execute(
-                """
-                INSERT INTO members(external_id, name, email_lower, phone_e164, membership_tier, status)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
+                f"""
+                SELECT s.idempotency_key, s.status, m.name FROM checkin_scans s LEFT JOIN members m ON m.id = s.member_id
+                WHERE s.device_id = {ph} AND s.idempotency_key IN ({", ".join([ph] * len(replayed))})
                 """,
-                (external_id, name, email_n, phone_n, membership_tier, status),
+                (device_id, *replayed),
             )
-            rid = cur.fetchone()[0]
-            return rid
-        else:
+            for r in cur.fetchall():
+                results[pending[r["idempotency_key"]][0]] = {
+                    "idempotency_key": r["idempotency_key"], "status": r["status"], "member_name": r["name"], "replayed": True,
+                }
+
+        members = {}
+        tokens = sorted({pending[key][1] for key in claimed})
+        if tokens:
+            # Ordered locks, so concurrent batches touching the same members cannot deadlock
             cur.execute(
-                """
-                INSERT INTO members(external_id, name, email_lower, phone_e164, membership_tier, status)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (external_id, name, email_n, phone_n, membership_tier, status),
+                f"SELECT id, name, qr_token FROM members WHERE status='active' AND qr_token IN ({', '.join([ph] * len(tokens))}) ORDER BY id"
+                + (" FOR UPDATE" if pg else ""),
+                tokens,
             )
-            return cur.lastrowid
-
-
-def send_email(to_email: str, subject: str, body: str, body_html: str | None = None, inline_images: list | None = None) -> bool:
-    host = os.environ.get("SMTP_HOST")
-    port = int(os.environ.get("SMTP_PORT", "587"))
-    user = os.environ.get("SMTP_USER")
-    password = os.environ.get("SMTP_PASS")
-    from_raw = os.environ.get("SMTP_FROM", user or "noreply@example.com")
-    from_name = os.environ.get("SMTP_FROM_NAME")
-    if not from_name and isinstance(from_raw, str) and from_raw.lower().endswith("@gymsense.io"):
-        from_name = "GymSense"
-    from_email = formataddr((from_name, from_raw)) if from_name else from_raw
-    if not host or not user or not password:
-        print(f"[DEV] Would send email to {to_email}: {subject}\n{body}")
-        return True
+            members = {r["qr_token"]: r for r in cur.fetchall()}
+
+        # member_id -> check-in time known to be committed (or committing in this transaction)
+        recent = {}
+        for member in members.values():
+            known = RECENT_CHECKINS.get(member["id"])
+            if known:
+                recent[member["id"]] = known["timestamp"]
+        dup_window = timedelta(minutes=window_minutes)
+
+        updates = []
+        for ts, key in sorted((pending[key][2], key) for key in claimed):
+            i, token, _ = pending[key]
+            member = members.get(token)
+            check_in_id = None
+            if member is None:
+                status = "not_found"
+            elif ts < oldest:
+                status = "stale"
+            elif member["id"] in recent and abs(ts - recent[member["id"]]) < dup_window:
+                status = "duplicate"
+            else:
+                at = _db_utc(ts, pg)
+                if pg:
+                    window = (at, window_minutes, at, window_minutes)
+                else:
+                    window = (at, f"-{int(window_minutes)} minutes", at, f"+{int(window_minutes)} minutes")
+                cur.execute(insert_sql, (member["id"], at, device_id, member["id"], *window))
+                row = cur.fetchone()
+                status = "ok" if row else "duplicate"
+                if row:
+                    check_in_id = row["id"]
+                    recent[member["id"]] = ts
+                    noted.append((row["id"], member["id"], _parse_db_timestamp(row["timestamp"]), member["name"], "QR"))
+            updates.append((status, member["id"] if member else None, check_in_id, device_id, key))
+            results[i] = {"idempotency_key": key, "status": status, "member_name": member["name"] if member else None}
+        if updates:
+            cur.executemany(
+                f"UPDATE checkin_scans SET status = {ph}, member_id = {ph}, check_in_id = {ph} WHERE device_id = {ph} AND idempotency_key = {ph}",
+                updates,
+            )
+        con.commit()
+    except Exception:
+        try:
+            con.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        con.close()
+    for args in noted:
+        _note_checkin(*args)
+    _prune_scan_keys()
+    return results
+
+
+_SCAN_KEYS_PRUNED_AT = 0.0
+
+
+def _prune_scan_keys():
+    """Forget batch idempotency keys after CHECKIN_SCAN_KEY_RETENTION_DAYS (at most hourly per process)."""
+    global _SCAN_KEYS_PRUNED_AT
+    if time.monotonic() - _SCAN_KEYS_PRUNED_AT < 3600:
+        return
+    _SCAN_KEYS_PRUNED_AT = time.monotonic()
+    pg = using_postgres()
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=CHECKIN_SCAN_KEY_RETENTION_DAYS)
+    con = connect_db()
     try:
-        if body_html:
-            # Build a related container so we can embed images by CID
-            root = MIMEMultipart('related')
-            root['Subject'] = subject
-            root['From'] = from_email
-            root['To'] = to_email
-            alt = MIMEMultipart('alternative')
-            root.attach(alt)
-            alt.attach(MIMEText(body, 'plain'))
-            alt.attach(MIMEText(body_html, 'html'))
-            if inline_images:
-                for (filename, content, mimetype, cid) in inline_images:
-                    try:
-                        img = MIMEImage(content, _subtype=mimetype.split('/')[-1])
-                        img.add_header('Content-ID', cid)
-                        img.add_header('Content-Disposition', 'inline', filename=filename)
-                        root.attach(img)
-                    except Exception:
-                        pass
-            msg = root
-        else:
-            msg = MIMEText(body, "plain")
-            msg["Subject"] = subject
-            msg["From"] = from_email
-            msg["To"] = to_email
-        with smtplib.SMTP(host, port) as server:
-            server.starttls()
-            server.login(user, password)
-            server.send_message(msg)
-        return True
+        cur = con.cursor()
+        cur.execute(f"DELETE FROM checkin_scans WHERE received_at < {'%s' if pg else '?'}", (_db_utc(cutoff, pg),))
+        con.commit()
     except Exception as e:
-        print("Email send failed:", e)
-        return False
+        print("Pruning checkin_scans failed:", e)
+    finally:
+        con.close()
+
+
+def _parse_db_timestamp(ts_val) -> datetime:
+    """Normalize a check_ins.timestamp value from either backend to a naive UTC datetime."""
+    if isinstance(ts_val, datetime):
+        ts = ts_val
+    else:
+        try:
+            ts = datetime.fromisoformat(str(ts_val))
+        except Exception:
+            ts = datetime.strptime(str(ts_val), "%Y-%m-%d %H:%M:%S")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _note_checkin(check_in_id: int, member_id: int, ts: datetime, name: str | None, method: str | None):
+    """Count a committed check-in and announce it to staff dashboard streams (once per id)."""
+    RECENT_CHECKINS.note(member_id, ts, name)
+    if CHECKIN_COUNTERS.observe(check_in_id, member_id, ts):
+        STAFF_EVENTS.publish(
+            "checkin",
+            {
+                "id": check_in_id,
+                "name": name,
+                "method": method,
+                "timestamp": ts.isoformat(timespec="seconds") + "Z",
+                "metrics": CHECKIN_COUNTERS.snapshot(),
+            },
+            event_id=check_in_id,
+        )
+
+
+_COUNTERS_LOCK = threading.Lock()
+_COUNTERS_SYNCED_AT = 0.0
+_COUNTERS_REBUILT_AT = 0.0
+
+
+def maintain_checkin_partitions():
+    """Create upcoming monthly check_ins partitions and archive old ones (Postgres only)."""
+    if not using_postgres():
+        return
+    con = connect_db(); cur = con.cursor()
+    try:
+        cur.execute("SELECT public.ensure_check_ins_partitions(%s) AS created", (CHECKINS_PARTITIONS_AHEAD,))
+        created = cur.fetchone()["created"]
+        archived = []
+        if CHECKINS_ARCHIVE_AFTER_MONTHS > 0:
+            cur.execute("SELECT public.archive_check_ins_partitions(%s) AS name", (CHECKINS_ARCHIVE_AFTER_MONTHS,))
+            archived = [r["name"] for r in cur.fetchall()]
+        con.commit()
+    except Exception as e:
+        # e.g. the partitioning migration has not been applied yet
+        print("check_ins partition maintenance failed:", e)
+        return
+    finally:
+        con.close()
+    if created or archived:
+        print(f"check_ins partitions: created {created}, archived {', '.join(archived) or 'none'}")
+
+
+def rebuild_checkin_counters():
+    """Reload CHECKIN_COUNTERS from the check-ins of the last history_days days, and RECENT_CHECKINS
+    from the ones inside the duplicate window."""
+    global _COUNTERS_SYNCED_AT, _COUNTERS_REBUILT_AT
+    since = datetime.utcnow().date() - timedelta(days=CHECKIN_COUNTERS.history_days - 1)
+    con = connect_db(); cur = con.cursor()
+    try:
+        cur.execute(
+            ("SELECT ci.id, ci.member_id, ci.timestamp, m.name FROM check_ins ci JOIN members m ON m.id = ci.member_id "
+             "WHERE ci.timestamp >= %s ORDER BY ci.id" if using_postgres() else
+             "SELECT ci.id, ci.member_id, ci.timestamp, m.name FROM check_ins ci JOIN members m ON m.id = ci.member_id "
+             "WHERE ci.timestamp >= ? ORDER BY ci.id"),
+            (since.isoformat(),),
+        )
+        rows = [(r["id"], r["member_id"], _parse_db_timestamp(r["timestamp"]), r["name"]) for r in cur.fetchall()]
+    finally:
+        con.close()
+    CHECKIN_COUNTERS.load((check_in_id, member_id, ts) for check_in_id, member_id, ts, _ in rows)
+    RECENT_CHECKINS.load((member_id, ts, name) for _, member_id, ts, name in rows)
+    # The first load primes the staff feed; later check-ins reach it through _note_checkin
+    STAFF_EVENTS.resume_from(CHECKIN_COUNTERS.high_id)
+    _COUNTERS_SYNCED_AT = _COUNTERS_REBUILT_AT = time.monotonic()
+
+
+def sync_checkin_counters(force: bool = False):
+    """Fold in check-ins committed by other workers since the last sync (rate-limited)."""
+    global _COUNTERS_SYNCED_AT
+    now = time.monotonic()
+    if not force and now - _COUNTERS_SYNCED_AT < COUNTERS_SYNC_SECONDS:
+        return
+    with _COUNTERS_LOCK:
+        if not force and time.monotonic() - _COUNTERS_SYNCED_AT < COUNTERS_SYNC_SECONDS:
+            return
+        if not CHECKIN_COUNTERS.ready:
+            maintain_checkin_partitions()
+            rebuild_checkin_counters()
+            return
+        gaps = CHECKIN_COUNTERS.pending_gaps()
+        ph = "%s" if using_postgres() else "?"
+        where = f"ci.id > {ph}"
+        if gaps:
+            where += f" OR ci.id IN ({', '.join([ph] * len(gaps))})"
+        # Older rows are outside the counters anyway; the bound keeps Postgres to the newest partitions
+        since = datetime.utcnow().date() - timedelta(days=CHECKIN_COUNTERS.history_days - 1)
+        con = connect_db(); cur = con.cursor()
+        try:
+            cur.execute(
+                f"""
+                SELECT ci.id, ci.member_id, ci.timestamp, ci.method, m.name
+                FROM check_ins ci JOIN members m ON m.id = ci.member_id
+                WHERE ({where}) AND ci.timestamp >= {ph}
+                ORDER BY ci.id
+                """,
+                tuple([CHECKIN_COUNTERS.high_id] + gaps + [since.isoformat()]),
+            )
+            rows = cur.fetchall()
+        finally:
+            con.close()
+        for r in rows:
+            _note_checkin(r["id"], r["member_id"], _parse_db_timestamp(r["timestamp"]), r["name"], r["method"])
+        _COUNTERS_SYNCED_AT = time.monotonic()
+        # After the catch-up, so the staff feed has announced everything the rebuild folds in
+        if now - _COUNTERS_REBUILT_AT > COUNTERS_REBUILD_SECONDS:
+            maintain_checkin_partitions()
+            rebuild_checkin_counters()
 
 
 def _map_csv_row(row: dict) -> dict | None:
@@ -468,10 +1470,189 @@ def _map_csv_row(row: dict) -> dict | None:
     return {"external_id": external_id, "name": name, "email": email, "phone": phone, "tier": tier, "status": status}
 
 
+def iter_csv_chunks(stream, chunk_rows: int = CSV_CHUNK_ROWS):
+    """Yield lists of up to chunk_rows _map_csv_row results, decoding the upload as it is read."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="ignore", newline="")
+    try:
+        chunk = []
+        for row in csv.DictReader(text):
+            mapped = _map_csv_row(row)
+            if mapped:
+                chunk.append(mapped)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        # Leave the upload stream open for werkzeug to clean up
+        text.detach()
+
+
+def _import_row(p: dict) -> dict:
+    """Normalize a _map_csv_row result into the columns MemberImport stages."""
+    return {
+        "external_id": p["external_id"],
+        "name": p["name"],
+        "email_lower": normalize_email(p["email"]),
+        "phone_e164": normalize_phone(p["phone"]),
+        "membership_tier": p["tier"],
+        "status": p["status"],
+    }
+
+
+_STRIPE_CONFIG = None
+_STRIPE_LOCK = threading.Lock()
+
+
+def stripe_client():
+    """The stripe module, configured once per process: API key (and STRIPE_API_BASE, e.g. a local
+    stripe-mock) from env, and one HTTP client with bounded timeouts that keeps a keep-alive session per thread."""
+    global _STRIPE_CONFIG
+    if stripe is None:
+        raise RuntimeError("stripe is not installed")
+    config = (os.environ.get("STRIPE_API_KEY"), os.environ.get("STRIPE_API_BASE"))
+    if _STRIPE_CONFIG != config:
+        with _STRIPE_LOCK:
+            if _STRIPE_CONFIG != config:
+                stripe.api_key = config[0]
+                if config[1]:
+                    stripe.api_base = config[1]
+                stripe.default_http_client = stripe.http_client.RequestsClient(
+                    timeout=(min(STRIPE_TIMEOUT_SECONDS, 5.0), STRIPE_TIMEOUT_SECONDS)
+                )
+                # Retries of POSTs reuse the request's idempotency key, so they cannot double-create
+                stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+                _STRIPE_CONFIG = config
+    return stripe
+
+
+# Signup customers: members.stripe_customer_id, then this cache, before creating one (see stripe_customers.py)
+STRIPE_CUSTOMERS = StripeCustomers(
+    connect=lambda: connect_db(),
+    postgres=bool(DATABASE_URL),
+    cache=TTLCache(max_entries=1024, ttl_seconds=24 * 3600),
+)
+
+
+def process_checkout_completed(event: dict, base_url: str) -> None:
+    """Webhook inbox handler: upsert the member of a completed Checkout Session and email their QR.
+
+    Raises on failure so the inbox retries; a repeat finds the member by email and only re-sends the email.
+    """
+    sess = event["data"]["object"]
+    try:
+        sess_full = stripe_client().checkout.Session.retrieve(sess.get("id"), expand=["customer"])
+    except Exception as e:
+        print("Checkout Session retrieve failed, using the event payload:", e)
+        sess_full = sess
+    cust = sess_full.get("customer") if isinstance(sess_full.get("customer"), dict) else None
+    customer_id = cust.get("id") if cust else sess_full.get("customer")
+    customer_email = (sess_full.get("customer_details") or {}).get("email")
+    if not customer_email:
+        customer_email = sess_full.get("customer_email") or (sess_full.get("metadata") or {}).get("app_member_email")
+    if not customer_email:
+        return
+    email_n = normalize_email(customer_email)
+    name = (sess_full.get("metadata") or {}).get("app_member_name") or (cust.get("name") if cust else None) or "Member"
+    phone_n = normalize_phone(cust.get("phone") if cust else None)
+
+    ph = "%s" if using_postgres() else "?"
+    con = connect_db()
+    try:
+        cur = con.cursor()
+        cur.execute(f"SELECT id, qr_token FROM members WHERE email_lower = {ph} LIMIT 1", (email_n,))
+        row = cur.fetchone()
+        if row:
+            member_id, token = row["id"], row["qr_token"]
+            cur.execute(
+                f"UPDATE members SET name={ph}, phone_e164={ph}, stripe_customer_id={ph}, updated_at=CURRENT_TIMESTAMP WHERE id={ph}",
+                (name, phone_n, customer_id, member_id),
+            )
+        else:
+            token = None
+            sql = f"INSERT INTO members(name, email_lower, phone_e164, status, stripe_customer_id) VALUES ({ph},{ph},{ph},'active',{ph})"
+            if using_postgres():
+                cur.execute(sql + " RETURNING id", (name, email_n, phone_n, customer_id))
+                member_id = cur.fetchone()["id"]
+            else:
+                cur.execute(sql, (name, email_n, phone_n, customer_id))
+                member_id = cur.lastrowid
+        if not token:
+            token = secrets.token_urlsafe(24)
+            cur.execute(f"UPDATE members SET qr_token={ph}, updated_at=CURRENT_TIMESTAMP WHERE id={ph}", (token, member_id))
+        con.commit()
+    finally:
+        con.close()
+    invalidate_member_caches(member_id)
+
+    if not queue_email(customer_email, "welcome", name=name, link=f"{base_url}/member/qr?token={token}"):
+        raise RuntimeError(f"Welcome email to {customer_email} could not be sent")
+
+
+# Stripe webhooks are stored by the route and handled here, off the request path
+WEBHOOK_INBOX = WebhookInbox(
+    connect=lambda: connect_background_db(),
+    postgres=bool(DATABASE_URL),
+    handlers={"checkout.session.completed": process_checkout_completed},
+    max_attempts=int(os.environ.get("CHECKIN_WEBHOOK_MAX_ATTEMPTS", "8")),
+    backoff_seconds=float(os.environ.get("CHECKIN_WEBHOOK_BACKOFF_SECONDS", "30")),
+)
+
+CAMPAIGNS = CampaignRunner(
+    connect=lambda: connect_background_db(),
+    postgres=bool(DATABASE_URL),
+    mail_queue=MAIL_QUEUE,
+    # Rendered in spawned worker processes, which import qr_render to unpickle this
+    render_png=functools.partial(generate_qr_png, box_size=10, border=2),
+    compose=compose_qr_email,
+    processes=CAMPAIGN_RENDER_PROCESSES,
+    batch_size=CAMPAIGN_BATCH_SIZE,
+)
+
+
 def create_app():
     init_db()
+    maintain_checkin_partitions()
+    try:
+        rebuild_checkin_counters()
+    except Exception as e:
+        # Retried by the first sync_checkin_counters() call
+        print("Check-in counters rebuild failed:", e)
+    if MAIL_QUEUE_ENABLED:
+        MAIL_QUEUE.start()
+        try:
+            CAMPAIGNS.resume_stale()
+        except Exception as e:
+            # e.g. email_campaigns not migrated yet
+            print("Campaign resume failed:", e)
+    if STAFF_SIGNUP_ENABLED:
+        WEBHOOK_INBOX.start()
     app = Flask(__name__, static_folder="static", template_folder="templates")
     app.secret_key = SESSION_SECRET
+    app.teardown_appcontext(release_request_connections)
+    try:
+        asset_manifest = ensure_assets(app.static_folder, ASSET_DIR)
+    except Exception as e:
+        # Pages fall back to the plain /static/ URLs
+        print("Asset build failed:", e)
+        asset_manifest = {}
+    built_assets = set(asset_manifest.values())
+
+    def asset_url(logical: str) -> str:
+        built = asset_manifest.get(logical)
+        return f"/assets/{built}" if built else f"/static/{logical}"
+
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    def send_built_asset(built: str, max_age: int, immutable: bool = False):
+        path, encoding = negotiate(ASSET_DIR, built, request.headers.get("Accept-Encoding", ""))
+        response = send_file(path, mimetype=content_type(built), conditional=True, etag=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+        return response
 
     @app.get("/")
     def root():
@@ -587,39 +1768,49 @@ def create_app():
         if not api_key:
             return jsonify({"ok": False, "error": "Stripe not configured"}), 501
         try:
-            import stripe
-            stripe.api_key = api_key
-            # Create or reuse Customer
-            customer = stripe.Customer.create(
-                name=name,
-                email=email,
-                phone=phone or None,
-                address={"line1": address} if address else None,
-                metadata={"birthday": birthday} if birthday else None,
-            )
-            session_obj = stripe.checkout.Session.create(
-                mode="subscription",
-                customer=customer.id,
-                line_items=[{"price": tier_price, "quantity": 1}],
-                success_url=success_url + "?session_id={CHECKOUT_SESSION_ID}",
-                cancel_url=cancel_url,
-                locale="en",
-                metadata={"app_member_email": email, "app_member_name": name},
-            )
+            client = stripe_client()
+            email_n = normalize_email(email)
+            details = {
+                "name": name,
+                "phone": phone or None,
+                "address": {"line1": address} if address else None,
+                "metadata": {"birthday": birthday} if birthday else None,
+            }
+
+            def create_session(customer_id):
+                return client.checkout.Session.create(
+                    mode="subscription",
+                    customer=customer_id,
+                    line_items=[{"price": tier_price, "quantity": 1}],
+                    success_url=success_url + "?session_id={CHECKOUT_SESSION_ID}",
+                    cancel_url=cancel_url,
+                    locale="en",
+                    metadata={"app_member_email": email, "app_member_name": name},
+                )
+
+            # Reuse the member's (or this form's earlier) customer; create one only on a miss
+            customer_id, _ = STRIPE_CUSTOMERS.resolve(client, email_n, **details)
+            try:
+                session_obj = create_session(customer_id)
+            except client.error.InvalidRequestError as e:
+                if e.code != "resource_missing" or e.param != "customer":
+                    raise
+                STRIPE_CUSTOMERS.forget(email_n, customer_id)
+                customer_id, _ = STRIPE_CUSTOMERS.resolve(client, email_n, replaces=customer_id, **details)
+                session_obj = create_session(customer_id)
             return jsonify({"ok": True, "url": session_obj.url})
         except Exception as e:
             return jsonify({"ok": False, "error": f"Stripe error: {str(e)}"}), 500
 
     @app.post("/webhooks/stripe")
     def stripe_webhook():
-        # Verify signature and handle key subscription events
+        # Verify the signature and store the event; WEBHOOK_INBOX processes it in the background
         if not STAFF_SIGNUP_ENABLED:
             return ("OK", 200)
         payload = request.get_data()
         sig = request.headers.get("Stripe-Signature", "")
         secret = os.environ.get("STRIPE_WEBHOOK_SECRET")
         try:
-            import stripe
             if not secret:
                 # If not configured, acknowledge to avoid retries during scaffold
                 return ("OK", 200)
@@ -628,82 +1819,29 @@ def create_app():
             return ("Bad signature", 400)
 
         try:
-            if event and event.get("type") == "checkout.session.completed":
-                sess = event["data"]["object"]
-                stripe.api_key = os.environ.get("STRIPE_API_KEY")
-                # Retrieve full session with line items
-                session_id = sess.get("id")
-                try:
-                    sess_full = stripe.checkout.Session.retrieve(session_id, expand=["line_items", "customer", "subscription"])
-                except Exception:
-                    sess_full = sess
-                cust = sess_full.get("customer") if isinstance(sess_full.get("customer"), dict) else None
-                customer_id = (cust.get("id") if cust else sess_full.get("customer"))
-                customer_email = None
-                if sess_full.get("customer_details"):
-                    customer_email = sess_full["customer_details"].get("email")
-                if not customer_email:
-                    customer_email = sess_full.get("customer_email") or (sess_full.get("metadata") or {}).get("app_member_email")
-                customer_name = (sess_full.get("metadata") or {}).get("app_member_name")
-
-                # Extract price and subscription ids
-                price_id = None
-                if sess_full.get("line_items") and sess_full["line_items"].get("data"):
-                    li = sess_full["line_items"]["data"][0]
-                    if li.get("price"):
-                        price_id = li["price"].get("id")
-                subscription_id = sess_full.get("subscription") if isinstance(sess_full.get("subscription"), str) else (sess_full.get("subscription") or {}).get("id")
-
-                    # Upsert member record (tier stored on members table)
-                if customer_email:
-                    email_n = normalize_email(customer_email)
-                    name = customer_name or (cust.get("name") if cust else None) or "Member"
-                    phone = (cust.get("phone") if cust else None)
-                    con = connect_db(); cur = con.cursor()
-                    # Find existing member by email
-                    if using_postgres():
-                        cur.execute("SELECT id FROM members WHERE email_lower = %s LIMIT 1", (email_n,))
-                    else:
-                        cur.execute("SELECT id FROM members WHERE email_lower = ? LIMIT 1", (email_n,))
-                    row = cur.fetchone()
-                    if row:
-                        member_id = row[0] if isinstance(row, (list, tuple)) else (row.get("id") if isinstance(row, dict) else row[0])
-                        # Update basic fields + stripe_customer_id
-                        if using_postgres():
-                            cur.execute("UPDATE members SET name=%s, phone_e164=%s, stripe_customer_id=%s, updated_at=CURRENT_TIMESTAMP WHERE id=%s", (name, normalize_phone(phone), customer_id, member_id))
-                        else:
-                            cur.execute("UPDATE members SET name=?, phone_e164=?, stripe_customer_id=?, updated_at=CURRENT_TIMESTAMP WHERE id=?", (name, normalize_phone(phone), customer_id, member_id))
-                    else:
-                        # Insert new member
-                        if using_postgres():
-                            cur.execute("INSERT INTO members(name, email_lower, phone_e164, status, stripe_customer_id) VALUES (%s,%s,%s,'active',%s) RETURNING id", (name, email_n, normalize_phone(phone), customer_id))
-                            member_id = cur.fetchone()[0]
-                        else:
-                            cur.execute("INSERT INTO members(name, email_lower, phone_e164, status, stripe_customer_id) VALUES (?,?,?,?,?)", (name, email_n, normalize_phone(phone), 'active', customer_id))
-                            member_id = cur.lastrowid
-
-                    # Ensure QR token
-                    if using_postgres():
-                        cur.execute("SELECT qr_token FROM members WHERE id=%s", (member_id,))
-                    else:
-                        cur.execute("SELECT qr_token FROM members WHERE id=?", (member_id,))
-                    tokrow = cur.fetchone()
-                    token = (tokrow[0] if isinstance(tokrow, (list, tuple)) else (tokrow.get("qr_token") if tokrow else None)) if tokrow else None
-                    if not token:
-                        token = secrets.token_urlsafe(24)
-                        if using_postgres():
-                            cur.execute("UPDATE members SET qr_token=%s, updated_at=CURRENT_TIMESTAMP WHERE id=%s", (token, member_id))
-                        else:
-                            cur.execute("UPDATE members SET qr_token=?, updated_at=CURRENT_TIMESTAMP WHERE id=?", (token, member_id))
-
-                    con.commit(); con.close()
-
-                    # Send QR email
-                    send_email(customer_email, "Your Atlas Gym Check-In Code", (
-                        f"Hi {name},\n\nYour membership is active. Open your QR code here:\n{request.url_root.rstrip('/')}/member/qr?token={token}\n\nSee you at Atlas!\n\nGymSense — Your gym operations, simplified."))
-            return ("OK", 200)
-        except Exception:
-            return ("OK", 200)
+            WEBHOOK_INBOX.record("stripe", event["id"], event["type"], payload, request.url_root.rstrip("/"))
+        except Exception as e:
+            # Not acknowledged, so Stripe delivers it again later
+            print("Stripe webhook could not be stored:", e)
+            return ("Inbox unavailable", 503)
+        return ("OK", 200)
+
+    @app.get("/api/admin/webhooks")
+    def api_admin_webhooks():
+        require_admin()
+        try:
+            return jsonify({"ok": True, **WEBHOOK_INBOX.stats(), "dead_letters": WEBHOOK_INBOX.dead_letters()})
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
+
+    @app.post("/api/admin/webhooks/retry")
+    def api_admin_webhooks_retry():
+        require_admin()
+        ids = (request.get_json(silent=True) or {}).get("ids") or []
+        try:
+            return jsonify({"ok": True, "retried": WEBHOOK_INBOX.retry(ids)})
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "ids must be a list of dead letter ids"}), 400
 
     # --- Signup success/cancel placeholders ---
     @app.get("/join/success")
@@ -718,157 +1856,158 @@ def create_app():
             abort(404)
         return render_template("checkin/join_cancel.html")
 
-    @app.get("/api/staff/metrics")
-    def api_staff_metrics():
-        require_admin()
+    def _staff_metrics_payload() -> dict:
+        sync_checkin_counters()
+        counts = CHECKIN_COUNTERS.snapshot()
+        con = connect_db(); cur = con.cursor()
         try:
-            con = connect_db(); cur = con.cursor()
-            # Today totals
-            if using_postgres():
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= CURRENT_DATE AND timestamp < CURRENT_DATE + INTERVAL '1 day'")
-            else:
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE date(timestamp) = date('now')")
-            row = cur.fetchone() or {}
-            today_total = (row[0] if isinstance(row, (list, tuple)) else row.get('c', 0))
-
-            # Last hour total
-            if using_postgres():
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= NOW() - INTERVAL '1 hour'")
-            else:
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= datetime('now','-1 hour')")
-            row = cur.fetchone() or {}
-            last_hour_total = (row[0] if isinstance(row, (list, tuple)) else row.get('c', 0))
-
-            if using_postgres():
-                cur.execute("SELECT COUNT(DISTINCT member_id) AS c FROM check_ins WHERE timestamp >= CURRENT_DATE AND timestamp < CURRENT_DATE + INTERVAL '1 day'")
-            else:
-                cur.execute("SELECT COUNT(DISTINCT member_id) AS c FROM check_ins WHERE date(timestamp) = date('now')")
-            row = cur.fetchone() or {}
-            today_unique = (row[0] if isinstance(row, (list, tuple)) else row.get('c', 0))
-
             # Recent check-ins (last 10)
             cur.execute(
-                ("""
-                 SELECT ci.timestamp, ci.method, m.name
-                 FROM check_ins ci JOIN members m ON m.id = ci.member_id
-                 ORDER BY ci.timestamp DESC LIMIT 10
-                 """ if using_postgres() else
-                 """
-                 SELECT ci.timestamp, ci.method, m.name
-                 FROM check_ins ci JOIN members m ON m.id = ci.member_id
-                 ORDER BY ci.timestamp DESC LIMIT 10
-                 """
-                )
+                """
+                SELECT ci.id, ci.timestamp, ci.method, m.name
+                FROM check_ins ci JOIN members m ON m.id = ci.member_id
+                ORDER BY ci.timestamp DESC LIMIT 10
+                """
             )
             recents = []
             for r in cur.fetchall():
-                if using_postgres():
-                    recents.append({"timestamp": str(r.get("timestamp")), "method": r.get("method"), "name": r.get("name")})
-                else:
-                    recents.append({"timestamp": r[0], "method": r[1], "name": r[2]})
+                recents.append({"id": r["id"], "timestamp": str(r["timestamp"]), "method": r["method"], "name": r["name"]})
+        finally:
+            con.close()
+        return {
+            "ok": True,
+            "today_total": counts["today_total"],
+            "last_hour_total": counts["last_hour_total"],
+            "today_unique": counts["today_unique"],
+            "trend": counts["trend"],
+            "recent": recents,
+        }
 
-            # 7-day trend (fill missing days in Python)
-            if using_postgres():
-                cur.execute("SELECT date(timestamp) AS d, COUNT(*) AS c FROM check_ins WHERE timestamp >= CURRENT_DATE - INTERVAL '6 days' GROUP BY d ORDER BY d ASC")
-                rows = cur.fetchall()
-                counts = {}
-                for r in rows:
-                    dval = (r.get('d') if not isinstance(r, (list, tuple)) else r[0])
-                    cval = (r.get('c') if not isinstance(r, (list, tuple)) else r[1])
-                    counts[str(dval)] = int(cval or 0)
-            else:
-                cur.execute("SELECT date(timestamp) AS d, COUNT(*) AS c FROM check_ins WHERE date(timestamp) >= date('now','-6 day') GROUP BY d ORDER BY d ASC")
-                rows = cur.fetchall()
-                counts = {}
-                for r in rows:
-                    # sqlite row supports key access
-                    dval = r['d'] if hasattr(r, '__getitem__') and 'd' in r.keys() else (r[0] if isinstance(r,(list,tuple)) else r[0])
-                    cval = r['c'] if hasattr(r, '__getitem__') and 'c' in r.keys() else (r[1] if isinstance(r,(list,tuple)) else r[1])
-                    counts[str(dval)] = int(cval or 0)
-            from datetime import date, timedelta
-            today = date.today()
-            trend = []
-            for i in range(6, -1, -1):
-                d = today - timedelta(days=i)
-                ds = d.isoformat()
-                trend.append({"date": ds, "count": int(counts.get(ds, 0) or 0)})
+    def _staff_metrics_etag() -> str:
+        # The payload only changes with the counters or a new check-in, so an unchanged dashboard is
+        # answered from memory without the recent check-ins query
+        sync_checkin_counters()
+        key = json.dumps([CHECKIN_COUNTERS.high_id, CHECKIN_COUNTERS.snapshot()], separators=(",", ":"))
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
-            con.close()
-            return jsonify({
-                "ok": True,
-                "today_total": today_total,
-                "last_hour_total": last_hour_total,
-                "today_unique": today_unique,
-                "trend": trend,
-                "recent": recents,
-            })
+    @app.get("/api/staff/metrics")
+    def api_staff_metrics():
+        require_admin()
+        try:
+            etag = _staff_metrics_etag()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = jsonify(_staff_metrics_payload())
         except Exception as e:
-            try:
-                con.close()
-            except Exception:
-                pass
             return jsonify({"ok": False, "error": str(e)}), 500
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
 
-    @app.get("/api/kiosk/status")
-    def api_kiosk_status():
+    @app.get("/api/staff/stream")
+    def api_staff_stream():
+        require_admin()
         try:
-            con = connect_db(); cur = con.cursor()
-
-            if using_postgres():
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= CURRENT_DATE AND timestamp < CURRENT_DATE + INTERVAL '1 day'")
-            else:
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE date(timestamp) = date('now')")
-            row = cur.fetchone() or {}
-            today_total = (row[0] if isinstance(row, (list, tuple)) else row.get('c', 0))
+            last_event_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or "")
+        except ValueError:
+            last_event_id = None
+        resume = STAFF_EVENTS.replay(last_event_id) if last_event_id is not None else None
+        if not _SSE_SLOTS.acquire(blocking=False):
+            # Over the cap: 204 stops EventSource from reconnecting, and the page polls
+            # /api/staff/metrics (a 304 while nothing changed) until it retries the stream
+            return Response(status=204)
+
+        def opening():
+            # The events after Last-Event-ID when the buffer still holds all of them; otherwise (first
+            # connect, buffer rolled over, or an id older than this worker's feed) a full snapshot.
+            # The snapshot's id is the newest check-in it covers, so a quiet dashboard resumes too.
+            if resume is not None:
+                seq, events = resume
+                for _, event_id, event, payload in events:
+                    yield format_sse(event, payload, event_id)
+                return seq
+            seq = STAFF_EVENTS.current_seq()
+            payload = _staff_metrics_payload()
+            yield format_sse("snapshot", json.dumps(payload, default=str), CHECKIN_COUNTERS.high_id)
+            return seq
+
+        def stream():
+            yield "retry: 2000\n\n"
+            seq = yield from opening()
+            deadline = time.monotonic() + SSE_MAX_SECONDS
+            last_write = time.monotonic()
+            while time.monotonic() < deadline:
+                sync_checkin_counters()
+                remaining = deadline - time.monotonic()
+                if STAFF_EVENTS.wait(seq, timeout=max(0.0, min(COUNTERS_SYNC_SECONDS, SSE_HEARTBEAT_SECONDS, remaining))):
+                    for seq, event_id, event, payload in STAFF_EVENTS.after(seq):
+                        yield format_sse(event, payload, event_id)
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write >= SSE_HEARTBEAT_SECONDS:
+                    yield ": ping\n\n"
+                    last_write = time.monotonic()
+
+        response = Response(stream_with_context(stream()), mimetype="text/event-stream")
+        # Released when the server closes the response, even if the body was never iterated
+        response.call_on_close(_SSE_SLOTS.release)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
 
-            if using_postgres():
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= NOW() - INTERVAL '1 hour'")
-            else:
-                cur.execute("SELECT COUNT(*) AS c FROM check_ins WHERE timestamp >= datetime('now','-1 hour')")
-            row = cur.fetchone() or {}
-            last_hour_total = (row[0] if isinstance(row, (list, tuple)) else row.get('c', 0))
-
-            count = int(last_hour_total or 0)
-            if count >= 25:
-                level = "peak"
-                headline = "Peak hour right now"
-                detail = f"{count} check-ins in the past 60 minutes."
-            elif count >= 12:
-                level = "steady"
-                headline = "Steady floor traffic"
-                detail = f"{count} check-ins this hour."
-            elif count > 0:
-                level = "calm"
-                headline = "Calm moment to check in"
-                detail = f"Only {count} check-ins this hour."
-            else:
-                level = "calm"
-                headline = "You are first to arrive"
-                detail = "No check-ins logged in the past hour yet."
+    def _kiosk_status_payload() -> dict:
+        sync_checkin_counters()
+        counts = CHECKIN_COUNTERS.snapshot()
+        today_total = counts["today_total"]
+        count = int(counts["last_hour_total"] or 0)
+        if count >= 25:
+            level = "peak"
+            headline = "Peak hour right now"
+            detail = f"{count} check-ins in the past 60 minutes."
+        elif count >= 12:
+            level = "steady"
+            headline = "Steady floor traffic"
+            detail = f"{count} check-ins this hour."
+        elif count > 0:
+            level = "calm"
+            headline = "Calm moment to check in"
+            detail = f"Only {count} check-ins this hour."
+        else:
+            level = "calm"
+            headline = "You are first to arrive"
+            detail = "No check-ins logged in the past hour yet."
 
-            messages = [
-                {"label": headline, "subtext": detail, "level": level},
-                {"label": "So far today", "subtext": f"{int(today_total or 0)} check-ins logged."},
-            ]
+        messages = [
+            {"label": headline, "subtext": detail, "level": level},
+            {"label": "So far today", "subtext": f"{int(today_total or 0)} check-ins logged."},
+        ]
+        return {
+            "ok": True,
+            "busyness": {
+                "level": level,
+                "label": headline,
+                "detail": detail,
+                "last_hour_total": count,
+                "today_total": int(today_total or 0),
+            },
+            "messages": messages,
+        }
 
-            con.close()
-            return jsonify({
-                "ok": True,
-                "busyness": {
-                    "level": level,
-                    "label": headline,
-                    "detail": detail,
-                    "last_hour_total": count,
-                    "today_total": int(today_total or 0),
-                },
-                "messages": messages,
-            })
+    @app.get("/api/kiosk/status")
+    def api_kiosk_status():
+        location_id = 1
+        try:
+            body, etag = KIOSK_STATUS_CACHE.get_or_compute(
+                f"location:{location_id}",
+                lambda: json.dumps(_kiosk_status_payload(), separators=(",", ":")).encode("utf-8"),
+            )
         except Exception as e:
-            try:
-                con.close()
-            except Exception:
-                pass
             return jsonify({"ok": False, "error": str(e)}), 500
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        # Kiosks revalidate every poll; an unchanged payload comes back as an empty 304
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
 
     @app.get("/admin/members")
     def admin_members_page():
@@ -876,84 +2015,103 @@ def create_app():
             return redirect(url_for("admin_login", next="/admin/members"))
         return render_template("checkin/admin_members.html", datetime=datetime)
 
-    def _query_members_list(q: str | None, tier: str | None, status: str | None, page: int, per_page: int):
+    def _member_group_counts(cur) -> dict:
+        counts = MEMBER_COUNT_CACHE.get("groups")
+        if counts is None:
+            cur.execute("SELECT status, membership_tier, COUNT(*) AS c FROM members GROUP BY status, membership_tier")
+            counts = {(r["status"], r["membership_tier"]): int(r["c"]) for r in cur.fetchall()}
+            MEMBER_COUNT_CACHE.set("groups", counts)
+        return counts
+
+    def _members_total(cur, q, tier, status, base: str, params: list, estimate: bool) -> tuple[int, bool]:
+        """Total for a member list filter and whether it is a planner estimate."""
+        if not q:
+            return sum(
+                c for (s, t), c in _member_group_counts(cur).items()
+                if (status is None or s == status) and (tier is None or t == tier)
+            ), False
+        key = ("q", q.lower(), tier, status)
+        cached = MEMBER_COUNT_CACHE.get(key)
+        if cached is not None:
+            return cached, False
+        if estimate and using_postgres():
+            cur.execute("EXPLAIN (FORMAT JSON) SELECT 1 " + base, tuple(params))
+            plan = cur.fetchone()["QUERY PLAN"]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"]), True
+        cur.execute("SELECT COUNT(*) AS total_count " + base, tuple(params))
+        total = int(cur.fetchone()["total_count"])
+        MEMBER_COUNT_CACHE.set(key, total)
+        return total, False
+
+    def _query_members_list(q: str | None, tier: str | None, status: str | None, page: int, per_page: int, after: tuple | None = None, estimate: bool = False):
+        """One page of members ordered by (sort_key, id).
+
+        With ``after`` (a (sort_key, id) cursor from the previous page's ``next_after``) the page starts
+        right after that row via the index, so deep pages cost the same as the first; otherwise
+        ``page`` is applied as an OFFSET.
+        """
+        ph = "%s" if using_postgres() else "?"
         con = connect_db(); cur = con.cursor()
         where = ["1=1"]
         params = []
-        like = None
         if q:
-            like = f"%{q}%"
+            like = f"%{_like_escape(q.lower())}%"
             if using_postgres():
-                where.append("(m.name ILIKE %s OR m.email_lower ILIKE %s OR m.phone_e164 ILIKE %s)")
-                params += [like, like, like]
+                where.append("(m.name ILIKE %s OR m.email_lower LIKE %s OR m.phone_e164 LIKE %s)")
             else:
-                where.append("(m.name LIKE ? OR m.email_lower LIKE ? OR m.phone_e164 LIKE ?)")
-                params += [like, like, like]
+                where.append("(m.name LIKE ? ESCAPE '\\' OR m.email_lower LIKE ? ESCAPE '\\' OR m.phone_e164 LIKE ? ESCAPE '\\')")
+            params += [like, like, like]
         if status in ("active","inactive"):
-            where.append("m.status = %s" if using_postgres() else "m.status = ?")
+            where.append(f"m.status = {ph}")
             params.append(status)
-        tier_join = ""
+        else:
+            status = None
         if tier in ("essential","elevated","elite"):
-            where.append("(m.membership_tier = %s)" if using_postgres() else "(m.membership_tier = ?)")
+            where.append(f"(m.membership_tier = {ph})")
             params.append(tier)
+        else:
+            tier = None
         base = f"""
             FROM members m
-            {tier_join}
             WHERE {' AND '.join(where)}
         """
-        # total
-        count_sql = "SELECT COUNT(*) AS total_count " + base
-        cur.execute(count_sql, tuple(params))
-        total_row = cur.fetchone()
-        if isinstance(total_row, (list, tuple)):
-            total = total_row[0]
-        elif total_row:
-            total = total_row.get('total_count') or total_row.get('?column?') or 0
-        else:
-            total = 0
+        total, estimated = _members_total(cur, q, tier, status, base, params, estimate)
         # page
-        offset = (page-1)*per_page
-        if using_postgres():
-            order = "ORDER BY lower(regexp_replace(m.name, '^.*\\s+', '')) ASC, lower(m.name) ASC"
-        else:
-            order = "ORDER BY lower(CASE WHEN instr(trim(m.name), ' ') > 0 THEN substr(trim(m.name), instr(trim(m.name), ' ') + 1) ELSE trim(m.name) END) ASC, lower(m.name) ASC"
-        if using_postgres():
-            cur.execute(
-                f"""
-                SELECT m.id, m.name, m.email_lower, m.phone_e164, m.status, to_char(m.updated_at, 'YYYY-MM-DD HH24:MI:SS') AS updated_at,
-                       m.membership_tier
-                {base}
-                {order}
-                LIMIT %s OFFSET %s
-                """,
-                tuple(params + [per_page, offset])
-            )
+        if after is not None:
+            page_where = f"AND (m.sort_key, m.id) > ({ph}, {ph})"
+            page_params = params + [after[0], after[1], per_page + 1]
+            limit = f"LIMIT {ph}"
         else:
-            cur.execute(
-                f"""
-                SELECT m.id, m.name, m.email_lower, m.phone_e164, m.status, m.updated_at AS updated_at,
-                       m.membership_tier
-                {base}
-                {order}
-                LIMIT ? OFFSET ?
-                """,
-                tuple(params + [per_page, offset])
-            )
-        items = []
-        for r in cur.fetchall():
-            if using_postgres():
-                items.append({
-                    "id": r.get("id"), "name": r.get("name"), "email_lower": r.get("email_lower"),
-                    "phone_e164": r.get("phone_e164"), "status": r.get("status"), "updated_at": r.get("updated_at"),
-                    "tier": r.get("membership_tier"),
-                })
-            else:
-                items.append({
-                    "id": r[0], "name": r[1], "email_lower": r[2], "phone_e164": r[3], "status": r[4],
-                    "updated_at": r[5], "tier": r[6],
-                })
+            page_where = ""
+            page_params = params + [per_page + 1, (page - 1) * per_page]
+            limit = f"LIMIT {ph} OFFSET {ph}"
+        updated_at = "to_char(m.updated_at, 'YYYY-MM-DD HH24:MI:SS')" if using_postgres() else "m.updated_at"
+        cur.execute(
+            f"""
+            SELECT m.id, m.name, m.email_lower, m.phone_e164, m.status, {updated_at} AS updated_at,
+                   m.membership_tier, m.sort_key
+            {base}
+            {page_where}
+            ORDER BY m.sort_key, m.id
+            {limit}
+            """,
+            tuple(page_params)
+        )
+        rows = cur.fetchall()
         con.close()
-        return total, items
+        # One extra row tells whether there is a next page without another query
+        next_after = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_after = f"{rows[-1]['sort_key']},{rows[-1]['id']}"
+        items = [{
+            "id": r["id"], "name": r["name"], "email_lower": r["email_lower"],
+            "phone_e164": r["phone_e164"], "status": r["status"], "updated_at": r["updated_at"],
+            "tier": r["membership_tier"],
+        } for r in rows]
+        return total, estimated, items, next_after
 
     @app.get("/api/admin/members")
     def api_admin_members():
@@ -966,9 +2124,23 @@ def create_app():
             per_page = min(100, max(1, int(request.args.get("per_page", "25"))))
         except Exception:
             page, per_page = 1, 25
+        after = None
+        after_raw = request.args.get("after")
+        if after_raw:
+            # sort_key may itself contain commas; the id is always last
+            key, _, id_raw = after_raw.rpartition(",")
+            try:
+                after = (key, int(id_raw))
+            except ValueError:
+                return jsonify({"ok": False, "error": "Invalid cursor"}), 400
+        # estimate=1 lets free-text searches report the planner's row estimate instead of counting
+        estimate = request.args.get("estimate", "0") in ("1", "true", "yes")
         try:
-            total, items = _query_members_list(q or None, tier, status, page, per_page)
-            return jsonify({"ok": True, "page": page, "per_page": per_page, "total": total, "items": items})
+            total, estimated, items, next_after = _query_members_list(q or None, tier, status, page, per_page, after, estimate)
+            return jsonify({
+                "ok": True, "page": page, "per_page": per_page, "total": total, "total_estimated": estimated,
+                "items": items, "next_after": next_after,
+            })
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -1021,9 +2193,62 @@ def create_app():
         to = (request.json or {}).get('to')
         if not to:
             return jsonify({"ok": False, "error": "Missing 'to'"}), 400
-        ok = send_email(to, "Atlas Check-In Test", "This is a test email from staging.", "<p>This is a <b>test</b> email from staging.</p>")
+        subject, message = MAIL_TEMPLATES.message(SmtpSettings.from_env(), to, "smtp_test")
+        ok = send_message(to, subject, message)
         return jsonify({"ok": ok})
 
+    @app.get("/api/admin/mail_queue")
+    def api_admin_mail_queue():
+        require_admin()
+        try:
+            return jsonify({"ok": True, "enabled": MAIL_QUEUE_ENABLED, **MAIL_QUEUE.stats()})
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
+
+    @app.get("/api/admin/campaigns")
+    def api_admin_campaigns():
+        require_admin()
+        return jsonify({"ok": True, "campaigns": CAMPAIGNS.recent()})
+
+    @app.post("/api/admin/campaigns")
+    def api_admin_campaign_create():
+        require_admin()
+        if not MAIL_QUEUE_ENABLED:
+            return jsonify({"ok": False, "error": "Bulk sends need the mail queue (CHECKIN_MAIL_QUEUE=1)"}), 409
+        payload = request.get_json(silent=True) or {}
+        try:
+            campaign_id = CAMPAIGNS.create(
+                (payload.get("segment") or "active").strip(),
+                request.url_root.rstrip("/"),
+                tier=payload.get("tier"),
+                since=payload.get("since"),
+            )
+        except CampaignError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        CAMPAIGNS.start(campaign_id)
+        return jsonify({"ok": True, "campaign": CAMPAIGNS.progress(campaign_id)})
+
+    @app.get("/api/admin/campaigns/<int:campaign_id>")
+    def api_admin_campaign(campaign_id: int):
+        require_admin()
+        progress = CAMPAIGNS.progress(campaign_id)
+        if progress is None:
+            return jsonify({"ok": False, "error": "Not found"}), 404
+        return jsonify({"ok": True, "campaign": progress})
+
+    @app.post("/api/admin/campaigns/<int:campaign_id>/<action>")
+    def api_admin_campaign_action(campaign_id: int, action: str):
+        require_admin()
+        if action not in ("pause", "resume", "cancel"):
+            abort(404)
+        changed = {"pause": CAMPAIGNS.pause, "resume": CAMPAIGNS.start, "cancel": CAMPAIGNS.cancel}[action](campaign_id)
+        progress = CAMPAIGNS.progress(campaign_id)
+        if progress is None:
+            return jsonify({"ok": False, "error": "Not found"}), 404
+        if not changed:
+            return jsonify({"ok": False, "error": f"Cannot {action} a {progress['status']} campaign", "campaign": progress}), 409
+        return jsonify({"ok": True, "campaign": progress})
+
     @app.post("/api/upload_csv")
     def upload_csv():
         require_admin()
@@ -1031,69 +2256,51 @@ def create_app():
             f = request.files.get("file")
             if not f:
                 return jsonify({"ok": False, "error": "No file uploaded"}), 400
-            decoded = f.stream.read().decode("utf-8", errors="ignore")
-            reader = csv.DictReader(decoded.splitlines())
             con = connect_db()
-            cur = con.cursor()
             commit = request.args.get("commit", "1") in ("1", "true", "yes")
             deactivate_missing = request.args.get("deactivate_missing", "0") in ("1", "true", "yes")
-
-            parsed = []
-            for row in reader:
-                mapped = _map_csv_row(row)
-                if mapped:
-                    parsed.append(mapped)
-
-            csv_keys = set()
-            for p in parsed:
-                key = p["external_id"] or normalize_email(p["email"]) or normalize_phone(p["phone"]) or None
-                if key:
-                    csv_keys.add(key)
-
-            activated = 0
-            for p in parsed:
-                mid = upsert_member(cur, p["external_id"], p["name"], p["email"], p["phone"], p["tier"], p["status"])
-                if using_postgres():
-                    cur.execute("SELECT qr_token FROM members WHERE id=%s", (mid,))
-                else:
-                    cur.execute("SELECT qr_token FROM members WHERE id=?", (mid,))
-                tok_row = cur.fetchone()
-                tok = (tok_row["qr_token"] if using_postgres() else tok_row[0]) if tok_row else None
-                if not tok:
-                    if using_postgres():
-                        cur.execute("UPDATE members SET qr_token=%s WHERE id=%s", (secrets.token_urlsafe(24), mid))
-                    else:
-                        cur.execute("UPDATE members SET qr_token=? WHERE id=?", (secrets.token_urlsafe(24), mid))
-                if p["status"] == "active":
-                    activated += 1
-
-            deactivated = 0
-            if deactivate_missing and csv_keys:
-                cur.execute("SELECT id, external_id, email_lower, phone_e164 FROM members WHERE status='active'")
-                missing_ids = []
-                for r in cur.fetchall():
-                    key = r["external_id"] or r["email_lower"] or r["phone_e164"]
-                    if key and key not in csv_keys:
-                        missing_ids.append(r["id"])
-                if missing_ids and commit:
-                    if using_postgres():
-                        for i in missing_ids:
-                            cur.execute("UPDATE members SET status='inactive' WHERE id=%s", (i,))
-                    else:
-                        cur.executemany("UPDATE members SET status='inactive' WHERE id=?", [(i,) for i in missing_ids])
-                deactivated = len(missing_ids)
+            force = request.args.get("force", "0") in ("1", "true", "yes")
+
+            importer = MemberImport(con, using_postgres()).begin()
+            imported = activated = 0
+            for chunk in iter_csv_chunks(f.stream):
+                rows = [_import_row(p) for p in chunk]
+                importer.stage(rows)
+                imported += len(rows)
+                activated += sum(1 for r in rows if r["status"] == "active")
+            result = importer.apply(
+                deactivate_missing=deactivate_missing,
+                max_deactivate_fraction=None if force else DEACTIVATE_MAX_FRACTION,
+            )
+            importer.finish()
 
             if commit:
                 con.commit()
             con.close()
+            invalidate_member_caches(deactivated=bool(result["deactivated"] or result["marked_inactive"]))
             return jsonify({
                 "ok": True,
-                "imported": len(parsed),
+                "imported": imported,
                 "activated": activated,
-                "deactivated": deactivated,
+                "deactivated": result["deactivated"],
                 "deactivate_missing": deactivate_missing,
                 "committed": commit,
+                "inserted": result["inserted"],
+                "updated": result["updated"],
+                "reactivated": result["reactivated"],
+                "unchanged": result["unchanged"],
+                "seconds": result["seconds"],
+                "rows_per_second": result["rows_per_second"],
             })
+        except DeactivationLimitExceeded as e:
+            con.close()
+            return jsonify({
+                "ok": False,
+                "error": str(e),
+                "deactivate_candidates": e.candidates,
+                "active": e.active,
+                "max_fraction": e.max_fraction,
+            }), 409
         except Exception as e:
             try:
                 # Best effort rollback/close
@@ -1109,79 +2316,17 @@ def create_app():
         f = request.files.get("file")
         if not f:
             return jsonify({"ok": False, "error": "No file uploaded"}), 400
-        decoded = f.stream.read().decode("utf-8", errors="ignore")
-        reader = csv.DictReader(decoded.splitlines())
-
-        parsed = []
-        for row in reader:
-            mapped = _map_csv_row(row)
-            if mapped:
-                parsed.append(mapped)
-
-        con = connect_db()
-        cur = con.cursor()
-        cur.execute("SELECT id, external_id, name, email_lower, phone_e164, membership_tier, status FROM members")
-        rows = cur.fetchall()
-        con.close()
-
-        by_ext = {r["external_id"]: r for r in rows if r["external_id"]}
-        by_email = {r["email_lower"]: r for r in rows if r["email_lower"]}
-        by_phone = {r["phone_e164"]: r for r in rows if r["phone_e164"]}
-
-        inserts, updates, reactivations = [], [], []
-        matched_keys = set()
-        for p in parsed:
-            key = p["external_id"] or normalize_email(p["email"]) or normalize_phone(p["phone"]) or None
-            matched_keys.add(key)
-            existing = None
-            if p["external_id"] and p["external_id"] in by_ext:
-                existing = by_ext[p["external_id"]]
-            elif p["email"] and normalize_email(p["email"]) in by_email:
-                existing = by_email[normalize_email(p["email"]) ]
-            elif p["phone"] and normalize_phone(p["phone"]) in by_phone:
-                existing = by_phone[normalize_phone(p["phone"]) ]
-            if not existing:
-                inserts.append({"name": p["name"], "email": normalize_email(p["email"]), "phone": normalize_phone(p["phone"])})
-            else:
-                needs_update = (
-                    (p["name"] and p["name"] != existing["name"]) or
-                    (normalize_email(p["email"]) != existing["email_lower"]) or
-                    (normalize_phone(p["phone"]) != existing["phone_e164"]) or
-                    (p["tier"] != existing["membership_tier"]) or
-                    (p["status"] != existing["status"]) 
-                )
-                if existing["status"] == 'inactive' and p["status"] == 'active':
-                    reactivations.append({"name": existing["name"], "email": existing["email_lower"]})
-                elif needs_update:
-                    updates.append({"name": existing["name"], "email": existing["email_lower"]})
-
         con = connect_db()
-        cur = con.cursor()
-        cur.execute("SELECT external_id, email_lower, phone_e164, name FROM members WHERE status='active'")
-        active_rows = cur.fetchall()
-        con.close()
-        missing = []
-        for r in active_rows:
-            key = r["external_id"] or r["email_lower"] or r["phone_e164"]
-            if key and key not in matched_keys:
-                missing.append({"name": r["name"], "email": r["email_lower"]})
-
-        return jsonify({
-            "ok": True,
-            "counts": {
-                "inserts": len(inserts),
-                "updates": len(updates),
-                "reactivations": len(reactivations),
-                "deactivate_candidates": len(missing),
-                "total_rows": len(parsed)
-            },
-            "samples": {
-                "inserts": inserts[:5],
-                "updates": updates[:5],
-                "reactivations": reactivations[:5],
-                "deactivate_candidates": missing[:5]
-            }
-        })
+        try:
+            importer = MemberImport(con, using_postgres()).begin()
+            for chunk in iter_csv_chunks(f.stream):
+                importer.stage(_import_row(p) for p in chunk)
+            plan = importer.plan()
+            importer.finish()
+        finally:
+            # Nothing from the preview is kept; closing rolls the staging rows back
+            con.close()
+        return jsonify({"ok": True, **plan})
 
     @app.get("/api/members/search")
     def member_search():
@@ -1189,97 +2334,7 @@ def create_app():
         q = (request.args.get("q") or "").strip().lower()
         if not q:
             return jsonify([])
-        con = connect_db()
-        cur = con.cursor()
-        like = f"%{q}%"
-        if using_postgres():
-            cur.execute(
-                """
-                SELECT id, name, email_lower, phone_e164, membership_tier, status
-                FROM members
-                WHERE status='active' AND (
-                    name ILIKE %s OR email_lower ILIKE %s OR phone_e164 ILIKE %s
-                )
-                ORDER BY name ASC
-                LIMIT 20
-                """,
-                (like, like, like),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, name, email_lower, phone_e164, membership_tier, status
-                FROM members
-                WHERE status='active' AND (
-                    name LIKE ? OR email_lower LIKE ? OR phone_e164 LIKE ?
-                )
-                ORDER BY name ASC
-                LIMIT 20
-                """,
-                (like, like, like),
-            )
-        rows = [dict(r) for r in cur.fetchall()]
-        con.close()
-        return jsonify(rows)
-
-    def _find_member_by_qr_token(token: str) -> sqlite3.Row | None:
-        con = connect_db()
-        cur = con.cursor()
-        cur.execute(
-            ("SELECT * FROM members WHERE qr_token = %s AND status='active'" if using_postgres() else "SELECT * FROM members WHERE qr_token = ? AND status='active'"),
-            (token,),
-        )
-        row = cur.fetchone()
-        con.close()
-        return row
-
-    def _find_member_by_lookup(email: str | None, phone: str | None) -> sqlite3.Row | None:
-        email_n = normalize_email(email)
-        phone_n = normalize_phone(phone)
-        con = connect_db()
-        cur = con.cursor()
-        if email_n:
-            cur.execute(
-                ("SELECT * FROM members WHERE email_lower = %s AND status='active'" if using_postgres() else "SELECT * FROM members WHERE email_lower = ? AND status='active'"),
-                (email_n,),
-            )
-            row = cur.fetchone()
-            if row:
-                con.close()
-                return row
-        if phone_n:
-            cur.execute(
-                ("SELECT * FROM members WHERE phone_e164 = %s AND status='active'" if using_postgres() else "SELECT * FROM members WHERE phone_e164 = ? AND status='active'"),
-                (phone_n,),
-            )
-            row = cur.fetchone()
-            con.close()
-            return row
-        con.close()
-        return None
-
-    def _recent_checkin_exists(member_id: int, window_minutes: int) -> bool:
-        con = connect_db()
-        cur = con.cursor()
-        cur.execute(
-            ("SELECT timestamp FROM check_ins WHERE member_id = %s ORDER BY timestamp DESC LIMIT 1" if using_postgres() else "SELECT timestamp FROM check_ins WHERE member_id = ? ORDER BY timestamp DESC LIMIT 1"),
-            (member_id,),
-        )
-        row = cur.fetchone()
-        con.close()
-        if not row:
-            return False
-        ts_val = row[0] if isinstance(row, (list, tuple)) else (row.get("timestamp") if isinstance(row, dict) else row["timestamp"])
-        if isinstance(ts_val, datetime):
-            last_ts = ts_val
-        else:
-            try:
-                last_ts = datetime.fromisoformat(str(ts_val))
-            except Exception:
-                last_ts = datetime.strptime(str(ts_val), "%Y-%m-%d %H:%M:%S")
-        if last_ts.tzinfo is not None:
-            last_ts = last_ts.astimezone(timezone.utc).replace(tzinfo=None)
-        return datetime.now() - last_ts < timedelta(minutes=window_minutes)
+        return jsonify(search_members(q, limit=20))
 
     @app.post("/api/checkin")
     def api_checkin():
@@ -1289,40 +2344,50 @@ def create_app():
         email = (payload.get("email") or request.form.get("email") or "").strip()
         phone = (payload.get("phone") or request.form.get("phone") or "").strip()
         method = "QR" if qr_token else "manual"
-        member = None
-        if member_id_in.isdigit():
-            con = connect_db(); cur = con.cursor()
-            cur.execute(
-                ("SELECT * FROM members WHERE id = %s AND status='active'" if using_postgres() else "SELECT * FROM members WHERE id = ? AND status='active'"),
-                (int(member_id_in),)
-            )
-            member = cur.fetchone()
-            con.close()
-        elif qr_token:
-            member = _find_member_by_qr_token(qr_token)
-        else:
-            member = _find_member_by_lookup(email, phone)
-        if not member:
+        member_id = int(member_id_in) if member_id_in.isdigit() else None
+        if member_id is None and qr_token:
+            # Token -> id comes from memory for regulars; the check-in itself still verifies the
+            # member is active by primary key.
+            cached = lookup_member_by_qr_token(qr_token)
+            if not cached or cached["status"] != "active":
+                return jsonify({"ok": False, "error": "Member not found or inactive"}), 404
+            member_id = cached["id"]
+        if member_id is not None:
+            # A repeat scan inside the window changes nothing, so it is answered from memory
+            recent = RECENT_CHECKINS.get(member_id)
+            if recent and recent["name"]:
+                return jsonify({"ok": True, "message": "Already checked in recently", "member_name": recent["name"]})
+        result = record_checkin(
+            member_id=member_id,
+            qr_token=qr_token or None,
+            email=email or None,
+            phone=phone or None,
+            method=method,
+            device_id=request.headers.get("X-Device-Id", "kiosk-1"),
+        )
+        if not result:
             return jsonify({"ok": False, "error": "Member not found or inactive"}), 404
-
-        if _recent_checkin_exists(member["id"], DUP_WINDOW_MINUTES):
-            return jsonify({"ok": True, "message": "Already checked in recently", "member_name": member["name"]})
-
-        con = connect_db()
-        cur = con.cursor()
-        if using_postgres():
-            cur.execute(
-                "INSERT INTO check_ins(member_id, location_id, method, source_device_id, status) VALUES (%s, 1, %s, %s, 'ok')",
-                (member["id"], method, request.headers.get("X-Device-Id", "kiosk-1")),
-            )
-        else:
-            cur.execute(
-                "INSERT INTO check_ins(member_id, location_id, method, source_device_id, status) VALUES (?, 1, ?, ?, 'ok')",
-                (member["id"], method, request.headers.get("X-Device-Id", "kiosk-1")),
-            )
-        con.commit()
-        con.close()
-        return jsonify({"ok": True, "member_name": member["name"]})
+        if result["duplicate"]:
+            return jsonify({"ok": True, "message": "Already checked in recently", "member_name": result["name"]})
+        return jsonify({"ok": True, "member_name": result["name"]})
+
+    @app.post("/api/checkin/batch")
+    def api_checkin_batch():
+        # Scans a kiosk queued while offline; see record_checkin_batch for idempotency and dedupe
+        payload = request.get_json(silent=True)
+        scans = payload.get("scans") if isinstance(payload, dict) else None
+        if not isinstance(scans, list) or not scans:
+            return jsonify({"ok": False, "error": "Expected {\"scans\": [...]}"}), 400
+        if len(scans) > CHECKIN_BATCH_MAX_SCANS:
+            return jsonify({"ok": False, "error": f"At most {CHECKIN_BATCH_MAX_SCANS} scans per batch"}), 413
+        device_id = (request.headers.get("X-Device-Id") or "").strip()[:100]
+        if not device_id:
+            return jsonify({"ok": False, "error": "X-Device-Id header required"}), 400
+        try:
+            results = record_checkin_batch(scans, device_id)
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
+        return jsonify({"ok": True, "results": results})
 
     @app.get("/api/kiosk/suggest")
     def kiosk_suggest():
@@ -1330,30 +2395,7 @@ def create_app():
         q = (request.args.get("q") or "").strip()
         if len(q) < 2:
             return jsonify([])
-        like = f"%{q}%"
-        con = connect_db(); cur = con.cursor()
-        if using_postgres():
-            cur.execute(
-                """
-                SELECT id, name FROM members
-                WHERE status='active' AND name ILIKE %s
-                ORDER BY name ASC
-                LIMIT 5
-                """,
-                (like,)
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, name FROM members
-                WHERE status='active' AND name LIKE ?
-                ORDER BY name ASC
-                LIMIT 5
-                """,
-                (like,)
-            )
-        rows = cur.fetchall(); con.close()
-        return jsonify([{"id": r["id"], "name": r["name"]} for r in rows])
+        return jsonify(search_members(q, limit=5, name_only=True))
 
     @app.post("/api/qr/resend")
     def api_qr_resend():
@@ -1378,64 +2420,12 @@ def create_app():
 
         token = ensure_qr_token(member)
         base_url = request.url_root.rstrip("/")
-        link = f"{base_url}/member/qr?token={token}"
-        wallet_available = WALLET_PASS_ENABLED and wallet_pass_configured()
-        wallet_link = f"{base_url}/member/pass.apple?token={token}" if wallet_available else None
-        wallet_text = f"Add to Apple Wallet: {wallet_link}\n\n" if wallet_link else ""
-        full_name = (member.get("name") if isinstance(member, dict) else member["name"]) or ""
-        full_name = full_name.strip()
-        first_name = full_name.split()[0] if full_name else "there"
-        preview_text = "Here's your Atlas Gym check-in QR code. Scan it at the kiosk for a breezy arrival."
         # Generate inline QR image
-        qr_png = generate_qr_png(token, box_size=10, border=2)
-        wallet_button_html = (
-            f"<a href=\"{wallet_link}\" style=\"display:inline-flex;align-items:center;justify-content:center;background:#0f172a;color:#ffffff;text-decoration:none;padding:14px 28px;border-radius:14px;font-weight:700;font-size:16px;letter-spacing:0.3px;\">Add to Apple Wallet</a>"
-            if wallet_link else ""
-        )
-        body = (
-            f"Hi {first_name},\n\n"
-            f"Here is your Atlas Gym check-in QR. Scan it at the kiosk or open it on your phone using the link below.\n\n"
-            f"Open link: {link}\n"
-            f"{wallet_text}"
-            f"- The Atlas Gym Team\n"
-            f"GymSense — Your gym operations, simplified."
-        )
-        body_html = f"""
-<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8" />
-    <meta name="viewport" content="width=device-width, initial-scale=1" />
-    <title>Your Atlas Gym check-in code</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com" />
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin />
-    <link href="https://fonts.googleapis.com/css2?family=Oleo+Script:wght@700&display=swap" rel="stylesheet" />
-  </head>
-  <body style="margin:0;padding:32px 16px;background:#f5f5f5;font-family:system-ui,-apple-system,'Segoe UI',Roboto,sans-serif;color:#101418;">
-    <div style="display:none;font-size:1px;color:#f5f5f5;line-height:1px;max-height:0;max-width:0;opacity:0;overflow:hidden;">{preview_text}</div>
-    <div style="max-width:560px;margin:0 auto;background:#ffffff;border:1px solid #e5e7eb;border-radius:20px;padding:32px;">
-      <div style="margin-bottom:24px;">
-        <div style="font-size:24px;font-weight:700;margin:0;">The Atlas Gym</div>
-        <div style="margin-top:6px;color:#6b7280;font-size:14px;">23282 Del Lago Dr, Laguna Hills, CA 92653</div>
-      </div>
-      <h1 style="font-size:24px;margin:0 0 12px;">Your check-in code</h1>
-      <p style="margin:0 0 24px;color:#374151;font-size:16px;">Hi {first_name}, your QR code is ready for your next visit. Show it at the kiosk or tap below to open it on your phone.</p>
-      <div style="text-align:center;padding:24px;border:1px solid #e5e7eb;border-radius:16px;background:#f9fafb;margin-bottom:24px;">
-        <img src="cid:qrimg" width="240" height="240" alt="Your Atlas Gym QR Code" style="display:block;margin:0 auto 20px;border-radius:12px;border:1px solid #e5e7eb;background:#ffffff;" />
-        <div style="display:flex;flex-direction:column;gap:12px;align-items:center;">
-          {wallet_button_html}
-          <a href="{link}" style="display:inline-flex;align-items:center;justify-content:center;width:auto;background:#ffffff;color:#0f172a;text-decoration:none;padding:13px 26px;border-radius:14px;font-weight:600;font-size:15px;border:1px solid #cbd5f5;">Open my QR code</a>
-        </div>
-      </div>
-      <p style="margin:0;color:#6b7280;font-size:14px;">Save this email or add the link to your wallet for quicker access next time.</p>
-      <hr style="border:none;border-top:1px solid #e5e7eb;margin:32px 0 0;" />
-    </div>
-  </body>
-</html>
-        """
+        qr_png = cached_qr_png(token, box_size=10, border=2)
+        full_name = member.get("name") if isinstance(member, dict) else member["name"]
         inline = [("qr.png", qr_png, "image/png", "<qrimg>")] if qr_png else None
-        ok = send_email(email_n or "", "Your Atlas Gym Check-In Code", body, body_html, inline_images=inline) if email_n else True
-        return jsonify({"ok": ok, "wallet": wallet_available})
+        ok = queue_email(email_n, "qr_code", inline, **qr_email_context(full_name, token, base_url))
+        return jsonify({"ok": ok, "wallet": WALLET_PASS_ENABLED and wallet_pass_configured()})
 
     @app.post("/api/pass/apple")
     def api_pass_apple():
@@ -1448,11 +2438,28 @@ def create_app():
         token = (request.args.get("token") or "").strip()
         if not token:
             return "Missing token", 400
-        member = _find_member_by_qr_token(token)
+        cached = lookup_member_by_qr_token(token)
+        if not cached or cached["status"] != "active":
+            abort(404)
+        con = connect_db(); cur = con.cursor()
+        cur.execute(
+            ("SELECT * FROM members WHERE id = %s AND status='active'" if using_postgres() else "SELECT * FROM members WHERE id = ? AND status='active'"),
+            (cached["id"],),
+        )
+        member = cur.fetchone()
+        con.close()
         if not member:
             abort(404)
+        base_url = request.url_root.rstrip("/")
         try:
-            result = build_member_wallet_pass(member, token, request.url_root.rstrip("/"))
+            digest = wallet_pass_digest(member, token, base_url)
+            # A pass the device already has is answered without signing or reading it
+            if request.if_none_match.contains(digest):
+                response = Response(status=304)
+                response.set_etag(digest)
+                response.headers["Cache-Control"] = "private, no-cache"
+                return response
+            result = cached_member_wallet_pass(member, token, base_url, digest)
         except Exception as exc:
             print("Wallet pass generation failed:", exc)
             return "Unable to generate pass", 500
@@ -1464,7 +2471,9 @@ def create_app():
             as_attachment=True,
             download_name=result.filename,
         )
-        response.headers["Cache-Control"] = "no-store"
+        response.set_etag(result.digest)
+        # Revalidated on every download since the member's details can change
+        response.headers["Cache-Control"] = "private, no-cache"
         return response
 
     @app.get("/member/qr")
@@ -1479,50 +2488,51 @@ def create_app():
         token = (request.args.get("token") or "").strip()
         if not token:
             return "Bad request", 400
-        png = generate_qr_png(token)
-        if not png:
-            return "Error", 500
-        from flask import Response
-        return Response(png, mimetype='image/png')
+        etag = qr_png_etag(token)
+        cache_control = f"private, max-age={QR_PNG_MAX_AGE_SECONDS}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            png = cached_qr_png(token)
+            if not png:
+                return "Error", 500
+            response = Response(png, mimetype='image/png')
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        return response
 
-    # PWA icons (generated server-side for convenience)
+    @app.get("/assets/<path:filename>")
+    def built_asset(filename):
+        # Only names from the manifest, so nothing outside ASSET_DIR (or a stale build) is reachable
+        if filename not in built_assets:
+            abort(404)
+        return send_built_asset(filename, ASSET_MAX_AGE_SECONDS, immutable=True)
+
+    # PWA icons, rendered by the asset build; these URLs are not fingerprinted so they stay revalidatable
     @app.get("/icons/icon-192.png")
     def icon_192():
-        try:
-            from PIL import Image, ImageDraw, ImageFont
-            img = Image.new('RGB', (192, 192), color=(0, 0, 0))
-            draw = ImageDraw.Draw(img)
-            # neon green border
-            draw.rectangle([4, 4, 188, 188], outline=(57, 255, 20), width=4)
-            # centered A monogram
-            text = "A"
-            font = ImageFont.load_default()
-            w, h = draw.textsize(text, font=font)
-            draw.text(((192-w)//2, (192-h)//2), text, fill=(57, 255, 20), font=font)
-            buf = io.BytesIO(); img.save(buf, format='PNG')
-            buf.seek(0)
-            from flask import Response
-            return Response(buf.getvalue(), mimetype='image/png')
-        except Exception:
-            return "", 404
+        if "icons/icon-192.png" not in asset_manifest:
+            abort(404)
+        return send_built_asset(asset_manifest["icons/icon-192.png"], ICON_MAX_AGE_SECONDS)
 
     @app.get("/icons/icon-512.png")
     def icon_512():
-        try:
-            from PIL import Image, ImageDraw, ImageFont
-            img = Image.new('RGB', (512, 512), color=(0, 0, 0))
-            draw = ImageDraw.Draw(img)
-            draw.rectangle([8, 8, 504, 504], outline=(57, 255, 20), width=6)
-            text = "A"
-            font = ImageFont.load_default()
-            w, h = draw.textsize(text, font=font)
-            draw.text(((512-w)//2, (512-h)//2), text, fill=(57, 255, 20), font=font)
-            buf = io.BytesIO(); img.save(buf, format='PNG')
-            buf.seek(0)
-            from flask import Response
-            return Response(buf.getvalue(), mimetype='image/png')
-        except Exception:
-            return "", 404
+        if "icons/icon-512.png" not in asset_manifest:
+            abort(404)
+        return send_built_asset(asset_manifest["icons/icon-512.png"], ICON_MAX_AGE_SECONDS)
+
+    @app.get("/api/admin/cache_stats")
+    def api_admin_cache_stats():
+        require_admin()
+        return jsonify({
+            "ok": True,
+            "qr_token": QR_TOKEN_CACHE.stats(),
+            "kiosk_status": KIOSK_STATUS_CACHE.stats(),
+            "member_counts": MEMBER_COUNT_CACHE.stats(),
+            "qr_png": QR_PNG_CACHE.stats(),
+            "pkpass": PKPASS_CACHE.stats(),
+            "recent_checkins": RECENT_CHECKINS.stats(),
+        })
 
     @app.get("/admin/init_pin")
     def admin_init_pin():
@@ -1591,12 +2601,19 @@ def create_app():
         except Exception as e:
             probe["error"] = str(e)
         details["probe"] = probe
+        try:
+            details["pool"] = db_pool_stats()
+        except Exception:
+            pass
         return jsonify(details)
 
     return app
 
 
-app = create_app()
+# Campaign render processes are spawned, and spawn re-imports the script that started the parent
+# (``python src/checkin_app.py``) under this name; they must not build a second app.
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "5055"))
@@ -0,0 +1,122 @@
+"""In-memory check-in counters for the staff metrics and kiosk status endpoints.
+
+The counters hold per-day totals, per-day unique member sets and per-minute buckets for the rolling
+last-hour figure. They are fed check-in rows (id, member_id, UTC timestamp) by the write path and by
+a periodic catch-up query, and never touch the database themselves.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+# Ids skipped by the sequence (a concurrent insert that had not committed yet) are re-requested by
+# the catch-up query for this long before being given up on as rolled back.
+GAP_TTL_SECONDS = 120.0
+MAX_TRACKED_GAPS = 500
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _minute(ts: datetime) -> int:
+    # Timestamps are naive UTC throughout
+    return int((ts - _EPOCH).total_seconds() // 60)
+
+
+class CheckinCounters:
+    """Aggregates check-ins by UTC day and minute; safe to share between request threads.
+
+    All timestamps passed in must be naive UTC datetimes.
+    """
+
+    def __init__(self, history_days: int = 7):
+        self.history_days = max(1, int(history_days))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._day_totals: dict[date, int] = {}
+            self._day_members: dict[date, set] = {}
+            self._minute_buckets: dict[int, int] = {}
+            self._seen: dict[int, date] = {}
+            self._gaps: dict[int, float] = {}
+            self.high_id = 0
+            self.ready = False
+
+    def load(self, rows: Iterable[tuple[int, int, datetime]]) -> None:
+        """Replace all state with ``rows`` (a full rebuild); sequence gaps in history are not tracked."""
+        self.reset()
+        with self._lock:
+            for check_in_id, member_id, ts in rows:
+                self._apply(check_in_id, member_id, ts)
+                self.high_id = max(self.high_id, check_in_id)
+            self.ready = True
+
+    def observe(self, check_in_id: int, member_id: int, ts: datetime) -> bool:
+        """Count one check-in; returns False if this id was already counted."""
+        with self._lock:
+            if check_in_id in self._seen:
+                return False
+            self._gaps.pop(check_in_id, None)
+            if check_in_id > self.high_id:
+                now = time.monotonic()
+                for missing in range(max(self.high_id + 1, check_in_id - MAX_TRACKED_GAPS), check_in_id):
+                    self._gaps[missing] = now
+                self.high_id = check_in_id
+            self._apply(check_in_id, member_id, ts)
+            return True
+
+    def pending_gaps(self) -> list[int]:
+        """Ids below high_id not seen yet that may still show up once their transaction commits."""
+        cutoff = time.monotonic() - GAP_TTL_SECONDS
+        with self._lock:
+            for gap_id in [i for i, seen_at in self._gaps.items() if seen_at < cutoff]:
+                del self._gaps[gap_id]
+            return sorted(self._gaps)
+
+    def _apply(self, check_in_id: int, member_id: int, ts: datetime) -> None:
+        day = ts.date()
+        if day < datetime.utcnow().date() - timedelta(days=self.history_days - 1):
+            return
+        self._seen[check_in_id] = day
+        self._day_totals[day] = self._day_totals.get(day, 0) + 1
+        self._day_members.setdefault(day, set()).add(member_id)
+        minute = _minute(ts)
+        self._minute_buckets[minute] = self._minute_buckets.get(minute, 0) + 1
+
+    def _prune(self, now: datetime) -> None:
+        oldest_day = now.date() - timedelta(days=self.history_days - 1)
+        for day in [d for d in self._day_totals if d < oldest_day]:
+            self._day_totals.pop(day, None)
+            self._day_members.pop(day, None)
+        for check_in_id in [i for i, d in self._seen.items() if d < oldest_day]:
+            del self._seen[check_in_id]
+        oldest_minute = _minute(now) - 60
+        for minute in [m for m in self._minute_buckets if m <= oldest_minute]:
+            del self._minute_buckets[minute]
+
+    def snapshot(self, now: Optional[datetime] = None) -> dict:
+        """Current figures: today_total, today_unique, last_hour_total and a history_days trend."""
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._prune(now)
+            today = now.date()
+            current_minute = _minute(now)
+            last_hour_total = sum(c for m, c in self._minute_buckets.items() if current_minute - 60 < m <= current_minute)
+            trend = []
+            for i in range(self.history_days - 1, -1, -1):
+                d = today - timedelta(days=i)
+                trend.append({"date": d.isoformat(), "count": self._day_totals.get(d, 0)})
+            return {
+                "today_total": self._day_totals.get(today, 0),
+                "today_unique": len(self._day_members.get(today, ())),
+                "last_hour_total": last_hour_total,
+                "trend": trend,
+            }
+
+
+__all__ = ["CheckinCounters"]
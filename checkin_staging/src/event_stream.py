@@ -0,0 +1,81 @@
+"""In-process pub/sub feeding the staff dashboard's Server-Sent Events stream."""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections import deque
+from typing import Optional
+
+
+def format_sse(event: Optional[str], data: str, event_id: Optional[str] = None, retry_ms: Optional[int] = None) -> str:
+    lines = []
+    if retry_ms is not None:
+        lines.append(f"retry: {int(retry_ms)}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.splitlines() or [""]:
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventBroker:
+    """Keeps the last ``capacity`` events in publish order and wakes waiting streams.
+
+    Event ids are increasing integers (check_ins ids here). Streams track a local sequence number;
+    a reconnecting client's Last-Event-ID is resumed from the buffer as long as nothing after it
+    can have been dropped: it must be at or above the floor, which starts at the id the feed was
+    primed with (``resume_from``) and rises as old events are evicted. Below the floor, or before
+    the feed is primed, the caller should send a fresh snapshot instead.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self._events: deque = deque(maxlen=max(1, capacity))
+        self._seq = 0
+        self._floor: Optional[int] = None
+        self._cond = threading.Condition()
+
+    def resume_from(self, event_id: int) -> None:
+        """Everything up to event_id is already reflected in snapshots; later ids are published."""
+        with self._cond:
+            if self._floor is None:
+                self._floor = event_id
+
+    def publish(self, event: str, data: dict, event_id: Optional[int] = None) -> None:
+        payload = json.dumps(data, separators=(",", ":"), default=str)
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                evicted = self._events[0][1]
+                if evicted is not None and self._floor is not None:
+                    self._floor = max(self._floor, evicted)
+            self._seq += 1
+            self._events.append((self._seq, event_id, event, payload))
+            self._cond.notify_all()
+
+    def current_seq(self) -> int:
+        with self._cond:
+            return self._seq
+
+    def replay(self, last_event_id: int) -> Optional[tuple]:
+        """(seq, events) to resume a client that has seen everything up to last_event_id: the
+        buffered events with a higher id and the sequence number to continue from, or None if the
+        buffer cannot prove nothing was missed."""
+        with self._cond:
+            if self._floor is None or last_event_id < self._floor:
+                return None
+            return self._seq, [e for e in self._events if e[1] is not None and e[1] > last_event_id]
+
+    def after(self, seq: int) -> list:
+        """Buffered (seq, event_id, event, payload) tuples published after seq."""
+        with self._cond:
+            return [e for e in self._events if e[0] > seq]
+
+    def wait(self, seq: int, timeout: float) -> bool:
+        """Block until something is published after seq or timeout elapses; True if there is news."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+
+
+__all__ = ["EventBroker", "format_sse"]
@@ -0,0 +1,470 @@
+"""Durable outbound email queue with a background SMTP delivery worker.
+
+Request handlers render a message and ``MailQueue.enqueue`` it into ``outbound_emails``; the request
+returns without touching SMTP. One worker thread per process claims due rows (``FOR UPDATE SKIP
+LOCKED`` on Postgres, so every gunicorn worker can run one), sends them over a single long-lived
+authenticated SMTP session and reschedules failures with exponential backoff. A claim pushes
+``available_at`` forward by a lease, so a row claimed by a process that died mid-send is retried once
+the lease runs out; delivery is at-least-once.
+
+``senders`` threads each keep their own session, and ``rate_per_second`` caps the combined send rate
+so bulk campaigns stay inside the relay's limits.
+
+``available_at`` is epoch seconds so both backends compare it the same way.
+"""
+
+from __future__ import annotations
+
+import base64
+import functools
+import os
+import random
+import secrets
+import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from email.header import Header
+from email.utils import formataddr
+from typing import Callable, Iterable, Optional
+
+
+@dataclass(frozen=True)
+class SmtpSettings:
+    host: Optional[str]
+    port: int
+    user: Optional[str]
+    password: Optional[str]
+    from_raw: str
+    from_name: Optional[str]
+    starttls: bool = True
+    timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "SmtpSettings":
+        user = os.environ.get("SMTP_USER")
+        from_raw = os.environ.get("SMTP_FROM", user or "noreply@example.com")
+        from_name = os.environ.get("SMTP_FROM_NAME")
+        if not from_name and isinstance(from_raw, str) and from_raw.lower().endswith("@gymsense.io"):
+            from_name = "GymSense"
+        return cls(
+            host=os.environ.get("SMTP_HOST") or None,
+            port=int(os.environ.get("SMTP_PORT", "587")),
+            user=user,
+            password=os.environ.get("SMTP_PASS"),
+            from_raw=from_raw,
+            from_name=from_name,
+            starttls=os.environ.get("SMTP_STARTTLS", "1").strip().lower() in {"1", "true", "yes", "on"},
+            timeout=float(os.environ.get("SMTP_TIMEOUT_SECONDS", "30")),
+        )
+
+    @property
+    def from_email(self) -> str:
+        return formataddr((self.from_name, self.from_raw)) if self.from_name else self.from_raw
+
+
+def _base64_body(data: bytes) -> bytes:
+    return base64.encodebytes(data).rstrip(b"\n").replace(b"\n", b"\r\n")
+
+
+def _header_value(value: str) -> str:
+    value = " ".join(value.splitlines())
+    return value if value.isascii() else Header(value, "utf-8").encode()
+
+
+def encode_text_part(subtype: str, text: str) -> bytes:
+    """text/<subtype> MIME part (headers and body): 7bit when it is plain ASCII with short lines,
+    otherwise base64 UTF-8."""
+    lines = text.splitlines()
+    if text.isascii() and all(len(line) <= 998 for line in lines):
+        head = f'Content-Type: text/{subtype}; charset="us-ascii"\r\nContent-Transfer-Encoding: 7bit\r\n\r\n'
+        return head.encode("ascii") + "\r\n".join(lines).encode("ascii")
+    head = f'Content-Type: text/{subtype}; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+    return head.encode("ascii") + _base64_body(text.encode("utf-8"))
+
+
+def encode_inline_image(filename: str, content: bytes, mimetype: str, cid: str) -> bytes:
+    """Inline image MIME part, referenced from HTML as ``cid:`` + cid without the angle brackets."""
+    head = (
+        f"Content-Type: {mimetype}\r\nContent-Transfer-Encoding: base64\r\n"
+        f'Content-ID: {cid}\r\nContent-Disposition: inline; filename="{filename}"\r\n\r\n'
+    )
+    return head.encode("ascii") + _base64_body(content)
+
+
+def _multipart(subtype: str, parts: list) -> bytes:
+    boundary = f"=_{secrets.token_hex(16)}".encode("ascii")
+    delimiter = b"\r\n--" + boundary + b"\r\n"
+    return (
+        b"Content-Type: multipart/" + subtype.encode("ascii") + b'; boundary="' + boundary + b'"\r\n\r\n'
+        + b"--" + boundary + b"\r\n" + delimiter.join(parts) + b"\r\n--" + boundary + b"--"
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _sender_header(settings: SmtpSettings) -> bytes:
+    return f"From: {_header_value(settings.from_email)}\r\nMIME-Version: 1.0\r\n".encode("ascii")
+
+
+def assemble_message(
+    settings: SmtpSettings,
+    to_email: str,
+    subject: str,
+    text_part: bytes,
+    html_part: Optional[bytes] = None,
+    image_parts: Iterable[bytes] = (),
+) -> bytes:
+    """RFC 5322 bytes (CRLF line endings, ready for ``sendmail``) from already encoded MIME parts:
+    the text alone, multipart/alternative with HTML, wrapped in multipart/related for CID images."""
+    body = _multipart("alternative", [text_part, html_part]) if html_part else text_part
+    image_parts = list(image_parts)
+    if image_parts:
+        body = _multipart("related", [body, *image_parts])
+    head = f"Subject: {_header_value(subject)}\r\nTo: {_header_value(to_email)}\r\n".encode("ascii")
+    return head + _sender_header(settings) + body + b"\r\n"
+
+
+def render_message(
+    settings: SmtpSettings,
+    to_email: str,
+    subject: str,
+    body: str,
+    body_html: Optional[str] = None,
+    inline_images: Optional[list] = None,
+) -> bytes:
+    """RFC 5322 bytes for a plain-text message, or one with HTML and ``(filename, content,
+    mimetype, cid)`` inline images."""
+    return assemble_message(
+        settings,
+        to_email,
+        subject,
+        encode_text_part("plain", body),
+        encode_text_part("html", body_html) if body_html else None,
+        [encode_inline_image(*image) for image in inline_images or ()],
+    )
+
+
+def is_permanent_failure(exc: Exception) -> bool:
+    """5xx answers about the recipient or the message itself; retrying would get the same answer."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)):
+        return exc.smtp_code >= 500
+    return False
+
+
+class SmtpSession:
+    """One SMTP connection reused across messages; reconnects when the relay has dropped it."""
+
+    def __init__(self, idle_seconds: float = 30.0):
+        self.idle_seconds = idle_seconds
+        self._server: Optional[smtplib.SMTP] = None
+        self._settings: Optional[SmtpSettings] = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self, settings: SmtpSettings) -> smtplib.SMTP:
+        if self._server is not None and self._settings == settings:
+            return self._server
+        self.close()
+        server = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+        try:
+            server.ehlo()
+            if settings.starttls:
+                server.starttls()
+                server.ehlo()
+            if settings.user and settings.password:
+                server.login(settings.user, settings.password)
+        except Exception:
+            server.close()
+            raise
+        self._server, self._settings = server, settings
+        self.connects += 1
+        return server
+
+    def send(self, settings: SmtpSettings, to_email: str, message: bytes) -> None:
+        for attempt in (1, 2):
+            server = self._connect(settings)
+            try:
+                server.sendmail(settings.from_raw, [to_email], message)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Relays close idle sessions; a fresh connection gets one more try
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                # The session state after a failed transaction is unknown
+                self.close()
+                raise
+            self._last_used = time.monotonic()
+            return
+
+    def idle_for(self) -> Optional[float]:
+        return None if self._server is None else time.monotonic() - self._last_used
+
+    def close(self) -> None:
+        server, self._server = self._server, None
+        self._settings = None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+
+class RateLimiter:
+    """Spaces calls ``1 / rate`` seconds apart across all threads; ``rate`` None or <= 0 disables it."""
+
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MailQueue:
+    def __init__(
+        self,
+        connect: Callable,
+        postgres: bool,
+        max_attempts: int = 8,
+        batch_size: int = 20,
+        poll_seconds: float = 5.0,
+        idle_seconds: float = 30.0,
+        lease_seconds: float = 120.0,
+        backoff_seconds: float = 30.0,
+        backoff_max_seconds: float = 3600.0,
+        senders: int = 1,
+        rate_per_second: Optional[float] = None,
+    ):
+        self.connect = connect
+        self.postgres = postgres
+        self.max_attempts = max(1, max_attempts)
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.sessions = [SmtpSession(idle_seconds=idle_seconds) for _ in range(max(1, senders))]
+        self.limiter = RateLimiter(rate_per_second)
+        # Rows claimed by one sender must all go out within the lease even at the throttled rate
+        if rate_per_second and rate_per_second > 0:
+            self.batch_size = max(1, min(self.batch_size, int(rate_per_second * lease_seconds / (2 * len(self.sessions)))))
+        self._ph = "%s" if postgres else "?"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list = []
+        self._threads_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def enqueue(self, to_email: str, subject: str, message: bytes) -> int:
+        ph = self._ph
+        sql = (
+            f"INSERT INTO outbound_emails (to_email, subject, message, available_at) VALUES ({ph}, {ph}, {ph}, {ph})"
+        )
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            if self.postgres:
+                cur.execute(sql + " RETURNING id", (to_email, subject, message, time.time()))
+                email_id = int(cur.fetchone()["id"])
+            else:
+                cur.execute(sql, (to_email, subject, message, time.time()))
+                email_id = int(cur.lastrowid)
+            con.commit()
+        finally:
+            con.close()
+        self._wake.set()
+        return email_id
+
+    def enqueue_batch(self, con, messages: list, campaign_id: Optional[int] = None) -> int:
+        """Insert (to_email, subject, message) tuples on the caller's connection; the caller commits
+        (together with its own bookkeeping) and then calls ``wake()``."""
+        if not messages:
+            return 0
+        ph = self._ph
+        now = time.time()
+        con.cursor().executemany(
+            f"INSERT INTO outbound_emails (to_email, subject, message, available_at, campaign_id) VALUES ({ph}, {ph}, {ph}, {ph}, {ph})",
+            [(to_email, subject, message, now, campaign_id) for to_email, subject, message in messages],
+        )
+        return len(messages)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _claim(self, con) -> list:
+        ph = self._ph
+        now = time.time()
+        skip_locked = "FOR UPDATE SKIP LOCKED" if self.postgres else ""
+        cur = con.cursor()
+        cur.execute(
+            f"""
+            UPDATE outbound_emails SET attempts = attempts + 1, available_at = {ph}
+            WHERE id IN (
+                SELECT id FROM outbound_emails
+                WHERE status = 'pending' AND available_at <= {ph}
+                ORDER BY available_at, id
+                LIMIT {int(self.batch_size)}
+                {skip_locked}
+            )
+            RETURNING id, to_email, message, attempts
+            """,
+            (now + self.lease_seconds, now),
+        )
+        rows = [(r["id"], r["to_email"], bytes(r["message"]), r["attempts"]) for r in cur.fetchall()]
+        con.commit()
+        return rows
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _mark(self, sql: str, params: tuple) -> None:
+        con = self.connect()
+        try:
+            con.cursor().execute(sql, params)
+            con.commit()
+        finally:
+            con.close()
+
+    def deliver_due(self, settings: Optional[SmtpSettings] = None, session: Optional[SmtpSession] = None) -> int:
+        """Send one batch of due messages; returns how many rows were claimed.
+
+        No connection is held while sending: the claim is committed and released first, and each
+        outcome is written on a connection taken just for that UPDATE.
+        """
+        settings = settings or SmtpSettings.from_env()
+        session = session or self.sessions[0]
+        ph = self._ph
+        con = self.connect()
+        try:
+            rows = self._claim(con)
+        finally:
+            con.close()
+        for email_id, to_email, message, attempts in rows:
+            try:
+                if settings.host:
+                    self.limiter.acquire()
+                    session.send(settings, to_email, message)
+                else:
+                    print(f"[DEV] Would send email #{email_id} to {to_email} ({len(message)} bytes)")
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"[:500]
+                if is_permanent_failure(exc) or attempts >= self.max_attempts:
+                    print(f"Email #{email_id} to {to_email} failed permanently:", error)
+                    self._mark(f"UPDATE outbound_emails SET status = 'failed', last_error = {ph} WHERE id = {ph}", (error, email_id))
+                    self._count("failed")
+                else:
+                    self._mark(
+                        f"UPDATE outbound_emails SET available_at = {ph}, last_error = {ph} WHERE id = {ph}",
+                        (time.time() + self._backoff(attempts), error, email_id),
+                    )
+                    self._count("retried")
+            else:
+                # Per message, so a crash later in the batch does not resend what already went out
+                self._mark(
+                    f"UPDATE outbound_emails SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = {ph}",
+                    (email_id,),
+                )
+                self._count("sent")
+        return len(rows)
+
+    def _run(self, session: SmtpSession) -> None:
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                claimed = self.deliver_due(session=session)
+            except Exception as exc:
+                print("Mail queue worker error:", exc)
+            if claimed >= self.batch_size:
+                continue
+            timeout = self.poll_seconds
+            idle = session.idle_for()
+            if idle is not None:
+                if idle >= session.idle_seconds:
+                    session.close()
+                else:
+                    timeout = min(timeout, session.idle_seconds - idle)
+            self._wake.wait(timeout)
+            self._wake.clear()
+        session.close()
+
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads) and self._threads_pid == os.getpid()
+
+    def start(self) -> None:
+        """Start this process's sender threads (again after a fork)."""
+        with self._lock:
+            if self.running():
+                return
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, args=(session,), name=f"mail-queue-{i}", daemon=True)
+                for i, session in enumerate(self.sessions)
+            ]
+            self._threads_pid = os.getpid()
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT status, COUNT(*) AS c FROM outbound_emails GROUP BY status")
+            by_status = {r["status"]: int(r["c"]) for r in cur.fetchall()}
+        finally:
+            con.close()
+        return {
+            "pending": by_status.get("pending", 0),
+            "sent": by_status.get("sent", 0),
+            "failed": by_status.get("failed", 0),
+            "worker": {
+                "running": self.running(),
+                "senders": len(self.sessions),
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "smtp_connects": sum(session.connects for session in self.sessions),
+            },
+        }
+
+
+__all__ = [
+    "MailQueue",
+    "RateLimiter",
+    "SmtpSession",
+    "SmtpSettings",
+    "assemble_message",
+    "encode_inline_image",
+    "encode_text_part",
+    "render_message",
+    "is_permanent_failure",
+]
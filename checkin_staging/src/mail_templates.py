@@ -0,0 +1,127 @@
+"""Outbound email templates, compiled once and rendered per recipient.
+
+An email ``<name>`` is ``email/<name>.txt`` under ``templates/``: a ``Subject:`` line, a blank line
+and the plain-text body, plus an optional ``email/<name>.html`` (usually extending
+``email/_layout.html``, which carries the branding). Templates are compiled on first use and not
+re-read until restart.
+
+Parts whose templates (including the ones they extend or include) use no per-recipient variables
+are rendered and MIME-encoded once; per message only the personalised parts and inline images are
+encoded, and ``mail_queue.assemble_message`` joins the pre-encoded bytes without building an
+``email.message`` tree.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, Template, meta, select_autoescape
+
+from mail_queue import SmtpSettings, assemble_message, encode_inline_image, encode_text_part
+
+
+@dataclass(frozen=True)
+class _Part:
+    subtype: str
+    # Encoded MIME part for static templates, else the compiled template
+    content: Union[bytes, Template]
+
+
+@dataclass(frozen=True)
+class _Email:
+    text: _Part
+    html: Optional[_Part]
+
+
+def _split_subject(rendered: str, template_name: str) -> tuple[str, str]:
+    head, sep, body = rendered.partition("\n\n")
+    if not sep or not head.startswith("Subject:") or "\n" in head:
+        raise RuntimeError(f"{template_name} must start with a 'Subject:' line and a blank line")
+    return head[len("Subject:"):].strip(), body
+
+
+class MailTemplates:
+    """``render`` gives (subject, body, body_html); ``message`` gives (subject, RFC 5322 bytes)."""
+
+    def __init__(self, template_dir: str, **globals):
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir),
+            autoescape=select_autoescape(enabled_extensions=("html",), default_for_string=False),
+            auto_reload=False,
+            undefined=StrictUndefined,
+        )
+        self.env.globals.update(globals)
+        self._emails: dict[str, _Email] = {}
+        # Static .txt parts keep their subject next to the encoded body
+        self._static_subjects: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _variables(self, template_name: str) -> set:
+        source = self.env.loader.get_source(self.env, template_name)[0]
+        ast = self.env.parse(source)
+        names = set(meta.find_undeclared_variables(ast))
+        for parent in meta.find_referenced_templates(ast):
+            # None is a dynamic {% extends var %}; treat the part as personalised
+            names |= self._variables(parent) if parent else {"*"}
+        return names
+
+    def _part(self, name: str, subtype: str) -> _Part:
+        ext = "txt" if subtype == "plain" else subtype
+        template_name = f"email/{name}.{ext}"
+        template = self.env.get_template(template_name)
+        if self._variables(template_name) - set(self.env.globals):
+            return _Part(subtype, template)
+        rendered = template.render()
+        if subtype == "plain":
+            subject, rendered = _split_subject(rendered, template_name)
+            self._static_subjects[name] = subject
+        return _Part(subtype, encode_text_part(subtype, rendered))
+
+    def _email(self, name: str) -> _Email:
+        email = self._emails.get(name)
+        if email is None:
+            with self._lock:
+                email = self._emails.get(name)
+                if email is None:
+                    html = None
+                    if f"email/{name}.html" in self.env.list_templates(extensions=["html"]):
+                        html = self._part(name, "html")
+                    email = self._emails[name] = _Email(self._part(name, "plain"), html)
+        return email
+
+    def render(self, template: str, **context) -> tuple[str, str, Optional[str]]:
+        """(subject, plain-text body, HTML body or None) of email ``template`` for one recipient."""
+        template_name = f"email/{template}.txt"
+        subject, body = _split_subject(self.env.get_template(template_name).render(**context), template_name)
+        body_html = None
+        if self._email(template).html is not None:
+            body_html = self.env.get_template(f"email/{template}.html").render(**context)
+        return subject, body, body_html
+
+    def message(
+        self,
+        settings: SmtpSettings,
+        to_email: str,
+        template: str,
+        inline_images: Optional[list] = None,
+        **context,
+    ) -> tuple[str, bytes]:
+        """(subject, message bytes) of email ``template`` to ``to_email``; inline_images are
+        ``(filename, content, mimetype, cid)`` referenced from the HTML as ``cid:``."""
+        email = self._email(template)
+        if isinstance(email.text.content, bytes):
+            subject, text_part = self._static_subjects[template], email.text.content
+        else:
+            subject, body = _split_subject(email.text.content.render(**context), f"email/{template}.txt")
+            text_part = encode_text_part("plain", body)
+        html_part = None
+        if email.html is not None:
+            html = email.html.content
+            html_part = html if isinstance(html, bytes) else encode_text_part("html", html.render(**context))
+        images = [encode_inline_image(*image) for image in inline_images or ()]
+        return subject, assemble_message(settings, to_email, subject, text_part, html_part, images)
+
+
+__all__ = ["MailTemplates"]
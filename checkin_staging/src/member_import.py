@@ -0,0 +1,363 @@
+"""Set-based member roster import and diff.
+
+Rows are staged into a temporary ``members_import`` table (COPY on Postgres, ``executemany`` on
+SQLite) and then compared with ``members`` in a handful of statements, whatever the roster size:
+
+1. resolve each staged row to an existing member by external_id, then email, then phone;
+2. collapse rows that resolve to the same member, or new rows that share any identifier with each
+   other (directly or through a chain of rows), so the last row in the file wins;
+3. classify each remaining row as insert, update, reactivate or unchanged; active members no row
+   resolved to are the deactivation candidates.
+
+``plan()`` reports that diff (the import preview); ``apply()`` executes it: optionally deactivate the
+missing members, UPDATE changed members, INSERT new ones and fill in missing ``qr_token`` values.
+
+Staged rows must already be normalized (``email_lower``/``phone_e164``). The caller owns the
+connection and the transaction; nothing here commits.
+"""
+
+from __future__ import annotations
+
+import secrets
+import time
+from typing import Iterable
+
+# Active members that no staged row resolved to. Members without any identifier are never candidates
+# since a roster could not have listed them.
+MISSING_MEMBERS_WHERE = """
+    members.status = 'active'
+    AND COALESCE(members.external_id, members.email_lower, members.phone_e164) IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM members_import t WHERE t.member_id = members.id)
+"""
+
+STAGING_COLUMNS = ("seq", "external_id", "name", "email_lower", "phone_e164", "membership_tier", "status", "new_token")
+
+# Identifiers that make two new rows the same person
+IDENTITY_COLUMNS = ("external_id", "email_lower", "phone_e164")
+
+
+class DeactivationLimitExceeded(RuntimeError):
+    def __init__(self, candidates: int, active: int, max_fraction: float):
+        self.candidates = candidates
+        self.active = active
+        self.max_fraction = max_fraction
+        super().__init__(
+            f"Refusing to deactivate {candidates} of {active} active members "
+            f"(more than {max_fraction:.0%}); check the roster or force the import"
+        )
+
+
+class MemberImport:
+    def __init__(self, con, postgres: bool):
+        self.con = con
+        self.postgres = postgres
+        self.cur = con.cursor()
+        self.staged = 0
+        self.planned: dict | None = None
+        self._started = time.perf_counter()
+
+    def begin(self) -> "MemberImport":
+        if self.postgres:
+            self.cur.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS members_import (
+                    seq INTEGER PRIMARY KEY,
+                    external_id TEXT,
+                    name TEXT NOT NULL,
+                    email_lower TEXT,
+                    phone_e164 TEXT,
+                    membership_tier TEXT,
+                    status TEXT NOT NULL,
+                    new_token TEXT NOT NULL,
+                    identity_group INTEGER,
+                    member_id BIGINT,
+                    action TEXT
+                ) ON COMMIT DROP
+                """
+            )
+            self.cur.execute("TRUNCATE members_import")
+        else:
+            self.cur.execute("DROP TABLE IF EXISTS temp.members_import")
+            self.cur.execute(
+                """
+                CREATE TEMP TABLE members_import (
+                    seq INTEGER PRIMARY KEY,
+                    external_id TEXT,
+                    name TEXT NOT NULL,
+                    email_lower TEXT,
+                    phone_e164 TEXT,
+                    membership_tier TEXT,
+                    status TEXT NOT NULL,
+                    new_token TEXT NOT NULL,
+                    identity_group INTEGER,
+                    member_id INTEGER,
+                    action TEXT
+                )
+                """
+            )
+        return self
+
+    def stage(self, rows: Iterable[dict]) -> int:
+        """Append normalized rows to the staging table; may be called once per chunk."""
+        batch = []
+        for r in rows:
+            self.staged += 1
+            batch.append((
+                self.staged,
+                r["external_id"],
+                r["name"],
+                r["email_lower"],
+                r["phone_e164"],
+                r["membership_tier"],
+                r["status"],
+                secrets.token_urlsafe(24),
+            ))
+        if not batch:
+            return 0
+        if self.postgres:
+            with self.cur.copy(f"COPY members_import ({', '.join(STAGING_COLUMNS)}) FROM STDIN") as copy:
+                for values in batch:
+                    copy.write_row(values)
+        else:
+            self.cur.executemany(
+                f"INSERT INTO members_import ({', '.join(STAGING_COLUMNS)}) VALUES ({', '.join('?' for _ in STAGING_COLUMNS)})",
+                batch,
+            )
+        return len(batch)
+
+    def _resolve(self) -> None:
+        self.cur.execute("CREATE INDEX IF NOT EXISTS members_import_member ON members_import (member_id, seq)")
+        if self.postgres:
+            # Autovacuum never analyzes temp tables; give the planner real row counts
+            self.cur.execute("ANALYZE members_import")
+        # Match precedence: external_id, then email, then phone
+        self.cur.execute(
+            """
+            UPDATE members_import SET member_id = COALESCE(
+                (SELECT m.id FROM members m WHERE members_import.external_id IS NOT NULL AND m.external_id = members_import.external_id ORDER BY m.id LIMIT 1),
+                (SELECT m.id FROM members m WHERE members_import.email_lower IS NOT NULL AND m.email_lower = members_import.email_lower ORDER BY m.id LIMIT 1),
+                (SELECT m.id FROM members m WHERE members_import.phone_e164 IS NOT NULL AND m.phone_e164 = members_import.phone_e164 ORDER BY m.id LIMIT 1)
+            )
+            """
+        )
+        # Applying rows one by one means a later row for the same member overwrites an earlier one
+        self.cur.execute(
+            """
+            DELETE FROM members_import
+            WHERE member_id IS NOT NULL
+              AND seq < (SELECT MAX(t.seq) FROM members_import t WHERE t.member_id = members_import.member_id)
+            """
+        )
+        self._group_new_rows()
+        # Inserting rows one by one would create the member from the first row of a group (keeping
+        # its external_id) and let later rows overwrite the rest; keep the earliest external_id
+        self.cur.execute(
+            """
+            UPDATE members_import SET external_id = (
+                SELECT t.external_id FROM members_import t
+                WHERE t.identity_group = members_import.identity_group AND t.external_id IS NOT NULL
+                ORDER BY t.seq LIMIT 1
+            )
+            WHERE member_id IS NULL
+              AND seq = (SELECT MAX(t.seq) FROM members_import t WHERE t.identity_group = members_import.identity_group)
+            """
+        )
+        self.cur.execute(
+            """
+            DELETE FROM members_import
+            WHERE member_id IS NULL
+              AND seq < (SELECT MAX(t.seq) FROM members_import t WHERE t.identity_group = members_import.identity_group)
+            """
+        )
+
+    def _group_new_rows(self) -> None:
+        """Label new rows with the lowest seq of every new row they share an identifier with.
+
+        Each pass lowers a row's group to the smallest group among rows with the same external_id,
+        email or phone; chains (A shares an email with B, B a phone with C) settle after a few passes.
+        """
+        self.cur.execute("UPDATE members_import SET identity_group = seq WHERE member_id IS NULL")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS members_import_group ON members_import (identity_group, seq)")
+        changed = True
+        while changed:
+            changed = False
+            for column in IDENTITY_COLUMNS:
+                self.cur.execute(
+                    f"""
+                    UPDATE members_import SET identity_group = g.identity_group
+                    FROM (
+                        SELECT {column} AS identifier, MIN(identity_group) AS identity_group
+                        FROM members_import
+                        WHERE member_id IS NULL AND {column} IS NOT NULL
+                        GROUP BY {column}
+                    ) g
+                    WHERE members_import.member_id IS NULL
+                      AND members_import.{column} = g.identifier
+                      AND members_import.identity_group > g.identity_group
+                    """
+                )
+                if self.cur.rowcount > 0:
+                    changed = True
+
+    def _classify(self) -> None:
+        distinct = "IS DISTINCT FROM" if self.postgres else "IS NOT"
+        self.cur.execute(
+            f"""
+            UPDATE members_import SET action = CASE
+                WHEN member_id IS NULL THEN 'insert'
+                WHEN status = 'active' AND EXISTS (
+                    SELECT 1 FROM members m WHERE m.id = members_import.member_id AND m.status = 'inactive'
+                ) THEN 'reactivate'
+                WHEN EXISTS (
+                    SELECT 1 FROM members m
+                    WHERE m.id = members_import.member_id
+                      AND (m.name {distinct} members_import.name
+                           OR m.email_lower {distinct} members_import.email_lower
+                           OR m.phone_e164 {distinct} members_import.phone_e164
+                           OR m.membership_tier {distinct} members_import.membership_tier
+                           OR m.status {distinct} members_import.status)
+                ) THEN 'update'
+                ELSE 'unchanged'
+            END
+            """
+        )
+
+    def plan(self, sample_size: int = 5) -> dict:
+        """Resolve and classify everything staged; returns counts and the first few rows per action."""
+        if self.planned is not None:
+            return self.planned
+        self._resolve()
+        self._classify()
+        self.cur.execute("SELECT action, COUNT(*) AS c FROM members_import GROUP BY action")
+        by_action = {r["action"]: int(r["c"]) for r in self.cur.fetchall()}
+        samples = {}
+        for action in ("insert", "update", "reactivate"):
+            self.cur.execute(
+                f"""
+                SELECT t.name, t.email_lower, t.phone_e164, m.name AS current_name, m.email_lower AS current_email
+                FROM members_import t LEFT JOIN members m ON m.id = t.member_id
+                WHERE t.action = '{action}'
+                ORDER BY t.seq LIMIT {int(sample_size)}
+                """
+            )
+            if action == "insert":
+                samples[action] = [{"name": r["name"], "email": r["email_lower"], "phone": r["phone_e164"]} for r in self.cur.fetchall()]
+            else:
+                samples[action] = [{"name": r["current_name"], "email": r["current_email"]} for r in self.cur.fetchall()]
+        if self.staged:
+            self.cur.execute(f"SELECT COUNT(*) AS c FROM members WHERE {MISSING_MEMBERS_WHERE}")
+            missing_count = int(self.cur.fetchone()["c"])
+            self.cur.execute(
+                f"SELECT name, email_lower FROM members WHERE {MISSING_MEMBERS_WHERE} ORDER BY id LIMIT {int(sample_size)}"
+            )
+            missing = [{"name": r["name"], "email": r["email_lower"]} for r in self.cur.fetchall()]
+        else:
+            # An empty upload never marks the whole roster missing
+            missing_count, missing = 0, []
+        self.planned = {
+            "counts": {
+                "inserts": by_action.get("insert", 0),
+                "updates": by_action.get("update", 0),
+                "reactivations": by_action.get("reactivate", 0),
+                "unchanged": by_action.get("unchanged", 0),
+                "deactivate_candidates": missing_count,
+                "total_rows": self.staged,
+            },
+            "samples": {
+                "inserts": samples["insert"],
+                "updates": samples["update"],
+                "reactivations": samples["reactivate"],
+                "deactivate_candidates": missing,
+            },
+        }
+        return self.planned
+
+    def _deactivate_missing(self, max_fraction: float | None) -> int:
+        candidates = self.plan()["counts"]["deactivate_candidates"]
+        if not candidates:
+            return 0
+        if max_fraction is not None:
+            self.cur.execute("SELECT COUNT(*) AS c FROM members WHERE status = 'active'")
+            active = int(self.cur.fetchone()["c"])
+            if candidates > active * max_fraction:
+                raise DeactivationLimitExceeded(candidates, active, max_fraction)
+        # Runs before the INSERT below: new members have no staged member_id and would look missing
+        sql = f"UPDATE members SET status = 'inactive', updated_at = CURRENT_TIMESTAMP WHERE {MISSING_MEMBERS_WHERE}"
+        if self.postgres:
+            self.cur.execute(sql + " RETURNING id")
+            return len(self.cur.fetchall())
+        self.cur.execute(sql)
+        return max(self.cur.rowcount, 0)
+
+    def apply(self, deactivate_missing: bool = False, max_deactivate_fraction: float | None = None) -> dict:
+        """Execute the plan; returns counts and throughput.
+
+        With ``deactivate_missing`` the plan's deactivation candidates are marked inactive, unless they
+        exceed ``max_deactivate_fraction`` of the active members, which raises DeactivationLimitExceeded
+        before anything is written.
+        """
+        counts = self.plan()["counts"]
+        deactivated = self._deactivate_missing(max_deactivate_fraction) if deactivate_missing and self.staged else 0
+        # Listed members the roster now marks inactive, so callers know per-member state went stale
+        self.cur.execute(
+            """
+            SELECT COUNT(*) AS c FROM members_import t JOIN members m ON m.id = t.member_id
+            WHERE t.action = 'update' AND t.status = 'inactive' AND m.status = 'active'
+            """
+        )
+        marked_inactive = int(self.cur.fetchone()["c"])
+        self.cur.execute(
+            """
+            UPDATE members
+            SET name = t.name,
+                email_lower = t.email_lower,
+                phone_e164 = t.phone_e164,
+                membership_tier = t.membership_tier,
+                status = t.status,
+                updated_at = CURRENT_TIMESTAMP
+            FROM members_import t
+            WHERE members.id = t.member_id AND t.action IN ('update', 'reactivate')
+            """
+        )
+        # The statement also covers reactivations, which are reported on their own
+        updated = max(self.cur.rowcount - counts["reactivations"], 0)
+        self.cur.execute(
+            """
+            INSERT INTO members (external_id, name, email_lower, phone_e164, membership_tier, status, qr_token)
+            SELECT external_id, name, email_lower, phone_e164, membership_tier, status, new_token
+            FROM members_import
+            WHERE action = 'insert'
+            ORDER BY seq
+            """
+        )
+        inserted = max(self.cur.rowcount, 0)
+        self.cur.execute(
+            """
+            UPDATE members
+            SET qr_token = t.new_token
+            FROM members_import t
+            WHERE members.id = t.member_id AND members.qr_token IS NULL
+            """
+        )
+        tokens_issued = max(self.cur.rowcount, 0) + inserted
+        elapsed = time.perf_counter() - self._started
+        return {
+            "staged": self.staged,
+            "inserted": inserted,
+            "updated": updated,
+            "reactivated": counts["reactivations"],
+            "unchanged": counts["unchanged"],
+            "deactivated": deactivated,
+            "marked_inactive": marked_inactive,
+            "tokens_issued": tokens_issued,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.staged / elapsed) if elapsed > 0 else None,
+        }
+
+    def finish(self) -> None:
+        """Drop the staging table (Postgres drops it at commit or rollback on its own)."""
+        if not self.postgres:
+            self.cur.execute("DROP TABLE IF EXISTS temp.members_import")
+
+
+__all__ = ["MemberImport", "DeactivationLimitExceeded"]
@@ -0,0 +1,38 @@
+"""QR code PNG rendering (qrcode[pil]).
+
+Kept apart from checkin_app so that processes spawned to render QR codes for email campaigns
+import only this module, not the whole app. Without the qrcode package every render returns
+``b''``: QR endpoints answer 500 and emails go out without the image.
+"""
+
+from __future__ import annotations
+
+import io
+
+try:
+    import qrcode
+except Exception:
+    qrcode = None
+
+
+def generate_qr_png(data: str, box_size: int = 8, border: int = 2) -> bytes:
+    if qrcode is None:
+        return b''
+    try:
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=box_size,
+            border=border,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="black", back_color="white")
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+    except Exception:
+        return b''
+
+
+__all__ = ["generate_qr_png"]
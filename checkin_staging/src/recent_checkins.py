@@ -0,0 +1,203 @@
+"""Members who checked in within the duplicate window, held in memory as a time wheel.
+
+``note`` is fed every committed check-in (the write path, the counters catch-up and the startup
+seed) and keeps the newest one per member; ``get`` answers "did this member check in within the
+last window_minutes?" with a dict lookup. Entries sit in one bucket per UTC minute, so expiring a
+minute drops a whole bucket instead of scanning every member.
+
+With a shared cache backend (sqlite or redis, see shared_cache.py) each check-in is also written
+there with a TTL of what remains of its window, and a local miss asks the backend, so a scan at
+another worker is recognised before that worker's check-in reaches this one's catch-up query.
+Invalidations go through the backend too: ``forget`` rotates a flush token and ``reset`` also a
+generation that every shared entry is tagged with. Each worker reads both at most every
+``check_seconds`` and drops its local wheel when either changed; entries of an older generation
+are ignored. With the memory backend nothing is shared, and another worker's stale entries expire
+with the window. The database stays authoritative: a miss here only means the insert's own
+duplicate check decides.
+
+Timestamps are naive UTC datetimes, as in checkin_counters.py.
+"""
+
+from __future__ import annotations
+
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+_EPOCH = datetime(1970, 1, 1)
+# Generation and flush tokens must outlive every entry written under them
+_TOKEN_TTL_SECONDS = 30 * 24 * 3600
+
+
+def _seconds(ts: datetime) -> float:
+    return (ts - _EPOCH).total_seconds()
+
+
+class RecentCheckins:
+    """member_id -> (time, name) of their latest check-in inside the window; thread-safe."""
+
+    def __init__(self, window_minutes: int, backend=None, namespace: str = "recent_checkin", check_seconds: float = 1.0):
+        self.window_seconds = max(1, int(window_minutes)) * 60
+        # A memory backend is per-process and would only duplicate the wheel
+        self.backend = backend if backend is not None and backend.kind != "memory" else None
+        self.namespace = namespace
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._tokens: tuple[str, str] = ("", "")
+        self._checked_at = 0.0
+        self._clear()
+        if self.backend is not None:
+            try:
+                self._tokens = self._read_tokens()
+                self._checked_at = time.monotonic()
+            except Exception:
+                pass
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._last: dict[int, tuple[float, Optional[str]]] = {}
+            self._buckets: dict[int, set] = {}
+
+    def _read_tokens(self) -> tuple[str, str]:
+        values = []
+        for name in ("generation", "flush"):
+            raw = self.backend.get(self._key(name))
+            values.append(raw.decode("utf-8") if raw else "")
+        return values[0], values[1]
+
+    def _sync_tokens(self) -> None:
+        """Drop the local wheel when another worker invalidated since the last check."""
+        if self.backend is None or time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        try:
+            tokens = self._read_tokens()
+        except Exception:
+            return
+        self._checked_at = time.monotonic()
+        if tokens != self._tokens:
+            self._tokens = tokens
+            self._clear()
+
+    def _rotate(self, names: tuple) -> None:
+        try:
+            for name in names:
+                self.backend.set(self._key(name), secrets.token_hex(8).encode("utf-8"), _TOKEN_TTL_SECONDS)
+            self._tokens = self._read_tokens()
+            self._checked_at = time.monotonic()
+        except Exception:
+            pass
+
+    def reset(self) -> None:
+        """Forget everyone, in every worker sharing the backend (e.g. after a bulk import)."""
+        self._clear()
+        if self.backend is not None:
+            self._rotate(("generation", "flush"))
+
+    def _key(self, member_id) -> str:
+        return f"{self.namespace}:{member_id}"
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        for minute in [m for m in self._buckets if (m + 1) * 60 <= cutoff]:
+            for member_id in self._buckets.pop(minute):
+                entry = self._last.get(member_id)
+                if entry is not None and entry[0] <= cutoff:
+                    del self._last[member_id]
+
+    def _remember(self, member_id: int, at: float, name: Optional[str]) -> bool:
+        entry = self._last.get(member_id)
+        if entry is not None and entry[0] >= at:
+            return False
+        self._last[member_id] = (at, name)
+        self._buckets.setdefault(int(at // 60), set()).add(member_id)
+        return True
+
+    def note(self, member_id: int, ts: datetime, name: Optional[str] = None) -> None:
+        """Record a committed check-in; ones already outside the window are ignored."""
+        at = _seconds(ts)
+        now = time.time()
+        if at <= now - self.window_seconds:
+            return
+        self._sync_tokens()
+        with self._lock:
+            newer = self._remember(member_id, at, name)
+        if newer and self.backend is not None:
+            try:
+                value = f"{at}\n{self._tokens[0]}\n{name or ''}".encode("utf-8")
+                self.backend.set(self._key(member_id), value, at + self.window_seconds - now)
+            except Exception:
+                pass
+
+    def load(self, rows: Iterable[tuple[int, datetime, Optional[str]]]) -> None:
+        """Replace local state with (member_id, timestamp, name) rows, e.g. the startup seed."""
+        self._clear()
+        cutoff = time.time() - self.window_seconds
+        with self._lock:
+            for member_id, ts, name in rows:
+                at = _seconds(ts)
+                if at > cutoff:
+                    self._remember(member_id, at, name)
+
+    def _shared(self, member_id: int, cutoff: float) -> Optional[tuple[float, Optional[str]]]:
+        try:
+            raw = self.backend.get(self._key(member_id))
+        except Exception:
+            return None
+        if not raw:
+            return None
+        at, generation, name = (raw.decode("utf-8").split("\n", 2) + ["", ""])[:3]
+        if generation != self._tokens[0] or float(at) <= cutoff:
+            return None
+        with self._lock:
+            self._remember(member_id, float(at), name or None)
+        return float(at), name or None
+
+    def get(self, member_id: int) -> Optional[dict]:
+        """{"name", "timestamp"} of the member's check-in inside the window, else None."""
+        self._sync_tokens()
+        now = time.time()
+        cutoff = now - self.window_seconds
+        with self._lock:
+            self._expire(now)
+            entry = self._last.get(member_id)
+        if entry is None and self.backend is not None:
+            entry = self._shared(member_id, cutoff)
+        hit = entry is not None and entry[0] > cutoff
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            return None
+        return {"name": entry[1], "timestamp": _EPOCH + timedelta(seconds=entry[0])}
+
+    def forget(self, member_id: int) -> None:
+        """Drop a member (deactivated or deleted) so their next scan goes to the database, here and
+        in the other workers sharing the backend."""
+        with self._lock:
+            self._last.pop(member_id, None)
+        if self.backend is not None:
+            try:
+                self.backend.delete(self._key(member_id))
+            except Exception:
+                pass
+            self._rotate(("flush",))
+
+    def stats(self) -> dict:
+        with self._lock:
+            members, hits, misses = len(self._last), self.hits, self.misses
+        return {
+            "backend": self.backend.kind if self.backend is not None else "memory",
+            "window_seconds": self.window_seconds,
+            "members": members,
+            "hits": hits,
+            "misses": misses,
+        }
+
+
+__all__ = ["RecentCheckins"]
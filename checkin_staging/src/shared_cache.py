@@ -0,0 +1,232 @@
+"""Pluggable key/value cache shared between gunicorn workers, plus a single-flight response cache.
+
+Backends are chosen by URL (``CHECKIN_CACHE_URL``):
+
+- ``memory://`` (default) — per-process dict; nothing is shared between workers.
+- ``sqlite:///path/to/cache.sqlite3`` — a small SQLite file every worker on the host opens.
+- ``redis://host:6379/0`` — any Redis-compatible server (requires the ``redis`` package).
+
+Values are bytes. Every backend supports ``get``, ``set`` with a TTL, ``add`` (set only if absent or
+expired, used as a cross-worker lock) and ``delete``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+
+class MemoryBackend:
+    kind = "memory"
+
+    def __init__(self):
+        self._data: dict[str, tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._data[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl_seconds, value)
+            if len(self._data) > 4096:
+                now = time.time()
+                for k in [k for k, (exp, _) in self._data.items() if exp <= now]:
+                    del self._data[k]
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.time():
+                return False
+            self._data[key] = (time.time() + ttl_seconds, value)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteBackend:
+    kind = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        con = self._con()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+        con.commit()
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            self._local.con = con
+        return con
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._con().execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        self._con().execute(
+            "INSERT OR REPLACE INTO cache(key, value, expires_at) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(value), time.time() + ttl_seconds),
+        )
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        now = time.time()
+        cur = self._con().execute(
+            """
+            INSERT INTO cache(key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+            WHERE cache.expires_at <= ?
+            """,
+            (key, sqlite3.Binary(value), now + ttl_seconds, now),
+        )
+        return cur.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        self._con().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisBackend:
+    kind = "redis"
+
+    def __init__(self, url: str):
+        import redis  # optional dependency
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        self._client.set(key, value, px=max(1, int(ttl_seconds * 1000)))
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        return bool(self._client.set(key, value, px=max(1, int(ttl_seconds * 1000)), nx=True))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+
+def make_cache_backend(url: Optional[str]):
+    """Build a backend from a cache URL; unknown or unusable URLs fall back to memory."""
+    url = (url or "memory://").strip()
+    scheme = urlparse(url).scheme
+    try:
+        if scheme == "sqlite":
+            path = url[len("sqlite://"):]
+            return SQLiteBackend(path if path.startswith("/") else os.path.abspath(path))
+        if scheme in ("redis", "rediss", "unix"):
+            return RedisBackend(url)
+    except Exception as exc:
+        print(f"Cache backend {scheme} unavailable, using memory:", exc)
+    return MemoryBackend()
+
+
+class ResponseCache:
+    """Caches rendered response bodies with a strong ETag and single-flight recompute.
+
+    Within a process, concurrent misses for one key wait for a single computation. Across workers a
+    short lock entry in the shared backend lets one worker compute while the others poll for its
+    result, falling back to computing themselves if it does not show up in time.
+    """
+
+    def __init__(self, backend, namespace: str, ttl_seconds: float, lock_seconds: float = 5.0):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def etag_for(body: bytes) -> str:
+        return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _read(self, full_key: str) -> Optional[tuple[bytes, str]]:
+        try:
+            raw = self.backend.get(full_key)
+        except Exception:
+            return None
+        if not raw:
+            return None
+        etag, _, body = raw.partition(b"\n")
+        return body, etag.decode("ascii")
+
+    def get_or_compute(self, key: str, compute: Callable[[], bytes]) -> tuple[bytes, str]:
+        """Return (body, etag) for key, computing and storing it on a miss."""
+        full_key = self._key(key)
+        hit = self._read(full_key)
+        if hit:
+            self.hits += 1
+            return hit
+        with self._locks_guard:
+            lock = self._locks.setdefault(full_key, threading.Lock())
+        with lock:
+            hit = self._read(full_key)
+            if hit:
+                self.hits += 1
+                return hit
+            self.misses += 1
+            lock_key = full_key + ":lock"
+            try:
+                owner = self.backend.add(lock_key, b"1", self.lock_seconds)
+            except Exception:
+                owner = True
+            if not owner:
+                deadline = time.monotonic() + self.lock_seconds
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    hit = self._read(full_key)
+                    if hit:
+                        return hit
+            body = compute()
+            etag = self.etag_for(body)
+            try:
+                self.backend.set(full_key, etag.encode("ascii") + b"\n" + body, self.ttl_seconds)
+                if owner:
+                    self.backend.delete(lock_key)
+            except Exception:
+                pass
+            return body, etag
+
+    def invalidate(self, key: str) -> None:
+        try:
+            self.backend.delete(self._key(key))
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.kind, "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl_seconds}
+
+
+__all__ = [
+    "MemoryBackend",
+    "SQLiteBackend",
+    "RedisBackend",
+    "make_cache_backend",
+    "ResponseCache",
+]
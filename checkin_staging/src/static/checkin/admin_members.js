@@ -14,6 +14,8 @@
 
   let page = 1;
   const perPage = 25;
+  // cursors[i] is the `after` cursor that loads page i+1; page 1 needs none
+  let cursors = [null];
   let total = 0;
   let totalPages = 1;
   let searchTimer = null;
@@ -27,19 +29,25 @@
 
   async function fetchPage() {
     const params = new URLSearchParams();
-    if (qEl.value.trim()) params.set('q', qEl.value.trim());
+    if (qEl.value.trim()) {
+      params.set('q', qEl.value.trim());
+      params.set('estimate', '1');
+    }
     if (tierEl.value) params.set('tier', tierEl.value);
     if (statusEl.value) params.set('status', statusEl.value);
     params.set('page', page);
     params.set('per_page', perPage);
+    if (cursors[page - 1]) params.set('after', cursors[page - 1]);
     const r = await fetch(`/api/admin/members?${params.toString()}`);
     const j = await r.json();
     if (!j.ok) { rowsEl.innerHTML = `<tr><td colspan="5">${esc(j.error||'Failed to load')}</td></tr>`; return; }
     const list = j.items || [];
+    cursors[page] = j.next_after || null;
     total = j.total || 0;
     totalPages = Math.max(1, Math.ceil(total / (j.per_page || perPage)));
-    countEl.textContent = `${total.toLocaleString()} members`;
-    pageInfo.textContent = `Page ${j.page} of ${totalPages}`;
+    const approx = j.total_estimated ? '~' : '';
+    countEl.textContent = `${approx}${total.toLocaleString()} members`;
+    pageInfo.textContent = `Page ${j.page} of ${approx}${totalPages}`;
     rowsEl.innerHTML = list.map(m => `
       <tr data-id="${m.id}">
         <td><a href="#" class="rowlink" data-id="${m.id}">${esc(m.name||'')}</a></td>
@@ -50,7 +58,7 @@
       </tr>
     `).join('');
     prevBtn.disabled = (page <= 1);
-    nextBtn.disabled = (page >= totalPages);
+    nextBtn.disabled = !j.next_after;
   }
 
   rowsEl?.addEventListener('click', async (e)=>{
@@ -84,10 +92,12 @@
     `;
   });
 
-  qEl?.addEventListener('input', () => { page = 1; scheduleFetch(); });
-  applyBtn?.addEventListener('click', ()=>{ page=1; fetchPage(); });
+  function resetPaging() { page = 1; cursors = [null]; }
+
+  qEl?.addEventListener('input', () => { resetPaging(); scheduleFetch(); });
+  applyBtn?.addEventListener('click', ()=>{ resetPaging(); fetchPage(); });
   prevBtn?.addEventListener('click', ()=>{ if(page>1){page--; fetchPage();} });
-  nextBtn?.addEventListener('click', ()=>{ if(page<totalPages){ page++; fetchPage(); } });
+  nextBtn?.addEventListener('click', ()=>{ if(cursors[page]){ page++; fetchPage(); } });
 
   fetchPage();
 })();
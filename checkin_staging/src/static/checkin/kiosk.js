@@ -120,6 +120,85 @@
     setTimeout(() => overlay.classList.add('hidden'), 5000);
   }
 
+  // Live scans go to /api/checkin. When the network or server is down they wait in localStorage with
+  // a per-scan idempotency key and are flushed to /api/checkin/batch once it is back; a resent batch
+  // is answered from the server's stored results, so nothing is checked in twice.
+  const QUEUE_KEY = 'gymsense:pendingScans';
+  const QUEUE_MAX = 500;
+  const FLUSH_BATCH = 50;
+  function newKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+  }
+  const deviceId = (() => {
+    try {
+      let id = localStorage.getItem('gymsense:deviceId');
+      if (!id) { id = 'kiosk-' + newKey().slice(0, 8); localStorage.setItem('gymsense:deviceId', id); }
+      return id;
+    } catch { return 'kiosk-1'; }
+  })();
+  function loadQueue() {
+    try { return JSON.parse(localStorage.getItem(QUEUE_KEY) || '[]'); } catch { return []; }
+  }
+  function saveQueue(queue) {
+    try { localStorage.setItem(QUEUE_KEY, JSON.stringify(queue.slice(-QUEUE_MAX))); } catch {}
+  }
+  async function readJson(r) {
+    try { return await r.json(); } catch { return null; }
+  }
+  // Results for the batch, or null when it was not answered (keep the scans for the next attempt)
+  async function postScans(scans) {
+    let r;
+    try {
+      r = await fetch('/api/checkin/batch', { method: 'POST', headers: { 'Content-Type': 'application/json', 'X-Device-Id': deviceId }, body: JSON.stringify({ scans }) });
+    } catch (err) {
+      return null;
+    }
+    if (!r.ok) return null;
+    const j = await readJson(r);
+    return j && j.ok && Array.isArray(j.results) ? j.results : null;
+  }
+  let flushing = false;
+  async function flushQueue() {
+    if (flushing) return;
+    flushing = true;
+    let flushed = false;
+    try {
+      let queue = loadQueue();
+      while (queue.length) {
+        const batch = queue.slice(0, FLUSH_BATCH);
+        // null = still unreachable, keep everything for the next attempt
+        if (await postScans(batch) === null) break;
+        const sent = new Set(batch.map(s => s.idempotency_key));
+        queue = loadQueue().filter(s => !sent.has(s.idempotency_key));
+        saveQueue(queue);
+        flushed = true;
+      }
+      if (flushed) loadStatus();
+    } finally {
+      flushing = false;
+    }
+  }
+  async function submitScan(token) {
+    const scan = { idempotency_key: newKey(), qr_token: token, scanned_at: new Date().toISOString() };
+    let r = null;
+    try {
+      r = await fetch('/api/checkin', { method: 'POST', headers: { 'Content-Type': 'application/json', 'X-Device-Id': deviceId }, body: JSON.stringify({ qr_token: token }) });
+    } catch (err) {}
+    // No answer from the app (offline, server error, or a proxy's error page): queue it
+    if (!r || r.status >= 500 || r.status === 429) {
+      saveQueue([...loadQueue(), scan]);
+      return { status: 'queued' };
+    }
+    if (loadQueue().length) flushQueue();
+    if (r.status === 404) return { status: 'not_found' };
+    const j = r.ok ? await readJson(r) : null;
+    if (!j || !j.ok) return { status: 'invalid' };
+    return { status: j.message ? 'duplicate' : 'ok', member_name: j.member_name };
+  }
+  window.addEventListener('online', flushQueue);
+  setInterval(() => { if (loadQueue().length) flushQueue(); }, 30000);
+
   // Email-driven check-in/resend actions
   const emailForm = document.getElementById('member-email-form');
   emailForm?.addEventListener('submit', async (e) => {
@@ -252,14 +331,16 @@
       if (raw) {
         stopScan();
         if (aimHint) aimHint.classList.add('hidden');
-        const r = await fetch('/api/checkin', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ qr_token: raw }) });
-        const j = await r.json();
-        if (j.ok) {
-          showSuccess(j.member_name || 'Member');
+        const res = await submitScan(raw);
+        if (res.status === 'ok' || res.status === 'duplicate') {
+          showSuccess(res.member_name || 'Member');
           loadStatus();
-          window.dispatchEvent(new CustomEvent('gymsense:checkin', { detail: { member: j.member_name || 'Member' } }));
+          window.dispatchEvent(new CustomEvent('gymsense:checkin', { detail: { member: res.member_name || 'Member' } }));
+        } else if (res.status === 'queued') {
+          showSuccess('Member');
+          emailResult.textContent = "We're offline right now; your check-in is saved and will sync shortly.";
         } else {
-          emailResult.textContent = j.error || 'Check-in failed';
+          emailResult.textContent = res.status === 'not_found' ? 'Member not found or inactive' : 'Check-in failed';
         }
         return;
       }
@@ -275,6 +356,7 @@
   setInterval(loadStatus, 300000);
   checkSupport();
   scanBtn?.addEventListener('click', startScan);
+  flushQueue();
 
   // No additional suggestions or autocomplete to avoid accidental mismatches
 })();
@@ -45,23 +45,73 @@
 
   function esc(s){ return (s==null?'':String(s)).replace(/[&<>]/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;'}[c])); }
 
+  let recentItems = [];
+
+  function applyMetrics(j) {
+    metricToday.textContent = Number(j.today_total || 0).toLocaleString();
+    metricHour.textContent = Number(j.last_hour_total || 0).toLocaleString();
+    metricMembers.textContent = Number(j.today_unique || 0).toLocaleString();
+    renderTrend(j.trend || []);
+    const nowLabel = timeFmt.format(new Date());
+    trendCaption.textContent = `Updated ${nowLabel}`;
+  }
+
+  function applySnapshot(j) {
+    if (!j.ok) { renderFallback(); return; }
+    applyMetrics(j);
+    recentItems = (j.recent || []).slice(0, 10);
+    renderRecents(recentItems);
+  }
+
+  // Live check-in pushed by /api/staff/stream; events can be replayed after a reconnect
+  function applyCheckin(ev) {
+    if (ev.id != null && recentItems.some(item => item.id === ev.id)) return;
+    recentItems = [ev, ...recentItems].slice(0, 10);
+    renderRecents(recentItems);
+    if (ev.metrics) applyMetrics(ev.metrics);
+  }
+
+  // Polls revalidate with the last ETag; an unchanged dashboard comes back as an empty 304
+  let metricsEtag = null;
   async function loadMetrics() {
     try {
-      const r = await fetch('/api/staff/metrics');
+      const r = await fetch('/api/staff/metrics', { headers: metricsEtag ? { 'If-None-Match': metricsEtag } : {} });
+      if (r.status === 304) return;
       const j = await r.json();
-      if (!j.ok) { renderFallback(); return; }
-      metricToday.textContent = Number(j.today_total || 0).toLocaleString();
-      metricHour.textContent = Number(j.last_hour_total || 0).toLocaleString();
-      metricMembers.textContent = Number(j.today_unique || 0).toLocaleString();
-      renderTrend(j.trend || []);
-      renderRecents(j.recent || []);
-      const nowLabel = timeFmt.format(new Date());
-      trendCaption.textContent = `Updated ${nowLabel}`;
+      metricsEtag = r.ok ? r.headers.get('ETag') : null;
+      applySnapshot(j);
     } catch {
       renderFallback();
     }
   }
 
+  const POLL_MS = 15000;
+  const STREAM_RETRY_MS = 300000;
+  let pollTimer = null;
+  function startPolling() {
+    if (pollTimer) return;
+    loadMetrics();
+    pollTimer = setInterval(loadMetrics, POLL_MS);
+    // Streams are capped per server worker; try for one again now and then
+    setTimeout(() => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+      connectStream();
+    }, STREAM_RETRY_MS);
+  }
+
+  function connectStream() {
+    if (!window.EventSource) { startPolling(); return; }
+    const es = new EventSource('/api/staff/stream');
+    es.addEventListener('snapshot', e => { try { applySnapshot(JSON.parse(e.data)); } catch {} });
+    es.addEventListener('checkin', e => { try { applyCheckin(JSON.parse(e.data)); } catch {} });
+    // EventSource reconnects on its own; it gives up on a 204 (no stream slot free) or an HTTP error
+    // (e.g. expired session)
+    es.addEventListener('error', () => {
+      if (es.readyState === EventSource.CLOSED) startPolling();
+    });
+  }
+
   function renderFallback() {
     metricToday.textContent = '—';
     metricHour.textContent = '—';
@@ -130,7 +180,6 @@
     }
   });
 
-  loadMetrics();
-  setInterval(loadMetrics, 60000);
+  connectStream();
   window.addEventListener('gymsense:checkin', loadMetrics);
 })();
@@ -0,0 +1,98 @@
+"""Stripe customer resolution for staff-assisted signups.
+
+A signup needs a Stripe customer for its Checkout Session. ``StripeCustomers.resolve`` reuses the
+one this process already resolved for the email (a staff retry of the same form), then the one
+linked to the member (``members.stripe_customer_id``, written by the Checkout webhook), and only
+creates a customer when neither exists. Creation sends only the normalized email, under an
+idempotency key derived from it, so a retry that reaches another worker inside Stripe's 24h
+idempotency window gets the same customer back instead of a duplicate, even when staff corrected the
+name or phone in between; the other details are then applied as an update. A newly created id is
+written to an existing member row right away, so later signups in any worker find it there.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Callable, Optional
+
+from ttl_cache import TTLCache
+
+
+class StripeCustomers:
+    def __init__(self, connect: Callable, postgres: bool, cache: TTLCache):
+        self.connect = connect
+        self.postgres = postgres
+        self.cache = cache
+        self._ph = "%s" if postgres else "?"
+
+    def _linked(self, email_lower: str) -> tuple[bool, Optional[str]]:
+        """(member exists, their stripe_customer_id)."""
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"SELECT stripe_customer_id FROM members WHERE email_lower = {self._ph} ORDER BY id LIMIT 1",
+                (email_lower,),
+            )
+            row = cur.fetchone()
+        finally:
+            con.close()
+        return (row is not None, row["stripe_customer_id"] if row is not None else None)
+
+    def _link(self, email_lower: str, customer_id: str) -> None:
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""
+                UPDATE members SET stripe_customer_id = {ph}, updated_at = CURRENT_TIMESTAMP
+                WHERE email_lower = {ph} AND stripe_customer_id IS NULL
+                """,
+                (customer_id, email_lower),
+            )
+            con.commit()
+        finally:
+            con.close()
+
+    def resolve(self, stripe, email_lower: str, replaces: Optional[str] = None, **details) -> tuple[str, bool]:
+        """(customer id, created) for this email; on a miss the customer is created with
+        ``email=email_lower`` and then updated with ``details`` (Customer.modify params).
+        ``replaces`` is a customer id just ``forget``-ten, which must not come back."""
+        customer_id = self.cache.get(email_lower)
+        if customer_id:
+            return customer_id, False
+        exists, customer_id = self._linked(email_lower)
+        if customer_id:
+            self.cache.set(email_lower, customer_id)
+            return customer_id, False
+        # The key covers exactly what is sent (the email), so edited details cannot fork a second customer
+        fingerprint = json.dumps([email_lower, replaces]).encode("utf-8")
+        key = hashlib.blake2b(fingerprint, digest_size=16).hexdigest()
+        customer_id = stripe.Customer.create(email=email_lower, idempotency_key=f"signup-customer-{key}").id
+        self.cache.set(email_lower, customer_id)
+        params = {k: v for k, v in details.items() if v is not None}
+        if params:
+            stripe.Customer.modify(customer_id, **params)
+        if exists:
+            self._link(email_lower, customer_id)
+        return customer_id, True
+
+    def forget(self, email_lower: str, customer_id: str) -> None:
+        """Drop a customer id Stripe no longer knows (deleted in the dashboard, or from test mode)."""
+        self.cache.pop(email_lower)
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"UPDATE members SET stripe_customer_id = NULL WHERE email_lower = {ph} AND stripe_customer_id = {ph}",
+                (email_lower, customer_id),
+            )
+            con.commit()
+        finally:
+            con.close()
+
+
+__all__ = ["StripeCustomers"]
@@ -0,0 +1,108 @@
+"""Small thread-safe LRU cache with per-entry TTL and hit/miss counters."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire ``ttl_seconds`` after they were stored.
+
+    ``max_bytes`` optionally caps the summed ``sizeof(value)`` of all entries, which suits caches of
+    rendered blobs. Eviction is least-recently-used first.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 300.0,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: len(value))
+        self._data: "OrderedDict[Hashable, tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value, size = entry
+            if expires_at <= now:
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (expires_at, value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[2]
+            return entry[1]
+
+    def pop_matching(self, predicate: Callable[[Any], bool]) -> int:
+        """Drop every entry whose value satisfies ``predicate``; returns how many were dropped."""
+        with self._lock:
+            doomed = [key for key, (_, value, _) in self._data.items() if predicate(value)]
+            for key in doomed:
+                self._bytes -= self._data.pop(key)[2]
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+__all__ = ["TTLCache"]
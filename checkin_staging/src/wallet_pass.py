@@ -3,13 +3,14 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import io
 import json
 import os
+import threading
 import uuid
 import zipfile
 from dataclasses import dataclass
-from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
@@ -39,9 +40,33 @@ class WalletPassResult:
     filename: str
     data: bytes
     content_type: str = "application/vnd.apple.pkpass"
+    # wallet_pass_digest() of the inputs; stable for as long as the pass content is
+    digest: str = ""
 
 
+@dataclass(frozen=True)
+class _PassSigner:
+    key: object
+    cert: x509.Certificate
+    chain: tuple
+    env_digest: bytes
+
+    def sign(self, manifest_bytes: bytes) -> bytes:
+        builder = PKCS7SignatureBuilder().set_data(manifest_bytes)
+        builder = builder.add_signer(self.cert, self.key, hashes.SHA256())
+        for extra_cert in self.chain:
+            builder = builder.add_certificate(extra_cert)
+        return builder.sign(Encoding.DER, [PKCS7Options.DetachedSignature])
+
+
+_PASS_IMAGES = ("icon.png", "icon@2x.png", "logo.png", "logo@2x.png")
+# Fixed zip entry timestamps, so a pass is a function of its contents (and the signature's signing time)
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 _ASSETS = None
+_ASSET_DIGESTS = None
+# Parsed signing material for the current certificate env vars; rebuilt when any of them changes
+_SIGNER: Optional[_PassSigner] = None
+_SIGNER_LOCK = threading.Lock()
 
 
 def wallet_pass_configured() -> bool:
@@ -49,6 +74,27 @@ def wallet_pass_configured() -> bool:
     return all(os.environ.get(name) for name in required)
 
 
+def _signing_env_digest() -> bytes:
+    h = hashlib.sha256()
+    for name in (PASS_CERT_ENV, PASS_WWDR_ENV, PASS_KEY_PASSPHRASE_ENV):
+        h.update((os.environ.get(name) or "").encode() + b"\0")
+    return h.digest()
+
+
+def _signer() -> _PassSigner:
+    """Signer for the current env, parsing the PKCS#12 bundle only when the env vars changed."""
+    global _SIGNER
+    env_digest = _signing_env_digest()
+    signer = _SIGNER
+    if signer is not None and signer.env_digest == env_digest:
+        return signer
+    with _SIGNER_LOCK:
+        if _SIGNER is None or _SIGNER.env_digest != env_digest:
+            key, cert, chain = _load_certificates()
+            _SIGNER = _PassSigner(key=key, cert=cert, chain=tuple(chain), env_digest=env_digest)
+        return _SIGNER
+
+
 def _load_certificates() -> tuple:
     cert_b64 = os.environ.get(PASS_CERT_ENV)
     wwdr_b64 = os.environ.get(PASS_WWDR_ENV)
@@ -70,39 +116,53 @@ def _load_certificates() -> tuple:
     return key, cert, chain
 
 
+def _sha1_hex(data: bytes) -> str:
+    digest = hashes.Hash(hashes.SHA1())
+    digest.update(data)
+    return digest.finalize().hex()
+
+
 def _asset_bytes(asset_name: str) -> bytes:
-    global _ASSETS
+    global _ASSETS, _ASSET_DIGESTS
     if _ASSETS is None:
         asset_dir = Path(__file__).resolve().parent / "static" / "wallet"
-        _ASSETS = {p.name: p.read_bytes() for p in asset_dir.glob("*.png")}
+        assets = {p.name: p.read_bytes() for p in asset_dir.glob("*.png")}
+        _ASSET_DIGESTS = {name: _sha1_hex(data) for name, data in assets.items()}
+        _ASSETS = assets
     if asset_name not in _ASSETS:
         raise FileNotFoundError(f"Wallet pass asset missing: {asset_name}")
     return _ASSETS[asset_name]
 
 
-def _member_serial(member: dict, token: str) -> str:
-    member_id = member.get("id") or member.get("member_id") or uuid.uuid4().hex
+def _asset_digest(asset_name: str) -> str:
+    _asset_bytes(asset_name)
+    return _ASSET_DIGESTS[asset_name]
+
+
+def _member_field(member, field: str, default: str = ""):
+    # dict from psycopg, sqlite3.Row from SQLite
+    if isinstance(member, dict):
+        return member.get(field, default)
+    try:
+        return member[field]
+    except Exception:
+        return default
+
+
+def _member_serial(member, token: str) -> str:
+    member_id = _member_field(member, "id") or _member_field(member, "member_id") or uuid.uuid4().hex
     prefix = str(member_id)
     suffix = token[:8] if token else uuid.uuid4().hex[:8]
     return f"{prefix}-{suffix}"
 
 
-def build_member_wallet_pass(member, token: str, base_url: str) -> WalletPassResult:
-    if not wallet_pass_configured():
-        raise RuntimeError("Wallet pass feature is not configured")
-    key, cert, chain = _load_certificates()
-
+def _pass_contents(member, token: str, base_url: str) -> tuple[str, bytes]:
     org_name = os.environ.get(ORG_NAME_ENV, "GymSense")
     team_id = os.environ[PASS_TEAM_ID_ENV]
     pass_type_id = os.environ[PASS_TYPE_ID_ENV]
 
     def _get(field: str, default: str = ""):
-        if isinstance(member, dict):
-            return member.get(field, default)
-        try:
-            return member[field]
-        except Exception:
-            return default
+        return _member_field(member, field, default)
 
     member_name = (_get("name") or "Member").strip()
     member_tier = (_get("membership_tier") or _get("membership_tier_normalized") or "Member").strip().title()
@@ -149,44 +209,56 @@ def build_member_wallet_pass(member, token: str, base_url: str) -> WalletPassRes
         }
     }
 
-    now_iso = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-    pass_json["relevantDate"] = now_iso
+    return serial, json.dumps(pass_json, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def wallet_pass_digest(member, token: str, base_url: str) -> str:
+    """Content address of the pass build_member_wallet_pass would produce, without signing anything."""
+    return _contents_digest(_pass_contents(member, token, base_url)[1])
+
+
+def _contents_digest(pass_bytes: bytes) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(_signing_env_digest())
+    for name in _PASS_IMAGES:
+        h.update(_asset_digest(name).encode("ascii"))
+    h.update(pass_bytes)
+    return h.hexdigest()
 
-    files = {
-        "pass.json": json.dumps(pass_json, separators=(",", ":"), ensure_ascii=False).encode("utf-8"),
-        "icon.png": _asset_bytes("icon.png"),
-        "icon@2x.png": _asset_bytes("icon@2x.png"),
-        "logo.png": _asset_bytes("logo.png"),
-        "logo@2x.png": _asset_bytes("logo@2x.png"),
-    }
 
-    manifest = {}
-    for name, data in files.items():
-        digest = hashes.Hash(hashes.SHA1())
-        digest.update(data)
-        manifest[name] = digest.finalize().hex()
+def wallet_pass_filename(member, token: str) -> str:
+    return f"atlas-gym-checkin-{_member_serial(member, token)}.pkpass"
+
+
+def build_member_wallet_pass(member, token: str, base_url: str) -> WalletPassResult:
+    if not wallet_pass_configured():
+        raise RuntimeError("Wallet pass feature is not configured")
+    signer = _signer()
+    _, pass_bytes = _pass_contents(member, token, base_url)
+
+    files = {"pass.json": pass_bytes}
+    manifest = {"pass.json": _sha1_hex(pass_bytes)}
+    # Static images are hashed once per process
+    for name in _PASS_IMAGES:
+        files[name] = _asset_bytes(name)
+        manifest[name] = _asset_digest(name)
 
     manifest_bytes = json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf-8")
     files["manifest.json"] = manifest_bytes
-
-    builder = PKCS7SignatureBuilder().set_data(manifest_bytes)
-    builder = builder.add_signer(cert, key, hashes.SHA256())
-    for extra_cert in chain:
-        builder = builder.add_certificate(extra_cert)
-    signature = builder.sign(Encoding.DER, [PKCS7Options.DetachedSignature])
+    files["signature"] = signer.sign(manifest_bytes)
 
     buffer = io.BytesIO()
     with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
         for name, data in files.items():
-            zf.writestr(name, data)
-        zf.writestr("signature", signature)
+            zf.writestr(zipfile.ZipInfo(name, date_time=_ZIP_DATE_TIME), data, compress_type=zipfile.ZIP_DEFLATED)
 
-    filename = f"atlas-gym-checkin-{serial}.pkpass"
-    return WalletPassResult(filename=filename, data=buffer.getvalue())
+    return WalletPassResult(filename=wallet_pass_filename(member, token), data=buffer.getvalue(), digest=_contents_digest(pass_bytes))
 
 
 __all__ = [
     "WalletPassResult",
     "wallet_pass_configured",
     "build_member_wallet_pass",
+    "wallet_pass_digest",
+    "wallet_pass_filename",
 ]
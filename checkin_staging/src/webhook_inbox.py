@@ -0,0 +1,245 @@
+"""Durable inbox for incoming webhooks, processed by a background worker.
+
+The HTTP handler only verifies the signature and ``record``s the raw event in ``webhook_events``,
+keyed by the provider's event id, then answers 200: a redelivered event is acknowledged without
+being stored twice, and the response never waits on the provider's API, member upserts or SMTP.
+
+A worker thread per process claims due events in batches (``FOR UPDATE SKIP LOCKED`` on Postgres,
+so every gunicorn worker can run one) and calls the handler registered for the event type with the
+parsed event and the base URL it was received on. Handlers that raise are retried with exponential
+backoff; after ``max_attempts`` the event is parked as ``dead`` with its last error, where
+``dead_letters`` lists it and ``retry`` puts it back. Types without a handler are marked ``ignored``.
+Like the mail queue a claim leases the row, so processing is at-least-once and handlers must
+tolerate a repeat.
+
+``available_at`` is epoch seconds so both backends compare it the same way.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+
+class WebhookInbox:
+    def __init__(
+        self,
+        connect: Callable,
+        postgres: bool,
+        handlers: dict,
+        max_attempts: int = 8,
+        batch_size: int = 10,
+        poll_seconds: float = 5.0,
+        lease_seconds: float = 300.0,
+        backoff_seconds: float = 30.0,
+        backoff_max_seconds: float = 3600.0,
+    ):
+        self.connect = connect
+        self.postgres = postgres
+        self.handlers = handlers
+        self.max_attempts = max(1, max_attempts)
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._ph = "%s" if postgres else "?"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.retried = 0
+        self.dead = 0
+
+    def record(self, provider: str, event_id: str, event_type: str, payload: bytes, base_url: str) -> bool:
+        """Store a verified event; False when this event id was already received."""
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO webhook_events (provider, event_id, event_type, payload, base_url, available_at)
+                VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph})
+                ON CONFLICT (provider, event_id) DO NOTHING
+                """,
+                (provider, event_id, event_type, payload.decode("utf-8"), base_url, time.time()),
+            )
+            inserted = cur.rowcount == 1
+            con.commit()
+        finally:
+            con.close()
+        if inserted:
+            self._wake.set()
+        return inserted
+
+    def _claim(self, con) -> list:
+        ph = self._ph
+        now = time.time()
+        skip_locked = "FOR UPDATE SKIP LOCKED" if self.postgres else ""
+        cur = con.cursor()
+        cur.execute(
+            f"""
+            UPDATE webhook_events SET attempts = attempts + 1, available_at = {ph}
+            WHERE id IN (
+                SELECT id FROM webhook_events
+                WHERE status = 'pending' AND available_at <= {ph}
+                ORDER BY available_at, id
+                LIMIT {int(self.batch_size)}
+                {skip_locked}
+            )
+            RETURNING id, event_id, event_type, payload, base_url, attempts
+            """,
+            (now + self.lease_seconds, now),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+        con.commit()
+        # RETURNING order is unspecified; handle events in the order they arrived
+        return sorted(rows, key=lambda r: r["id"])
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def process_due(self) -> int:
+        """Handle one batch of due events; returns how many rows were claimed."""
+        ph = self._ph
+        con = self.connect()
+        try:
+            rows = self._claim(con)
+            cur = con.cursor()
+            for row in rows:
+                handler = self.handlers.get(row["event_type"])
+                try:
+                    if handler is not None:
+                        handler(json.loads(row["payload"]), row["base_url"])
+                except Exception as exc:
+                    error = f"{type(exc).__name__}: {exc}"[:500]
+                    if row["attempts"] >= self.max_attempts:
+                        print(f"Webhook event {row['event_id']} ({row['event_type']}) moved to dead letters:", error)
+                        cur.execute(f"UPDATE webhook_events SET status = 'dead', last_error = {ph} WHERE id = {ph}", (error, row["id"]))
+                        self._count("dead")
+                    else:
+                        print(f"Webhook event {row['event_id']} ({row['event_type']}) failed, will retry:", error)
+                        cur.execute(
+                            f"UPDATE webhook_events SET available_at = {ph}, last_error = {ph} WHERE id = {ph}",
+                            (time.time() + self._backoff(row["attempts"]), error, row["id"]),
+                        )
+                        self._count("retried")
+                else:
+                    status = "processed" if handler is not None else "ignored"
+                    cur.execute(
+                        f"UPDATE webhook_events SET status = {ph}, processed_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = {ph}",
+                        (status, row["id"]),
+                    )
+                    self._count("processed")
+                # Per event, so a crash later in the batch does not replay handled events
+                con.commit()
+            return len(rows)
+        finally:
+            con.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                claimed = self.process_due()
+            except Exception as exc:
+                print("Webhook inbox worker error:", exc)
+            if claimed >= self.batch_size:
+                continue
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid()
+
+    def start(self) -> None:
+        """Start this process's worker thread (again after a fork)."""
+        with self._lock:
+            if self.running():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="webhook-inbox", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def dead_letters(self, limit: int = 50) -> list:
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""
+                SELECT id, provider, event_id, event_type, attempts, last_error, received_at
+                FROM webhook_events WHERE status = 'dead' ORDER BY id DESC LIMIT {int(limit)}
+                """
+            )
+            return [
+                {**dict(r), "received_at": str(r["received_at"]) if r["received_at"] is not None else None}
+                for r in cur.fetchall()
+            ]
+        finally:
+            con.close()
+
+    def retry(self, ids: Iterable[int]) -> int:
+        """Put dead events back in the queue with a fresh attempt budget."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return 0
+        ph = self._ph
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""
+                UPDATE webhook_events SET status = 'pending', attempts = 0, available_at = {ph}
+                WHERE status = 'dead' AND id IN ({", ".join([ph] * len(ids))})
+                """,
+                (time.time(), *ids),
+            )
+            count = cur.rowcount
+            con.commit()
+        finally:
+            con.close()
+        self._wake.set()
+        return count
+
+    def stats(self) -> dict:
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT status, COUNT(*) AS c FROM webhook_events GROUP BY status")
+            by_status = {r["status"]: int(r["c"]) for r in cur.fetchall()}
+        finally:
+            con.close()
+        return {
+            "pending": by_status.get("pending", 0),
+            "processed": by_status.get("processed", 0),
+            "ignored": by_status.get("ignored", 0),
+            "dead": by_status.get("dead", 0),
+            "worker": {
+                "running": self.running(),
+                "processed": self.processed,
+                "retried": self.retried,
+                "dead": self.dead,
+            },
+        }
+
+
+__all__ = ["WebhookInbox"]
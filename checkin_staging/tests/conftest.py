@@ -0,0 +1,27 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """checkin_app configured once per run against a fresh SQLite database."""
+    tmp = tmp_path_factory.mktemp("checkin")
+    saved = dict(os.environ)
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.update({
+        "CHECKIN_ALLOW_SQLITE": "1",
+        "CHECKIN_DB_PATH": str(tmp / "checkin.sqlite3"),
+        "CHECKIN_ASSET_DIR": str(tmp / "assets"),
+        "CHECKIN_MAIL_QUEUE": "0",
+        "CHECKIN_CACHE_URL": "memory://",
+    })
+    module = importlib.import_module("checkin_app")
+    module.init_db()
+    yield module
+    os.environ.clear()
+    os.environ.update(saved)
@@ -0,0 +1,78 @@
+import gzip
+import json
+import os
+
+import assets
+
+SCRIPT = b"// kiosk\n" + b"console.log('scan');\n" * 200
+
+
+def _static(tmp_path, script=SCRIPT):
+    static = tmp_path / "static"
+    (static / "img").mkdir(parents=True, exist_ok=True)
+    (static / "img" / "logo.svg").write_bytes(b"<svg xmlns='http://www.w3.org/2000/svg'/>")
+    (static / "app.css").write_bytes(b"body { background: url('/static/img/logo.svg'); }\n")
+    (static / "app.js").write_bytes(script)
+    return str(static)
+
+
+def test_build_fingerprints_rewrites_and_precompresses(tmp_path):
+    out = str(tmp_path / "out")
+    manifest = assets.build_assets(_static(tmp_path), out)
+
+    assert manifest["app.js"].startswith("app.") and manifest["app.js"].endswith(".js")
+    assert {"icons/icon-192.png", "icons/icon-512.png", "img/logo.svg"} <= set(manifest)
+    with open(os.path.join(out, manifest["app.css"]), "rb") as fh:
+        assert f"url('/assets/{manifest['img/logo.svg']}')".encode() in fh.read()
+    with open(os.path.join(out, manifest["app.js"] + ".gz"), "rb") as fh:
+        assert gzip.decompress(fh.read()) == SCRIPT
+    # Too small to be worth compressing
+    assert not os.path.exists(os.path.join(out, manifest["img/logo.svg"] + ".gz"))
+    with open(os.path.join(out, assets.MANIFEST_NAME)) as fh:
+        assert json.load(fh)["files"] == manifest
+
+
+def test_unchanged_sources_are_not_rebuilt_and_stale_builds_are_pruned(tmp_path):
+    static, out = _static(tmp_path), str(tmp_path / "out")
+    first = assets.ensure_assets(static, out)
+    manifest_path = os.path.join(out, assets.MANIFEST_NAME)
+    os.utime(manifest_path, (0, 0))
+    assert assets.ensure_assets(static, out) == first
+    assert os.stat(manifest_path).st_mtime == 0
+
+    _static(tmp_path, script=SCRIPT + b"console.log('v2');\n")
+    second = assets.ensure_assets(static, out)
+    assert second["app.js"] != first["app.js"]
+    assert second["img/logo.svg"] == first["img/logo.svg"]
+    assert not os.path.exists(os.path.join(out, first["app.js"]))
+    assert not os.path.exists(os.path.join(out, first["app.js"] + ".gz"))
+    assert os.path.exists(os.path.join(out, second["app.js"] + ".gz"))
+
+
+def test_negotiate_picks_an_accepted_variant(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    for name in ("a.js", "a.js.gz", "a.js.br"):
+        (out / name).write_bytes(b"x")
+    (out / "b.js").write_bytes(b"x")
+
+    assert assets.negotiate(str(out), "a.js", "gzip, deflate, br") == (str(out / "a.js.br"), "br")
+    assert assets.negotiate(str(out), "a.js", "gzip, br;q=0") == (str(out / "a.js.gz"), "gzip")
+    assert assets.negotiate(str(out), "a.js", "GZIP;q=0.000, identity") == (str(out / "a.js"), None)
+    assert assets.negotiate(str(out), "b.js", "br, gzip") == (str(out / "b.js"), None)
+    assert assets.negotiate(str(out), "a.js", "") == (str(out / "a.js"), None)
+
+
+def test_built_assets_are_served_immutable_and_encoded(app_module):
+    with open(os.path.join(app_module.ASSET_DIR, assets.MANIFEST_NAME)) as fh:
+        built = json.load(fh)["files"]["checkin/kiosk.js"]
+    client = app_module.app.test_client()
+
+    r = client.get(f"/assets/{built}", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.headers["Vary"] == "Accept-Encoding"
+    assert "immutable" in r.headers["Cache-Control"]
+    assert r.mimetype == "text/javascript"
+    r.close()
+    assert client.get("/assets/checkin/kiosk.js").status_code == 404
@@ -0,0 +1,83 @@
+import sqlite3
+import time
+
+import pytest
+
+from campaigns import CampaignError, CampaignRunner
+
+
+def _members(app_module, tier, count, with_tokens=True):
+    con = sqlite3.connect(app_module.DB_PATH)
+    for i in range(count):
+        token = f"{tier}-{i}" if with_tokens and i % 2 == 0 else None
+        con.execute(
+            "INSERT INTO members(name, email_lower, status, membership_tier, qr_token) VALUES (?, ?, 'active', ?, ?)",
+            (f"{tier.title()} {i}", f"{tier}{i}@example.com", tier, token),
+        )
+    con.commit()
+    con.close()
+
+
+def _runner(app_module, **kwargs):
+    return CampaignRunner(
+        connect=app_module.connect_db,
+        postgres=False,
+        mail_queue=app_module.MAIL_QUEUE,
+        render_png=lambda token: b"png:" + token.encode(),
+        compose=lambda name, email, token, png, base_url: (email, "Your QR", png),
+        processes=1,
+        **kwargs,
+    )
+
+
+def _queued(app_module, campaign_id):
+    con = sqlite3.connect(app_module.DB_PATH)
+    rows = con.execute("SELECT to_email, message FROM outbound_emails WHERE campaign_id = ? ORDER BY id", (campaign_id,)).fetchall()
+    con.close()
+    return rows
+
+
+def test_campaign_resumes_from_its_cursor_after_a_restart(app_module):
+    _members(app_module, "resume", 5)
+    first = _runner(app_module, batch_size=2)
+    campaign_id = first.create("tier", "https://gym.example.com", tier="resume")
+
+    assert first._claim(campaign_id)
+    assert first._run_batch(campaign_id, None)
+    progress = first.progress(campaign_id)
+    assert (progress["status"], progress["total"], progress["enqueued"]) == ("running", 5, 2)
+
+    # The process went away mid-campaign; another one takes it over once the heartbeat is stale
+    second = _runner(app_module, batch_size=2, stale_after_seconds=0)
+    assert second.resume_stale() == [campaign_id]
+    deadline = time.monotonic() + 10
+    while second.progress(campaign_id)["status"] == "running" and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    progress = second.progress(campaign_id)
+    assert (progress["status"], progress["enqueued"], progress["pending"]) == ("done", 5, 5)
+    queued = _queued(app_module, campaign_id)
+    assert [email for email, _ in queued] == [f"resume{i}@example.com" for i in range(5)]
+    # Members without a token got one stored, and their email carries that token
+    con = sqlite3.connect(app_module.DB_PATH)
+    stored = dict(con.execute("SELECT email_lower, qr_token FROM members WHERE membership_tier = 'resume'").fetchall())
+    con.close()
+    assert all(stored.values())
+    assert all(bytes(message) == b"png:" + stored[email].encode() for email, message in queued)
+
+
+def test_paused_campaign_queues_nothing_more(app_module):
+    _members(app_module, "paused", 3)
+    runner = _runner(app_module, batch_size=2)
+    campaign_id = runner.create("tier", "https://gym.example.com", tier="paused")
+
+    assert runner._claim(campaign_id)
+    assert runner.pause(campaign_id)
+    assert not runner._run_batch(campaign_id, None)
+    assert _queued(app_module, campaign_id) == []
+    assert runner.progress(campaign_id)["status"] == "paused"
+
+
+def test_tier_segment_needs_a_tier(app_module):
+    with pytest.raises(CampaignError):
+        _runner(app_module).create("tier", "https://gym.example.com")
@@ -0,0 +1,57 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+
+def _member(app_module, token):
+    con = sqlite3.connect(app_module.DB_PATH)
+    cur = con.execute("INSERT INTO members(name, email_lower, status, qr_token) VALUES (?, ?, 'active', ?)", (token.title(), f"{token}@example.com", token))
+    con.commit()
+    member_id = cur.lastrowid
+    con.close()
+    return member_id
+
+
+def _check_ins(app_module, member_id):
+    con = sqlite3.connect(app_module.DB_PATH)
+    count = con.execute("SELECT COUNT(*) FROM check_ins WHERE member_id = ?", (member_id,)).fetchone()[0]
+    con.close()
+    return count
+
+
+def _scan(key, token, at):
+    return {"idempotency_key": key, "qr_token": token, "scanned_at": at.isoformat() + "Z"}
+
+
+def test_batch_duplicates_come_from_recent_checkins(app_module):
+    member_id = _member(app_module, "batchdup")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    recent = app_module.RECENT_CHECKINS
+
+    first = app_module.record_checkin_batch([_scan("a1", "batchdup", now - timedelta(minutes=1))], "kiosk-1")
+    assert first[0]["status"] == "ok"
+    assert recent.get(member_id) is not None
+
+    hits = recent.hits
+    again = app_module.record_checkin_batch(
+        [_scan("a2", "batchdup", now), _scan("a3", "batchdup", now - timedelta(seconds=30))], "kiosk-2"
+    )
+    assert [r["status"] for r in again] == ["duplicate", "duplicate"]
+    assert recent.hits == hits + 1
+    assert _check_ins(app_module, member_id) == 1
+
+
+def test_batch_scans_outside_the_window_still_check_in(app_module):
+    member_id = _member(app_module, "batchlate")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    window = timedelta(minutes=app_module.DUP_WINDOW_MINUTES)
+
+    results = app_module.record_checkin_batch(
+        [
+            _scan("b1", "batchlate", now - 3 * window),
+            _scan("b2", "batchlate", now - 3 * window + timedelta(seconds=10)),
+            _scan("b3", "batchlate", now),
+        ],
+        "kiosk-1",
+    )
+    assert [r["status"] for r in results] == ["ok", "duplicate", "ok"]
+    assert _check_ins(app_module, member_id) == 2
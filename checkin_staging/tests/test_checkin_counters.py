@@ -0,0 +1,71 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import checkin_counters
+from checkin_counters import CheckinCounters
+
+
+def test_counters_count_each_check_in_once():
+    # Midday, so every timestamp below falls on the same UTC day
+    now = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    counters = CheckinCounters(history_days=3)
+    counters.load([(1, 10, now - timedelta(days=1)), (2, 10, now - timedelta(minutes=90))])
+
+    assert counters.observe(3, 10, now - timedelta(minutes=5))
+    assert counters.observe(4, 11, now)
+    assert not counters.observe(4, 11, now)
+    snapshot = counters.snapshot(now)
+    assert (snapshot["today_total"], snapshot["today_unique"], snapshot["last_hour_total"]) == (3, 2, 2)
+    assert [(d["date"], d["count"]) for d in snapshot["trend"]] == [
+        ((now.date() - timedelta(days=2)).isoformat(), 0),
+        ((now.date() - timedelta(days=1)).isoformat(), 1),
+        (now.date().isoformat(), 3),
+    ]
+    assert counters.high_id == 4
+
+
+def test_check_ins_older_than_the_history_are_ignored():
+    now = datetime.utcnow()
+    counters = CheckinCounters(history_days=2)
+    counters.load([])
+    assert counters.observe(1, 10, now - timedelta(days=5))
+    assert sum(d["count"] for d in counters.snapshot(now)["trend"]) == 0
+
+
+def test_skipped_ids_are_requested_until_they_expire(monkeypatch):
+    counters = CheckinCounters()
+    counters.load([])
+    now = datetime.utcnow()
+    counters.observe(5, 10, now)
+    # 1-4 may belong to transactions that have not committed yet
+    assert counters.pending_gaps() == [1, 2, 3, 4]
+    counters.observe(3, 11, now)
+    assert counters.pending_gaps() == [1, 2, 4]
+
+    monkeypatch.setattr(checkin_counters, "GAP_TTL_SECONDS", -1.0)
+    assert counters.pending_gaps() == []
+
+
+def test_sync_folds_in_check_ins_from_other_workers(app_module):
+    app_module.sync_checkin_counters(force=True)
+    before = app_module.CHECKIN_COUNTERS.snapshot()["today_total"]
+
+    # Written by another process, so this worker only learns of it through the catch-up query
+    con = sqlite3.connect(app_module.DB_PATH)
+    member_id = con.execute(
+        "INSERT INTO members(name, email_lower, status, qr_token) VALUES ('Elsewhere', 'elsewhere@example.com', 'active', 'elsewhere')"
+    ).lastrowid
+    check_in_id = con.execute(
+        "INSERT INTO check_ins(member_id, timestamp, method) VALUES (?, ?, 'QR')",
+        (member_id, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")),
+    ).lastrowid
+    con.commit()
+    con.close()
+
+    app_module.sync_checkin_counters(force=True)
+    assert app_module.CHECKIN_COUNTERS.snapshot()["today_total"] == before + 1
+    assert app_module.CHECKIN_COUNTERS.high_id >= check_in_id
+    assert app_module.RECENT_CHECKINS.get(member_id)["name"] == "Elsewhere"
+    # Already counted: another sync changes nothing
+    app_module.sync_checkin_counters(force=True)
+    assert app_module.CHECKIN_COUNTERS.snapshot()["today_total"] == before + 1
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from shared_cache import MemoryBackend, ResponseCache
+
+
+def test_status_answers_304_until_the_payload_changes(app_module):
+    client = app_module.app.test_client()
+    first = client.get("/api/kiosk/status")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+    etag = first.headers["ETag"].strip('"')
+
+    again = client.get("/api/kiosk/status", headers={"If-None-Match": f'"{etag}"'})
+    assert again.status_code == 304
+    assert again.data == b""
+
+    app_module.KIOSK_STATUS_CACHE.invalidate("location:1")
+    stale = client.get("/api/kiosk/status", headers={"If-None-Match": '"not-the-etag"'})
+    assert stale.status_code == 200
+    assert stale.get_json() is not None
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache(MemoryBackend(), "status", ttl_seconds=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return b'{"ok":true}'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert set(results) == {(b'{"ok":true}', ResponseCache.etag_for(b'{"ok":true}'))}
+
+    cache.invalidate("k")
+    cache.get_or_compute("k", compute)
+    assert len(calls) == 2
@@ -0,0 +1,111 @@
+import smtplib
+import sqlite3
+
+from mail_queue import MailQueue, SmtpSettings
+
+SETTINGS = SmtpSettings(host="smtp.example.com", port=587, user=None, password=None, from_raw="gym@example.com", from_name=None)
+
+
+class FakeSession:
+    """SmtpSession stand-in: answers from a list of outcomes and records how many connections were open."""
+
+    def __init__(self, outcomes, open_connections):
+        self.outcomes = list(outcomes)
+        self.open_connections = open_connections
+        self.sent = []
+        self.open_while_sending = []
+
+    def send(self, settings, to_email, message):
+        self.open_while_sending.append(len(self.open_connections))
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if outcome is not None:
+            raise outcome
+        self.sent.append(to_email)
+
+
+def _queue(tmp_path, **kwargs):
+    path = str(tmp_path / "mail.sqlite3")
+    con = sqlite3.connect(path)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbound_emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, to_email TEXT NOT NULL, subject TEXT, message BLOB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,
+            last_error TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, sent_at TIMESTAMP, campaign_id INTEGER
+        )
+        """
+    )
+    con.commit()
+    con.close()
+    open_connections = set()
+
+    class Tracked(sqlite3.Connection):
+        def close(self):
+            open_connections.discard(id(self))
+            super().close()
+
+    def connect():
+        c = sqlite3.connect(path, factory=Tracked)
+        c.row_factory = sqlite3.Row
+        open_connections.add(id(c))
+        return c
+
+    return MailQueue(connect, postgres=False, **kwargs), open_connections
+
+
+def _rows(queue):
+    con = queue.connect()
+    try:
+        return {r["to_email"]: dict(r) for r in con.execute("SELECT * FROM outbound_emails")}
+    finally:
+        con.close()
+
+
+def test_deliver_due_sends_claimed_rows_without_holding_a_connection(tmp_path):
+    queue, open_connections = _queue(tmp_path)
+    for i in range(3):
+        queue.enqueue(f"m{i}@example.com", "Hi", b"Subject: Hi\r\n\r\nbody")
+    session = FakeSession([], open_connections)
+
+    assert queue.deliver_due(SETTINGS, session) == 3
+    assert session.sent == ["m0@example.com", "m1@example.com", "m2@example.com"]
+    assert session.open_while_sending == [0, 0, 0]
+    assert not open_connections
+    rows = _rows(queue)
+    assert {r["status"] for r in rows.values()} == {"sent"}
+    assert queue.deliver_due(SETTINGS, session) == 0
+
+
+def test_transient_failures_are_retried_and_permanent_ones_fail(tmp_path):
+    queue, open_connections = _queue(tmp_path, max_attempts=2, backoff_seconds=60)
+    queue.enqueue("flaky@example.com", "Hi", b"x")
+    queue.enqueue("bounce@example.com", "Hi", b"x")
+    session = FakeSession(
+        [
+            smtplib.SMTPServerDisconnected("relay went away"),
+            smtplib.SMTPRecipientsRefused({"bounce@example.com": (550, b"no such user")}),
+        ],
+        open_connections,
+    )
+
+    assert queue.deliver_due(SETTINGS, session) == 2
+    rows = _rows(queue)
+    assert rows["flaky@example.com"]["status"] == "pending"
+    assert rows["flaky@example.com"]["attempts"] == 1
+    assert "SMTPServerDisconnected" in rows["flaky@example.com"]["last_error"]
+    assert rows["bounce@example.com"]["status"] == "failed"
+    # Backed off, so not due yet
+    assert queue.deliver_due(SETTINGS, session) == 0
+    assert (queue.sent, queue.retried, queue.failed) == (0, 1, 1)
+
+
+def test_last_attempt_fails_permanently(tmp_path):
+    queue, open_connections = _queue(tmp_path, max_attempts=2, backoff_seconds=0)
+    queue.enqueue("down@example.com", "Hi", b"x")
+    session = FakeSession([ConnectionError("refused"), ConnectionError("refused")], open_connections)
+
+    assert queue.deliver_due(SETTINGS, session) == 1
+    assert _rows(queue)["down@example.com"]["status"] == "pending"
+    assert queue.deliver_due(SETTINGS, session) == 1
+    row = _rows(queue)["down@example.com"]
+    assert (row["status"], row["attempts"]) == ("failed", 2)
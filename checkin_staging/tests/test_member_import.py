@@ -0,0 +1,132 @@
+import sqlite3
+
+import pytest
+
+from member_import import DeactivationLimitExceeded, MemberImport
+
+
+@pytest.fixture
+def con(tmp_path):
+    c = sqlite3.connect(str(tmp_path / "members.sqlite3"))
+    c.row_factory = sqlite3.Row
+    c.execute(
+        """
+        CREATE TABLE members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, external_id TEXT, name TEXT NOT NULL, email_lower TEXT,
+            phone_e164 TEXT, membership_tier TEXT, status TEXT NOT NULL DEFAULT 'active', qr_token TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    c.execute("CREATE UNIQUE INDEX idx_members_external ON members(external_id)")
+    yield c
+    c.close()
+
+
+def _row(name, external_id=None, email=None, phone=None, status="active", tier="essential"):
+    return {
+        "external_id": external_id,
+        "name": name,
+        "email_lower": email,
+        "phone_e164": phone,
+        "membership_tier": tier,
+        "status": status,
+    }
+
+
+def _seed(con, *rows):
+    for r in rows:
+        con.execute(
+            "INSERT INTO members (external_id, name, email_lower, phone_e164, membership_tier, status, qr_token) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (r["external_id"], r["name"], r["email_lower"], r["phone_e164"], r["membership_tier"], r["status"], f"tok-{r['name']}"),
+        )
+    con.commit()
+
+
+def _import(con, rows):
+    importer = MemberImport(con, postgres=False).begin()
+    importer.stage(rows)
+    return importer
+
+
+def _members(con):
+    return [dict(r) for r in con.execute("SELECT external_id, name, email_lower, phone_e164, status, qr_token FROM members ORDER BY id")]
+
+
+def test_plan_classifies_rows_and_lists_missing_members(con):
+    _seed(
+        con,
+        _row("Ada", "E1", "ada@example.com"),
+        _row("Bo", "E2", "bo@example.com"),
+        _row("Cy", None, "cy@example.com", status="inactive"),
+        _row("Di", "E4", "di@example.com"),
+    )
+    importer = _import(
+        con,
+        [
+            _row("Ada", "E1", "ada@example.com"),
+            _row("Bo Renamed", None, "bo@example.com"),
+            _row("Cy", None, "cy@example.com"),
+            _row("Eve", "E5", "eve@example.com"),
+        ],
+    )
+    plan = importer.plan()
+    assert plan["counts"] == {
+        "inserts": 1,
+        "updates": 1,
+        "reactivations": 1,
+        "unchanged": 1,
+        "deactivate_candidates": 1,
+        "total_rows": 4,
+    }
+    assert plan["samples"]["updates"] == [{"name": "Bo", "email": "bo@example.com"}]
+    assert plan["samples"]["deactivate_candidates"] == [{"name": "Di", "email": "di@example.com"}]
+    # Preview only: nothing was written
+    assert [m["name"] for m in _members(con)] == ["Ada", "Bo", "Cy", "Di"]
+
+
+def test_apply_writes_the_plan(con):
+    _seed(con, _row("Ada", "E1", "ada@example.com"), _row("Di", "E4", "di@example.com"))
+    importer = _import(con, [_row("Ada Lovelace", "E1", "ada@example.com"), _row("Eve", "E5", "eve@example.com", status="inactive")])
+
+    result = importer.apply(deactivate_missing=True)
+    assert (result["inserted"], result["updated"], result["deactivated"], result["tokens_issued"]) == (1, 1, 1, 1)
+    members = {m["name"]: m for m in _members(con)}
+    assert set(members) == {"Ada Lovelace", "Di", "Eve"}
+    assert members["Di"]["status"] == "inactive"
+    assert members["Eve"]["status"] == "inactive" and members["Eve"]["qr_token"]
+
+
+def test_new_rows_sharing_any_identifier_become_one_member(con):
+    importer = _import(
+        con,
+        [
+            _row("Ann", "N1", "ann@example.com"),
+            # Different first identifier, same email as the row above
+            _row("Ann B", "N2", "ann@example.com", "+15550001"),
+            # Linked to both only through the phone number
+            _row("Ann C", None, None, "+15550001"),
+            _row("Zed", None, "zed@example.com"),
+        ],
+    )
+    assert importer.plan()["counts"]["inserts"] == 2
+
+    importer.apply()
+    members = _members(con)
+    assert [(m["external_id"], m["name"], m["email_lower"], m["phone_e164"]) for m in members] == [
+        ("N1", "Ann C", None, "+15550001"),
+        (None, "Zed", "zed@example.com", None),
+    ]
+
+
+def test_deactivation_guard_refuses_before_writing(con):
+    _seed(con, *[_row(f"M{i}", f"E{i}", f"m{i}@example.com") for i in range(10)])
+    importer = _import(con, [_row("M0 Renamed", "E0", "m0@example.com"), _row("New", "E99", "new@example.com")])
+
+    with pytest.raises(DeactivationLimitExceeded) as raised:
+        importer.apply(deactivate_missing=True, max_deactivate_fraction=0.5)
+    assert (raised.value.candidates, raised.value.active) == (9, 10)
+    members = _members(con)
+    assert len(members) == 10
+    assert {m["status"] for m in members} == {"active"}
+    assert members[0]["name"] == "M0"
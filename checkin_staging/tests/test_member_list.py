@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def admin(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    return client
+
+
+def _members(app_module, names):
+    con = sqlite3.connect(app_module.DB_PATH)
+    for name in names:
+        con.execute("INSERT INTO members(name, email_lower, status) VALUES (?, ?, 'active')", (name, f"{name.replace(' ', '.').lower()}@example.com"))
+    con.commit()
+    con.close()
+
+
+def _page(admin, **params):
+    r = admin.get("/api/admin/members", query_string=params)
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_cursor_pages_match_offset_pages(admin, app_module):
+    # Ordered by last name, then full name; equal names fall back to the id
+    _members(app_module, ["Pagina Zed", "Ann Paginer", "Bo Paginer", "Bo Paginer", "Cy Paginal", "Di Pagina", "Ed Paginer"])
+    first = _page(admin, q="pagin", per_page=3)
+    assert first["total"] == 7 and not first["total_estimated"]
+
+    by_cursor, after = [], None
+    while True:
+        page = _page(admin, q="pagin", per_page=3, **({"after": after} if after else {}))
+        by_cursor += [item["id"] for item in page["items"]]
+        after = page["next_after"]
+        if after is None:
+            break
+    by_offset = [item["id"] for p in (1, 2, 3) for item in _page(admin, q="pagin", per_page=3, page=p)["items"]]
+    assert by_cursor == by_offset
+    assert len(by_cursor) == 7
+
+    names = [item["name"] for p in (1, 2, 3) for item in _page(admin, q="pagin", per_page=3, page=p)["items"]]
+    assert names == ["Di Pagina", "Cy Paginal", "Ann Paginer", "Bo Paginer", "Bo Paginer", "Ed Paginer", "Pagina Zed"]
+
+
+def test_cursor_keys_may_contain_commas(admin, app_module):
+    _members(app_module, ["Comma, Kay Commaton", "Comma, Lee Commaton"])
+    first = _page(admin, q="commaton", per_page=1)
+    assert "," in first["next_after"].rpartition(",")[0]
+    second = _page(admin, q="commaton", per_page=1, after=first["next_after"])
+    assert [item["name"] for item in second["items"]] == ["Comma, Lee Commaton"]
+    assert second["next_after"] is None
+
+
+def test_bad_cursor_is_rejected(admin):
+    r = admin.get("/api/admin/members", query_string={"after": "name,not-an-id"})
+    assert r.status_code == 400
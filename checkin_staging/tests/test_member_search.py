@@ -0,0 +1,52 @@
+import sqlite3
+
+
+def _members(app_module, *rows):
+    con = sqlite3.connect(app_module.DB_PATH)
+    ids = [
+        con.execute("INSERT INTO members(name, email_lower, status) VALUES (?, ?, ?)", (name, email, status)).lastrowid
+        for name, email, status in rows
+    ]
+    con.commit()
+    con.close()
+    return ids
+
+
+def test_search_ranks_name_prefix_then_word_start_then_substring(app_module):
+    assert app_module.SQLITE_MEMBER_FTS
+    _members(
+        app_module,
+        ("Zorbik Quell", "zorbik@example.com", "active"),
+        ("Aquellan Rho", "rho@example.com", "active"),
+        ("Quellen Amy", "quellen@example.com", "active"),
+        ("Amy Quell", "amyq@example.com", "active"),
+        ("Gone Quell", "gone@example.com", "inactive"),
+    )
+    names = [r["name"] for r in app_module.search_members("quell", limit=10)]
+    assert names == ["Quellen Amy", "Amy Quell", "Zorbik Quell", "Aquellan Rho"]
+    # Two characters are below the trigram length and go through LIKE, with the same ranking
+    assert [r["name"] for r in app_module.search_members("qu", limit=10) if "uell" in r["name"]] == names
+
+
+def test_search_covers_email_unless_name_only(app_module):
+    _members(app_module, ("Plain Name", "xylophonist@example.com", "active"))
+    assert [r["name"] for r in app_module.search_members("xylophon", limit=5)] == ["Plain Name"]
+    assert app_module.search_members("xylophon", limit=5, name_only=True) == []
+
+
+def test_search_follows_renames_and_escapes_wildcards(app_module):
+    (member_id,) = _members(app_module, ("Before Rename", "rename@example.com", "active"))
+    con = sqlite3.connect(app_module.DB_PATH)
+    con.execute("UPDATE members SET name = 'Vantablack 100%' WHERE id = ?", (member_id,))
+    con.commit()
+    con.close()
+    assert app_module.search_members("before ren", limit=5) == []
+    assert [r["id"] for r in app_module.search_members("vantablack", limit=5)] == [member_id]
+    assert [r["id"] for r in app_module.search_members("0%", limit=5, name_only=True)] == [member_id]
+
+
+def test_kiosk_suggest_returns_ids_and_names_only(app_module):
+    (member_id,) = _members(app_module, ("Suggestible Sam", "sam@example.com", "active"))
+    client = app_module.app.test_client()
+    assert client.get("/api/kiosk/suggest?q=s").get_json() == []
+    assert client.get("/api/kiosk/suggest?q=suggestib").get_json() == [{"id": member_id, "name": "Suggestible Sam"}]
@@ -0,0 +1,24 @@
+def test_qr_png_is_rendered_once_and_revalidated_without_rendering(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    first = client.get("/api/qr.png?token=pngtoken")
+    assert first.status_code == 200
+    assert first.mimetype == "image/png"
+    assert first.data.startswith(b"\x89PNG")
+    assert first.headers["Cache-Control"] == f"private, max-age={app_module.QR_PNG_MAX_AGE_SECONDS}"
+    etag = first.headers["ETag"].strip('"')
+    assert etag == app_module.qr_png_etag("pngtoken")
+
+    # Served from QR_PNG_CACHE: a second render would fail
+    monkeypatch.setattr(app_module, "generate_qr_png", lambda *args, **kwargs: b"")
+    assert client.get("/api/qr.png?token=pngtoken").data == first.data
+
+    # The ETag is known before rendering, so a revalidation never renders
+    app_module.QR_PNG_CACHE.clear()
+    revalidated = client.get("/api/qr.png?token=pngtoken", headers={"If-None-Match": f'"{etag}"'})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"].strip('"') == etag
+    assert client.get("/api/qr.png?token=pngtoken").status_code == 500
+
+
+def test_qr_png_needs_a_token(app_module):
+    assert app_module.app.test_client().get("/api/qr.png").status_code == 400
@@ -0,0 +1,47 @@
+import sqlite3
+
+
+def _member(app_module, token, status="active"):
+    con = sqlite3.connect(app_module.DB_PATH)
+    member_id = con.execute(
+        "INSERT INTO members(name, email_lower, status, qr_token) VALUES (?, ?, ?, ?)",
+        (token.title(), f"{token}@example.com", status, token),
+    ).lastrowid
+    con.commit()
+    con.close()
+    return member_id
+
+
+def _set_status(app_module, member_id, status):
+    con = sqlite3.connect(app_module.DB_PATH)
+    con.execute("UPDATE members SET status = ? WHERE id = ?", (status, member_id))
+    con.commit()
+    con.close()
+
+
+def test_token_lookups_are_served_from_the_cache(app_module):
+    member_id = _member(app_module, "cachedtoken")
+    cache = app_module.QR_TOKEN_CACHE
+
+    misses = cache.misses
+    assert app_module.lookup_member_by_qr_token("cachedtoken") == {"id": member_id, "name": "Cachedtoken", "status": "active"}
+    assert cache.misses == misses + 1
+    hits = cache.hits
+    assert app_module.lookup_member_by_qr_token("cachedtoken")["id"] == member_id
+    assert cache.hits == hits + 1
+    assert app_module.lookup_member_by_qr_token("no-such-token") is None
+
+
+def test_member_writes_drop_the_cached_entry(app_module):
+    member_id = _member(app_module, "staletoken")
+    assert app_module.lookup_member_by_qr_token("staletoken")["status"] == "active"
+
+    _set_status(app_module, member_id, "inactive")
+    # Until invalidated the cached member is served
+    assert app_module.lookup_member_by_qr_token("staletoken")["status"] == "active"
+    app_module.invalidate_member_caches(member_id, deactivated=True)
+    assert app_module.lookup_member_by_qr_token("staletoken")["status"] == "inactive"
+
+    _set_status(app_module, member_id, "active")
+    app_module.invalidate_member_caches()
+    assert app_module.lookup_member_by_qr_token("staletoken")["status"] == "active"
@@ -0,0 +1,81 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from recent_checkins import RecentCheckins
+from shared_cache import SQLiteBackend
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _workers(tmp_path):
+    backend_path = str(tmp_path / "cache.sqlite3")
+    # Two workers on one host, each with its own wheel and backend connection
+    return (
+        RecentCheckins(5, SQLiteBackend(backend_path), check_seconds=0),
+        RecentCheckins(5, SQLiteBackend(backend_path), check_seconds=0),
+    )
+
+
+def test_check_in_at_one_worker_is_seen_by_another(tmp_path):
+    first, second = _workers(tmp_path)
+    first.note(7, _now(), "Ada")
+    assert second.get(7)["name"] == "Ada"
+    assert second.get(8) is None
+    assert first.get(7) is not None
+
+
+def test_reset_reaches_every_worker(tmp_path):
+    first, second = _workers(tmp_path)
+    first.note(7, _now(), "Ada")
+    assert second.get(7) is not None
+
+    first.reset()
+    # Gone from the other worker's wheel and the shared entry is of an old generation
+    assert second.get(7) is None
+    assert first.get(7) is None
+
+    second.note(7, _now() + timedelta(seconds=1), "Ada")
+    assert first.get(7) is not None
+
+
+def test_forget_reaches_every_worker(tmp_path):
+    first, second = _workers(tmp_path)
+    first.note(7, _now(), "Ada")
+    first.note(9, _now(), "Bo")
+    assert second.get(7) is not None and second.get(9) is not None
+
+    first.forget(7)
+    assert second.get(7) is None
+    # Others are refilled from the shared cache
+    assert second.get(9)["name"] == "Bo"
+
+
+def test_member_edits_keep_recent_check_ins(app_module):
+    member_id = 424242
+    app_module.RECENT_CHECKINS.note(member_id, _now(), "Edited")
+
+    app_module.invalidate_member_caches(member_id)
+    app_module.invalidate_member_caches()
+    assert app_module.RECENT_CHECKINS.get(member_id) is not None
+
+    app_module.invalidate_member_caches(member_id, deactivated=True)
+    assert app_module.RECENT_CHECKINS.get(member_id) is None
+
+
+def test_hit_and_miss_counts_survive_concurrent_lookups():
+    recent = RecentCheckins(5)
+    recent.note(7, _now(), "Ada")
+
+    def look():
+        for _ in range(2000):
+            recent.get(7)
+            recent.get(8)
+
+    threads = [threading.Thread(target=look) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (recent.stats()["hits"], recent.stats()["misses"]) == (16000, 16000)
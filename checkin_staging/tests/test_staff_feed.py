@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def admin(app_module, monkeypatch):
+    # Streams end right after their opening events
+    monkeypatch.setattr(app_module, "SSE_MAX_SECONDS", 0)
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    return client
+
+
+def _check_in(app_module, token):
+    con = sqlite3.connect(app_module.DB_PATH)
+    con.execute("INSERT INTO members(name, email_lower, status, qr_token) VALUES (?, ?, 'active', ?)", (token.title(), f"{token}@example.com", token))
+    con.commit()
+    con.close()
+    assert not app_module.record_checkin(qr_token=token, method="QR")["duplicate"]
+
+
+def _stream(client, **headers):
+    with client.get("/api/staff/stream", headers=headers) as r:
+        return r.status_code, r.get_data(as_text=True)
+
+
+def test_metrics_answer_304_until_a_check_in(app_module, admin):
+    first = admin.get("/api/staff/metrics")
+    assert first.status_code == 200 and first.get_json()["ok"]
+    etag = first.headers["ETag"]
+    assert admin.get("/api/staff/metrics", headers={"If-None-Match": etag}).status_code == 304
+
+    _check_in(app_module, "feedetag")
+    changed = admin.get("/api/staff/metrics", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert any(item["name"] == "Feedetag" for item in changed.get_json()["recent"])
+
+
+def test_stream_resumes_without_a_snapshot(app_module, admin):
+    _check_in(app_module, "feedfirst")
+    status, body = _stream(admin)
+    assert status == 200
+    assert "event: snapshot" in body
+    high_id = app_module.CHECKIN_COUNTERS.high_id
+    assert f"id: {high_id}\n" in body
+
+    # Nothing new: the reconnect gets no snapshot and no events
+    status, body = _stream(admin, **{"Last-Event-ID": str(high_id)})
+    assert status == 200
+    assert "event:" not in body
+
+    _check_in(app_module, "feedsecond")
+    status, body = _stream(admin, **{"Last-Event-ID": str(high_id)})
+    assert "event: snapshot" not in body
+    assert body.count("event: checkin") == 1
+    assert f"id: {app_module.CHECKIN_COUNTERS.high_id}\n" in body
+
+
+def test_unknown_event_id_gets_a_snapshot(app_module, admin):
+    status, body = _stream(admin, **{"Last-Event-ID": "-1"})
+    assert "event: snapshot" in body
+    status, body = _stream(admin, **{"Last-Event-ID": "not-a-number"})
+    assert "event: snapshot" in body
+
+
+def test_stream_over_the_cap_is_204_and_slots_are_released(app_module, admin):
+    slots = app_module.SSE_MAX_STREAMS
+    assert slots >= 1
+    for _ in range(slots):
+        assert app_module._SSE_SLOTS.acquire(blocking=False)
+    try:
+        assert _stream(admin)[0] == 204
+    finally:
+        for _ in range(slots):
+            app_module._SSE_SLOTS.release()
+    # Every stream above gave its slot back when it closed
+    assert _stream(admin)[0] == 200
@@ -0,0 +1,70 @@
+import sqlite3
+from types import SimpleNamespace
+
+from stripe_customers import StripeCustomers
+from ttl_cache import TTLCache
+
+
+class FakeCustomers:
+    """Stripe's Customer.create with idempotency: a reused key must carry identical params."""
+
+    def __init__(self):
+        self.by_key = {}
+        self.calls = []
+        self.details = {}
+
+    def create(self, idempotency_key=None, **params):
+        self.calls.append(params)
+        if idempotency_key in self.by_key:
+            stored_params, customer = self.by_key[idempotency_key]
+            if stored_params != params:
+                raise RuntimeError("IdempotencyError: keys for idempotent requests can only be used with the same parameters")
+            return customer
+        customer = SimpleNamespace(id=f"cus_{len(self.by_key) + 1}")
+        self.by_key[idempotency_key] = (params, customer)
+        return customer
+
+    def modify(self, customer_id, **params):
+        self.details.setdefault(customer_id, {}).update(params)
+
+
+def _customers(tmp_path):
+    path = str(tmp_path / "members.sqlite3")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE IF NOT EXISTS members (id INTEGER PRIMARY KEY, email_lower TEXT, stripe_customer_id TEXT, updated_at TEXT)")
+    con.commit()
+    con.close()
+
+    def connect():
+        c = sqlite3.connect(path)
+        c.row_factory = sqlite3.Row
+        return c
+
+    return StripeCustomers(connect, postgres=False, cache=TTLCache(max_entries=16, ttl_seconds=60))
+
+
+def test_retry_with_different_email_casing_reuses_the_customer(tmp_path):
+    stripe = SimpleNamespace(Customer=FakeCustomers())
+    first = _customers(tmp_path)
+    # Another worker (empty cache) handles the retry
+    second = _customers(tmp_path)
+
+    customer_id, created = first.resolve(stripe, "pat@example.com", name="Pat Lee", email="Pat@Example.com")
+    retry_id, _ = second.resolve(stripe, "pat@example.com", name="Pat Lee", email="PAT@example.com")
+
+    assert created
+    assert retry_id == customer_id
+    assert [call["email"] for call in stripe.Customer.calls] == ["pat@example.com", "pat@example.com"]
+
+
+def test_retry_with_corrected_details_reuses_the_customer(tmp_path):
+    stripe = SimpleNamespace(Customer=FakeCustomers())
+    first = _customers(tmp_path)
+    second = _customers(tmp_path)
+
+    customer_id, _ = first.resolve(stripe, "sam@example.com", name="Sam Smtih", phone="+15550100")
+    retry_id, _ = second.resolve(stripe, "sam@example.com", name="Sam Smith", phone="+15550199")
+
+    assert retry_id == customer_id
+    assert len(stripe.Customer.by_key) == 1
+    assert stripe.Customer.details[customer_id] == {"name": "Sam Smith", "phone": "+15550199"}
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+from webhook_inbox import WebhookInbox
+
+
+def _inbox(tmp_path, handlers, **kwargs):
+    path = str(tmp_path / "inbox.sqlite3")
+    con = sqlite3.connect(path)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT NOT NULL, event_id TEXT NOT NULL,
+            event_type TEXT NOT NULL, payload TEXT NOT NULL, base_url TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,
+            last_error TEXT, received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_at TIMESTAMP,
+            UNIQUE (provider, event_id)
+        )
+        """
+    )
+    con.commit()
+    con.close()
+
+    def connect():
+        c = sqlite3.connect(path)
+        c.row_factory = sqlite3.Row
+        return c
+
+    return WebhookInbox(connect, postgres=False, handlers=handlers, **kwargs)
+
+
+def _record(inbox, event_id, event_type="checkout.session.completed", **data):
+    payload = json.dumps({"id": event_id, "type": event_type, "data": data}).encode("utf-8")
+    return inbox.record("stripe", event_id, event_type, payload, "https://gym.example.com")
+
+
+def test_redelivered_events_are_stored_and_handled_once(tmp_path):
+    handled = []
+    inbox = _inbox(tmp_path, {"checkout.session.completed": lambda event, base_url: handled.append((event["id"], base_url))})
+
+    assert _record(inbox, "evt_1")
+    assert not _record(inbox, "evt_1")
+    assert _record(inbox, "evt_2", event_type="customer.created")
+
+    assert inbox.process_due() == 2
+    assert handled == [("evt_1", "https://gym.example.com")]
+    stats = inbox.stats()
+    assert (stats["pending"], stats["processed"], stats["ignored"]) == (0, 1, 1)
+    assert inbox.process_due() == 0
+
+
+def test_failing_handlers_back_off_then_go_to_dead_letters(tmp_path):
+    calls = []
+
+    def handler(event, base_url):
+        calls.append(event["id"])
+        if len(calls) < 4:
+            raise RuntimeError("member upsert failed")
+
+    inbox = _inbox(tmp_path, {"checkout.session.completed": handler}, max_attempts=2, backoff_seconds=0)
+    _record(inbox, "evt_flaky")
+
+    assert inbox.process_due() == 1
+    assert inbox.stats()["pending"] == 1
+    assert inbox.process_due() == 1
+    dead = inbox.dead_letters()
+    assert [(d["event_id"], d["attempts"]) for d in dead] == [("evt_flaky", 2)]
+    assert dead[0]["last_error"] == "RuntimeError: member upsert failed"
+    assert inbox.process_due() == 0
+
+    # Retried with a fresh attempt budget: one more failure, then it goes through
+    assert inbox.retry([dead[0]["id"]]) == 1
+    assert inbox.process_due() == 1
+    assert inbox.process_due() == 1
+    assert calls == ["evt_flaky"] * 4
+    stats = inbox.stats()
+    assert (stats["processed"], stats["dead"], stats["worker"]["retried"], stats["worker"]["dead"]) == (1, 0, 2, 1)
+
+
+def test_retries_wait_for_the_backoff(tmp_path):
+    def handler(event, base_url):
+        raise RuntimeError("down")
+
+    inbox = _inbox(tmp_path, {"checkout.session.completed": handler}, backoff_seconds=60)
+    _record(inbox, "evt_later")
+    assert inbox.process_due() == 1
+    assert inbox.process_due() == 0
+    assert inbox.stats()["pending"] == 1
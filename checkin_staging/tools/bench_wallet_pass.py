@@ -0,0 +1,98 @@
+"""Per-pass build time of wallet_pass.build_member_wallet_pass, cold vs cached signer.
+
+Generates a throwaway 2048-bit signing key, self-signed certificate and WWDR stand-in, exports them
+as the APPLE_* env vars (the PKCS#12 bundle encrypted with a passphrase, like the real one), then
+times ``--builds`` passes twice:
+
+- cold: the signer and image digests are dropped before every build, which is what each pass cost
+  before they were cached (base64 decode, PKCS#12 parse, SHA1 of every image);
+- cached: the process-wide signer and digests are reused, so only pass.json is hashed and signed.
+
+Usage: python tools/bench_wallet_pass.py [--builds 200]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import wallet_pass  # noqa: E402
+
+
+def _self_signed(common_name: str, key) -> x509.Certificate:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.utcnow()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+
+
+def configure_test_signer(passphrase: str = "bench-passphrase") -> None:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    cert = _self_signed("Pass Type ID: pass.bench.checkin", key)
+    wwdr_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    wwdr = _self_signed("Bench WWDR", wwdr_key)
+    bundle = pkcs12.serialize_key_and_certificates(
+        b"bench", key, cert, None, serialization.BestAvailableEncryption(passphrase.encode())
+    )
+    os.environ.update({
+        wallet_pass.PASS_CERT_ENV: base64.b64encode(bundle).decode("ascii"),
+        wallet_pass.PASS_WWDR_ENV: base64.b64encode(wwdr.public_bytes(serialization.Encoding.DER)).decode("ascii"),
+        wallet_pass.PASS_KEY_PASSPHRASE_ENV: passphrase,
+        wallet_pass.PASS_TEAM_ID_ENV: "BENCHTEAM1",
+        wallet_pass.PASS_TYPE_ID_ENV: "pass.bench.checkin",
+    })
+
+
+def _time_builds(builds: int, cold: bool) -> list[float]:
+    member = {"id": 42, "name": "Bench Member", "membership_tier": "elite", "email_lower": "bench@example.com"}
+    timings = []
+    for i in range(builds):
+        if cold:
+            wallet_pass._SIGNER = None
+            wallet_pass._ASSETS = None
+            wallet_pass._ASSET_DIGESTS = None
+        start = time.perf_counter()
+        wallet_pass.build_member_wallet_pass(member, f"bench-token-{i:06d}", "https://checkin.example.com")
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _summary(label: str, timings: list[float]) -> str:
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"{label:7s} median {statistics.median(ordered):7.2f} ms, p95 {p95:7.2f} ms ({len(ordered)} builds)"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--builds", type=int, default=200)
+    args = parser.parse_args()
+    configure_test_signer()
+    _time_builds(3, cold=False)  # warm imports and OpenSSL
+    print(_summary("cold", _time_builds(args.builds, cold=True)))
+    print(_summary("cached", _time_builds(args.builds, cold=False)))
+
+
+if __name__ == "__main__":
+    main()